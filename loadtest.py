@@ -0,0 +1,339 @@
+"""Asyncio load generator for the Flight Map server.
+
+Replays a map/kiosk client mix against the serving endpoints and reports
+latency percentiles, throughput and error rates per endpoint. With ``--local``
+a throwaway server is started on synthetic data with the external feeds
+(OpenSky, OurAirports, OpenFlights) stubbed, so no network access is needed.
+
+    python loadtest.py --local --clients 50 --duration 30 --ingest 5
+    python loadtest.py --url http://localhost:8000 --clients 20
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+# Client behaviours and their relative weights: a page opening, the periodic
+# plane/info refresh, a burst of plane reloads after panning, and an admin
+# looking at the data files.
+SCENARIOS = {
+    "initial_load": 1,
+    "poll": 6,
+    "moveend_burst": 3,
+    "admin": 1,
+}
+
+
+class Stats:
+    """Latency samples and error counts per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, name: str, seconds: float, ok: bool):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self) -> Dict[str, dict]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rows = {}
+        all_samples = []
+        for name, samples in sorted(self.latencies.items()):
+            rows[name] = summarize(samples, self.errors.get(name, 0), elapsed)
+            all_samples.extend(samples)
+        rows["total"] = summarize(all_samples, sum(self.errors.values()), elapsed)
+        return rows
+
+
+def percentile(sorted_samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "rps": count / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+    }
+
+
+def format_report(rows: Dict[str, dict]) -> str:
+    header = f"{'endpoint':<28}{'reqs':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err %':>8}"
+    lines = [header, "-" * len(header)]
+    for name, r in rows.items():
+        lines.append(
+            f"{name:<28}{r['requests']:>8}{r['rps']:>9.1f}{r['p50_ms']:>10.1f}"
+            f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['error_rate'] * 100:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+async def timed(client: httpx.AsyncClient, stats: Stats, method: str, path: str, name: str = None):
+    start = time.perf_counter()
+    try:
+        resp = await client.request(method, path)
+        ok = resp.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    stats.record(name or f"{method} {path}", time.perf_counter() - start, ok)
+
+
+async def run_scenario(client: httpx.AsyncClient, stats: Stats, scenario: str):
+    if scenario == "initial_load":
+        await asyncio.gather(
+            timed(client, stats, "GET", "/airports.json"),
+            timed(client, stats, "GET", "/info"),
+        )
+        await timed(client, stats, "GET", "/active-planes")
+    elif scenario == "poll":
+        await timed(client, stats, "GET", "/active-planes")
+        await timed(client, stats, "GET", "/info")
+    elif scenario == "moveend_burst":
+        for _ in range(random.randint(3, 6)):
+            await timed(client, stats, "GET", "/active-planes")
+            await asyncio.sleep(random.uniform(0.05, 0.2))
+    elif scenario == "admin":
+        await timed(client, stats, "GET", "/admin/files")
+
+
+async def virtual_client(client: httpx.AsyncClient, stats: Stats, deadline: float, think: float):
+    names = list(SCENARIOS)
+    weights = list(SCENARIOS.values())
+    while time.perf_counter() < deadline:
+        await run_scenario(client, stats, random.choices(names, weights)[0])
+        await asyncio.sleep(random.uniform(0, think))
+
+
+async def ingestion_loop(client: httpx.AsyncClient, stats: Stats, deadline: float, interval: float):
+    while time.perf_counter() < deadline:
+        await timed(client, stats, "POST", "/update-routes")
+        await asyncio.sleep(interval)
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    clients: int = 10,
+    duration: float = 10.0,
+    think: float = 1.0,
+    ingest_interval: float = None,
+) -> Stats:
+    """Drive ``clients`` virtual users (plus optional ingestion) for ``duration`` seconds."""
+    stats = Stats()
+    deadline = time.perf_counter() + duration
+    tasks = [virtual_client(client, stats, deadline, think) for _ in range(clients)]
+    if ingest_interval is not None:
+        tasks.append(ingestion_loop(client, stats, deadline, ingest_interval))
+    await asyncio.gather(*tasks)
+    stats.finished = time.perf_counter()
+    return stats
+
+
+# --- Synthetic data and stubbed feeds --------------------------------------
+
+
+def synthetic_airports(count: int, seed: int = 1) -> List[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "code": f"A{i:04d}",
+            "name": f"Airport {i}",
+            "lat": round(rng.uniform(36, 70), 4),
+            "lon": round(rng.uniform(-10, 40), 4),
+            "continent": "EU",
+            "country_code": "XX",
+            "country": "Synthetic",
+        }
+        for i in range(count)
+    ]
+
+
+class FakeResponse:
+    def __init__(self, text: str = "", data=None):
+        self.text = text
+        self._data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        return None
+
+
+class FakeFeeds:
+    """Stands in for ``requests.get`` with deterministic synthetic feeds.
+
+    Planes take off from random airports, fly towards another one and drop out
+    of the feed on arrival, so ingestion keeps creating and finishing routes.
+    """
+
+    def __init__(self, airports: List[dict], planes: int, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.airports = airports
+        self.planes = {}
+        for i in range(planes):
+            self._spawn(f"{i:06x}")
+        self.time = int(time.time())
+
+    def _spawn(self, icao24: str):
+        src, dest = self.rng.sample(self.airports, 2)
+        self.planes[icao24] = {
+            "callsign": f"{self.rng.choice(['AB', 'CD', 'EF', 'GH'])}{self.rng.randint(1, 999)}",
+            "pos": [src["lat"], src["lon"]],
+            "dest": dest,
+            "steps": self.rng.randint(2, 6),
+        }
+
+    def _advance(self):
+        self.time += 10
+        states = []
+        for icao24, p in list(self.planes.items()):
+            if p["steps"] == 0:
+                del self.planes[icao24]
+                self._spawn(f"{self.rng.getrandbits(24):06x}")
+                continue
+            dest = p["dest"]
+            p["pos"][0] += (dest["lat"] - p["pos"][0]) / p["steps"]
+            p["pos"][1] += (dest["lon"] - p["pos"][1]) / p["steps"]
+            p["steps"] -= 1
+            states.append([icao24, p["callsign"], "XX", self.time, self.time, p["pos"][1], p["pos"][0]])
+        return {"time": self.time, "states": states}
+
+    def __call__(self, url, *args, **kwargs):
+        if "opensky" in url:
+            return FakeResponse(data=self._advance())
+        if "airports.csv" in url:
+            rows = ["id,ident,type,name,latitude_deg,longitude_deg,elevation_ft,continent,"
+                    "iso_country,iso_region,municipality,scheduled_service,icao_code,"
+                    "iata_code,gps_code,local_code,home_link,wikipedia_link,keywords"]
+            for i, a in enumerate(self.airports):
+                rows.append(f"{i},{a['code']},large_airport,{a['name']},{a['lat']},{a['lon']},,EU,"
+                            f"XX,XX-1,City,yes,{a['code']},,{a['code']},,,,")
+            return FakeResponse(text="\n".join(rows))
+        if "countries.csv" in url:
+            return FakeResponse(text="id,code,name,continent,wikipedia_link,keywords\n1,XX,Synthetic,EU,,")
+        if "airlines.dat" in url:
+            return FakeResponse(text="\n".join(
+                f'{i},Airline {c},\\N,{c},{c}X,CALL,Country,Y' for i, c in enumerate(["AB", "CD", "EF", "GH"])
+            ))
+        raise RuntimeError(f"unexpected request to {url}")
+
+
+def prepare_data(data_dir: Path, airports: int, planes: int):
+    """Install stubbed feeds and materialize a synthetic dataset in ``data_dir``."""
+    os.environ["DATA_DIR"] = str(data_dir)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import server
+
+    server.requests.get = FakeFeeds(synthetic_airports(airports), planes)
+    server.save_config({"airport_continents": ["EU"], "flight_continents": ["EU"]})
+    server.write_json(server.AIRPORTS_FULL_PATH, synthetic_airports(airports))
+    for _ in range(3):
+        server.update_routes()
+    return server
+
+
+def serve(args):
+    """Run a stubbed server on synthetic data (used by ``--local``)."""
+    import uvicorn
+
+    os.chdir(Path(__file__).resolve().parent)
+    server = prepare_data(Path(args.data_dir), args.airports, args.planes)
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+async def wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/info")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"server at {url} did not become ready")
+
+
+async def main_async(args) -> Dict[str, dict]:
+    url = args.url
+    proc = None
+    tmp = None
+    if args.local:
+        tmp = tempfile.TemporaryDirectory()
+        url = f"http://127.0.0.1:{args.port}"
+        proc = subprocess.Popen([
+            sys.executable, __file__, "--serve",
+            "--data-dir", tmp.name, "--port", str(args.port),
+            "--airports", str(args.airports), "--planes", str(args.planes),
+        ])
+    try:
+        await wait_ready(url)
+        limits = httpx.Limits(max_connections=args.clients + 1)
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            stats = await run_load(client, args.clients, args.duration, args.think, args.ingest)
+        return stats.report()
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+        if tmp:
+            tmp.cleanup()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="server to test")
+    parser.add_argument("--local", action="store_true", help="start a stubbed server on synthetic data")
+    parser.add_argument("--port", type=int, default=8765, help="port for the --local server")
+    parser.add_argument("--airports", type=int, default=2000, help="synthetic airports for --local")
+    parser.add_argument("--planes", type=int, default=3000, help="synthetic planes for --local")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="test length in seconds")
+    parser.add_argument("--think", type=float, default=1.0, help="max pause between client actions")
+    parser.add_argument("--ingest", type=float, default=None, metavar="SECONDS",
+                        help="also run /update-routes with this pause between runs")
+    parser.add_argument("--timeout", type=float, default=30.0, help="request timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args)
+        return
+    rows = asyncio.run(main_async(args))
+    print(json.dumps(rows, indent=2) if args.json else format_report(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -30,8 +30,6 @@ const colorPalette = [
   '#000075', '#808080'
 ];
 
-const airlineNameToCode = {};
-
 const planeIcon = L.icon({
   iconUrl: 'plane.svg',
   iconSize: [8, 8],
@@ -41,6 +39,181 @@ const planeIcon = L.icon({
 const statsEl = document.getElementById('stats');
 let infoStats = {};
 
+// Opt-in renderer (?renderer=canvas) drawing airports and planes into one
+// canvas instead of one DOM/SVG element per marker.
+const useCanvas = new URLSearchParams(window.location.search).get('renderer') === 'canvas';
+const routesRenderer = useCanvas ? L.canvas({ pane: 'routes' }) : undefined;
+const planeImage = new Image();
+planeImage.src = 'plane.svg';
+
+const PointCanvasLayer = L.Layer.extend({
+  initialize(options) {
+    L.setOptions(this, options);
+    this.airports = [];
+    this.planes = [];
+    this._frame = null;
+    this._cells = new Map();
+    this._cellSize = 32;
+  },
+
+  onAdd(map) {
+    this._canvas = L.DomUtil.create('canvas', 'leaflet-zoom-hide');
+    this._canvas.style.pointerEvents = 'none';
+    map.getPanes().overlayPane.appendChild(this._canvas);
+    this._tooltip = L.tooltip({ direction: 'top', offset: [0, -6] });
+    map.on('move zoom resize', this.redraw, this);
+    map.on('mousemove', this._onMouseMove, this);
+    map.on('click', this._onClick, this);
+    this.redraw();
+  },
+
+  onRemove(map) {
+    map.off('move zoom resize', this.redraw, this);
+    map.off('mousemove', this._onMouseMove, this);
+    map.off('click', this._onClick, this);
+    map.closeTooltip(this._tooltip);
+    L.DomUtil.remove(this._canvas);
+  },
+
+  redraw() {
+    if (this._map && !this._frame) {
+      this._frame = L.Util.requestAnimFrame(this._draw, this);
+    }
+    return this;
+  },
+
+  _draw() {
+    this._frame = null;
+    const map = this._map;
+    if (!map) return;
+    const size = map.getSize();
+    const ratio = window.devicePixelRatio || 1;
+    const canvas = this._canvas;
+    canvas.width = size.x * ratio;
+    canvas.height = size.y * ratio;
+    canvas.style.width = `${size.x}px`;
+    canvas.style.height = `${size.y}px`;
+    L.DomUtil.setPosition(canvas, map.containerPointToLayerPoint([0, 0]));
+    const ctx = canvas.getContext('2d');
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    this._cells.clear();
+
+    // All airports share one style, so batch them into a single path
+    ctx.beginPath();
+    this.airports.forEach(item => {
+      if (!item.visible) return;
+      const p = this._project(item, size);
+      if (!p) return;
+      ctx.moveTo(p.x + item.radius, p.y);
+      ctx.arc(p.x, p.y, item.radius, 0, Math.PI * 2);
+      this._index(item, p);
+    });
+    ctx.fillStyle = '#3388ff';
+    ctx.fill();
+    ctx.lineWidth = 1;
+    ctx.strokeStyle = 'black';
+    ctx.stroke();
+
+    this.planes.forEach(item => {
+      const p = this._project(item, size);
+      if (!p) return;
+      ctx.drawImage(planeImage, p.x - 4, p.y - 4, 8, 8);
+      this._index(item, p);
+    });
+  },
+
+  _project(item, size) {
+    const p = this._map.latLngToContainerPoint([item.lat, item.lon]);
+    const r = item.radius;
+    if (p.x < -r || p.y < -r || p.x > size.x + r || p.y > size.y + r) return null;
+    return p;
+  },
+
+  // Spatial hash of drawn items in screen space used for hit-testing
+  _index(item, p) {
+    item.x = p.x;
+    item.y = p.y;
+    const cs = this._cellSize;
+    for (let cx = Math.floor((p.x - item.radius) / cs); cx <= Math.floor((p.x + item.radius) / cs); cx++) {
+      for (let cy = Math.floor((p.y - item.radius) / cs); cy <= Math.floor((p.y + item.radius) / cs); cy++) {
+        const key = cx * 65536 + cy;
+        if (!this._cells.has(key)) this._cells.set(key, []);
+        this._cells.get(key).push(item);
+      }
+    }
+  },
+
+  hitTest(point) {
+    const cs = this._cellSize;
+    const items = this._cells.get(Math.floor(point.x / cs) * 65536 + Math.floor(point.y / cs)) || [];
+    // Later items are drawn on top, so search from the end
+    for (let i = items.length - 1; i >= 0; i--) {
+      const item = items[i];
+      const dx = item.x - point.x;
+      const dy = item.y - point.y;
+      if (dx * dx + dy * dy <= (item.radius + 1) * (item.radius + 1)) return item;
+    }
+    return null;
+  },
+
+  _onMouseMove(e) {
+    const item = this.hitTest(e.containerPoint);
+    this._map.getContainer().style.cursor = item ? 'pointer' : '';
+    if (item) {
+      this._tooltip.setLatLng([item.lat, item.lon]).setContent(item.tooltip);
+      this._map.openTooltip(this._tooltip);
+    } else {
+      this._map.closeTooltip(this._tooltip);
+    }
+  },
+
+  _onClick(e) {
+    const item = this.hitTest(e.containerPoint);
+    if (item && item.onClick) item.onClick();
+  },
+});
+
+const pointLayer = useCanvas ? new PointCanvasLayer().addTo(map) : null;
+
+// Canvas-backed stand-in for L.circleMarker exposing the calls used below
+function createCanvasMarker(a, lat, lon) {
+  const item = {
+    lat,
+    lon,
+    radius: minRadius,
+    visible: true,
+    tooltip: `${a.name} (${a.code})`,
+    setRadius(r) {
+      this.radius = r;
+      pointLayer.redraw();
+    },
+  };
+  pointLayer.airports.push(item);
+  return item;
+}
+
+function isMarkerShown(m) {
+  return useCanvas ? m.visible : map.hasLayer(m);
+}
+
+function showMarker(m) {
+  if (useCanvas) {
+    m.visible = true;
+    pointLayer.redraw();
+  } else {
+    m.addTo(map);
+  }
+}
+
+function hideMarker(m) {
+  if (useCanvas) {
+    m.visible = false;
+    pointLayer.redraw();
+  } else {
+    map.removeLayer(m);
+  }
+}
+
 function getAirlineColor(code) {
   if (!airlineColors[code]) {
     const idx = Object.keys(airlineColors).length % colorPalette.length;
@@ -50,6 +223,44 @@ function getAirlineColor(code) {
 }
 let airportsData = [];
 
+// Great-circle route geometry from the server, keyed by airport code and then
+// by the code at the other end of the route. Geometry is prefetched in batches
+// for the airports in view so clicking an airport never waits on the network.
+const routeGeometry = new Map();
+const pendingGeometry = new Map();
+const GEOMETRY_BATCH = 100; // the server's per-request airport limit
+
+function fetchGeometryBatch(codes) {
+  const params = new URLSearchParams();
+  codes.forEach(c => params.append('airport', c));
+  const request = fetch(`routes/geometry?${params}`)
+    .then(r => (r.ok ? r.json() : {}))
+    .catch(() => ({}))
+    .then(data => {
+      codes.forEach(c => {
+        routeGeometry.set(c, (data && data[c]) || {});
+        pendingGeometry.delete(c);
+      });
+    });
+  codes.forEach(c => pendingGeometry.set(c, request));
+}
+
+function loadRouteGeometry(codes) {
+  const missing = codes.filter(c => !routeGeometry.has(c) && !pendingGeometry.has(c));
+  for (let i = 0; i < missing.length; i += GEOMETRY_BATCH) {
+    fetchGeometryBatch(missing.slice(i, i + GEOMETRY_BATCH));
+  }
+  const waiting = codes.filter(c => pendingGeometry.has(c)).map(c => pendingGeometry.get(c));
+  return Promise.all(waiting).then(() => {});
+}
+
+function prefetchVisibleGeometry() {
+  const bounds = map.getBounds();
+  loadRouteGeometry(
+    airportsData.filter(a => bounds.contains([a.lat, a.lon])).map(a => a.code)
+  );
+}
+
 function updatePathDisplay() {
   const parts = [];
   selectedRoutes.forEach((item, idx) => {
@@ -64,9 +275,10 @@ function updatePathDisplay() {
 }
 
 function updateStatsDisplay() {
-  const visibleAirports = markers.filter(m => map.hasLayer(m.marker)).length;
+  const visibleAirports = markers.filter(m => isMarkerShown(m.marker)).length;
   const totalAirports = infoStats.active_airports || airportsData.length || 0;
-  const visiblePlanes = planeToggle.checked ? activeFlightMarkers.size : 0;
+  const planeCount = useCanvas ? pointLayer.planes.length : activeFlightMarkers.size;
+  const visiblePlanes = planeToggle.checked ? planeCount : 0;
   const totalPlanes = infoStats.active_planes || 0;
   const routes = infoStats.routes || 0;
   const added = infoStats.recovered_last_hour || 0;
@@ -77,19 +289,27 @@ function updateStatsDisplay() {
     `<span style="color:red">-${removed}</span>)`;
 }
 
-function applyFilter() {
-  const airline = filterSelect.value;
-  // Get all selected country values from the default select
-  const selected = Array.from(countrySelect.options)
+// Route counts per airport for the selected airline and countries come from
+// the server's facet index instead of a scan over every airport's routes.
+function fetchFacets() {
+  const params = new URLSearchParams();
+  if (filterSelect.value) params.append('airline', filterSelect.value);
+  Array.from(countrySelect.options)
     .filter(o => o.selected && o.value)
-    .map(o => o.value);
-  const countries = selected;
+    .forEach(o => params.append('country', o.value));
+  return fetch(`facets?${params}`).then(r => r.json());
+}
+
+function applyFilter() {
+  fetchFacets().then(applyFacets);
+}
+
+function applyFacets(facets) {
+  const routeCounts = facets.airports || {};
   const counts = [];
   let maxRoutes = 0;
   markers.forEach(m => {
-    const inCountry = countries.length === 0 || countries.includes(m.airport.country_code);
-    const count = inCountry ?
-      m.airport.routes.filter(r => !airline || r.airline === airline).length : 0;
+    const count = routeCounts[m.airport.code] || 0;
     counts.push(count);
     if (count > maxRoutes) maxRoutes = count;
   });
@@ -103,14 +323,14 @@ function applyFilter() {
     m.setRadius(radius);
 
     if (show) {
-      if (!map.hasLayer(m)) {
-        m.addTo(map);
+      if (!isMarkerShown(m)) {
+        showMarker(m);
       }
     } else {
-      if (map.hasLayer(m)) {
+      if (isMarkerShown(m)) {
         m.routesLines.forEach(l => map.removeLayer(l));
         m.routesLines = [];
-        map.removeLayer(m);
+        hideMarker(m);
       }
     }
   });
@@ -140,16 +360,94 @@ function toggleRouteSelection(line, route) {
   updatePathDisplay();
 }
 
+function formatFlightInfo(f) {
+  const code = (f.callsign || '').trim() || `${f.airline || ''}${f.flight_number || ''}`;
+  let duration = '';
+  if (f.first_seen && f.last_updated) {
+    const first = Date.parse(f.first_seen);
+    const last = Date.parse(f.last_updated);
+    if (!isNaN(first) && !isNaN(last) && last >= first) {
+      const mins = Math.floor((last - first) / 60000);
+      const h = Math.floor(mins / 60);
+      const m = mins % 60;
+      duration = h ? `${h}h ${m}m` : `${m}m`;
+    }
+  }
+  return [code, f.airline, duration, f.origin_name || f.origin]
+    .filter(Boolean)
+    .join(', ');
+}
+
+// Flown path of the selected plane; clicking a plane replaces it
+let trailLine = null;
+
+function showTrail(icao24) {
+  fetch(`active-planes/${encodeURIComponent(icao24)}/trail`)
+    .then(r => (r.ok ? r.json() : { trail: [] }))
+    .then(data => {
+      if (trailLine) map.removeLayer(trailLine);
+      trailLine = L.polyline(data.trail || [], {
+        color: '#911eb4',
+        weight: 2,
+        dashArray: '4 4',
+        renderer: routesRenderer,
+      }).addTo(map);
+    });
+}
+
+// Planes for the canvas renderer come packed as uint32 count, float32
+// [lat, lon] pairs and a JSON array of per-plane details.
+function loadActiveFlightsPacked() {
+  fetch('active-planes.bin')
+    .then(r => r.arrayBuffer())
+    .then(buf => {
+      const count = new DataView(buf).getUint32(0, true);
+      const coords = new Float32Array(buf, 4, count * 2);
+      const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4 + count * 8)));
+      const bounds = map.getBounds();
+      const filterCode = filterSelect.value;
+      const planes = [];
+      for (let i = 0; i < count; i++) {
+        const [icao24, callsign, airline, flightNumber, origin, firstSeen, lastUpdated] = meta[i];
+        if (filterCode && airline !== filterCode) continue;
+        const lat = coords[2 * i];
+        const lon = coords[2 * i + 1];
+        if (!bounds.contains([lat, lon])) continue;
+        planes.push({
+          icao24,
+          lat,
+          lon,
+          radius: 4,
+          onClick: () => showTrail(icao24),
+          tooltip: formatFlightInfo({
+            callsign,
+            airline,
+            flight_number: flightNumber,
+            origin_name: origin,
+            first_seen: firstSeen,
+            last_updated: lastUpdated,
+          }),
+        });
+      }
+      pointLayer.planes = planes;
+      pointLayer.redraw();
+      updateStatsDisplay();
+    });
+}
+
 function loadActiveFlights() {
+  if (useCanvas) {
+    loadActiveFlightsPacked();
+    return;
+  }
   fetch('active-planes')
     .then(r => r.json())
     .then(data => {
       const seen = new Set();
       const bounds = map.getBounds();
-      const airlineFilter = filterSelect.value;
-      const filterCode = airlineNameToCode[airlineFilter] || airlineFilter;
+      const filterCode = filterSelect.value;
       Object.entries(data || {}).forEach(([icao24, f]) => {
-        if (airlineFilter && f.airline !== filterCode) return;
+        if (filterCode && f.airline !== filterCode) return;
         if (!Array.isArray(f.last_coord)) return;
         const [lat, lon] = f.last_coord;
         if (lat == null || lon == null) return;
@@ -160,21 +458,7 @@ function loadActiveFlights() {
           }
           return;
         }
-        const code = (f.callsign || '').trim() || `${f.airline || ''}${f.flight_number || ''}`;
-        let duration = '';
-        if (f.first_seen && f.last_updated) {
-          const first = Date.parse(f.first_seen);
-          const last = Date.parse(f.last_updated);
-          if (!isNaN(first) && !isNaN(last) && last >= first) {
-            const mins = Math.floor((last - first) / 60000);
-            const h = Math.floor(mins / 60);
-            const m = mins % 60;
-            duration = h ? `${h}h ${m}m` : `${m}m`;
-          }
-        }
-        const info = [code, f.airline, duration, f.origin_name || f.origin]
-          .filter(Boolean)
-          .join(', ');
+        const info = formatFlightInfo(f);
         seen.add(icao24);
         if (activeFlightMarkers.has(icao24)) {
           const marker = activeFlightMarkers.get(icao24);
@@ -183,7 +467,8 @@ function loadActiveFlights() {
         } else {
           const marker = L.marker([lat, lon], { icon: planeIcon })
             .addTo(activeFlightsLayer)
-            .bindTooltip(info);
+            .bindTooltip(info)
+            .on('click', () => showTrail(icao24));
           activeFlightMarkers.set(icao24, marker);
         }
       });
@@ -197,6 +482,96 @@ function loadActiveFlights() {
     });
 }
 
+// History playback: the slider picks a minute within the last 24 hours and
+// recorded positions in view are drawn on their own canvas. Only one request
+// is in flight; moves made meanwhile are fetched once it completes.
+const historySlider = document.getElementById('history-slider');
+const historyTimeEl = document.getElementById('history-time');
+const historyRenderer = L.canvas();
+const historyLayer = L.layerGroup().addTo(map);
+let historyPending = false;
+let historyLoading = false;
+
+function loadHistory() {
+  const minutes = Number(historySlider.value);
+  if (minutes === 0) {
+    historyLayer.clearLayers();
+    historyTimeEl.textContent = 'Off';
+    return;
+  }
+  if (historyLoading) {
+    historyPending = true;
+    return;
+  }
+  historyLoading = true;
+  const at = Math.floor(Date.now() / 1000) + minutes * 60;
+  const params = new URLSearchParams({ at, bbox: map.getBounds().toBBoxString() });
+  fetch(`history/positions?${params}`)
+    .then(r => r.json())
+    .then(data => {
+      historyLayer.clearLayers();
+      (data.positions || []).forEach(([icao24, lat, lon]) => {
+        L.circleMarker([lat, lon], {
+          renderer: historyRenderer,
+          radius: 3,
+          color: '#f58231',
+          weight: 1,
+          fillOpacity: 0.8,
+        }).bindTooltip(icao24).addTo(historyLayer);
+      });
+      historyTimeEl.textContent = data.time
+        ? `${new Date(data.time).toLocaleString()} (${data.positions.length})`
+        : 'No data';
+    })
+    .finally(() => {
+      historyLoading = false;
+      if (historyPending) {
+        historyPending = false;
+        loadHistory();
+      }
+    });
+}
+
+historySlider.addEventListener('input', loadHistory);
+map.on('moveend', () => {
+  if (Number(historySlider.value) !== 0) {
+    loadHistory();
+  }
+});
+
+// Airport search: suggestions come from the server-side prefix index, so the
+// full airport list is not needed to find an airport.
+const airportSearch = document.getElementById('airport-search');
+const airportResults = document.getElementById('airport-results');
+const airportSuggestions = new Map();
+let airportSearchTimer = null;
+
+airportSearch.addEventListener('input', () => {
+  const chosen = airportSuggestions.get(airportSearch.value);
+  if (chosen) {
+    map.setView([chosen.lat, chosen.lon], 9);
+    return;
+  }
+  clearTimeout(airportSearchTimer);
+  airportSearchTimer = setTimeout(() => {
+    const q = airportSearch.value.trim();
+    if (!q) return;
+    fetch(`airports/search?${new URLSearchParams({ q, limit: 10 })}`)
+      .then(r => r.json())
+      .then(data => {
+        airportSuggestions.clear();
+        airportResults.innerHTML = '';
+        (data.results || []).forEach(a => {
+          const label = `${a.code} – ${a.name}${a.municipality ? `, ${a.municipality}` : ''}`;
+          airportSuggestions.set(label, a);
+          const option = document.createElement('option');
+          option.value = label;
+          airportResults.appendChild(option);
+        });
+      });
+  }, 150);
+});
+
 filterSelect.addEventListener('change', applyFilter);
 resetAirlineBtn.addEventListener('click', () => {
   filterSelect.value = '';
@@ -221,6 +596,14 @@ planeToggle.addEventListener('change', () => {
     activeFlightMarkers.forEach(m => activeFlightsLayer.removeLayer(m));
     activeFlightMarkers.clear();
     map.removeLayer(activeFlightsLayer);
+    if (trailLine) {
+      map.removeLayer(trailLine);
+      trailLine = null;
+    }
+    if (useCanvas) {
+      pointLayer.planes = [];
+      pointLayer.redraw();
+    }
   }
   updateStatsDisplay();
 });
@@ -249,31 +632,28 @@ fetch('airports.json')
   .then(data => {
     if (!Array.isArray(data)) data = [];
     airportsData = data.filter(a => a.routes && a.routes.length);
-    const airlinesSet = new Set();
-    const countriesMap = new Map();
-
-    airportsData.forEach(a => {
-      a.routes.forEach(r => {
-        airlinesSet.add(r.airline);
-        if (r.airline && r.airline_code) {
-          airlineNameToCode[r.airline] = r.airline_code;
-        }
-      });
-      countriesMap.set(a.country_code, a.country);
-
-      const marker = L.circleMarker([a.lat, a.lon], {
-        radius: minRadius,
-        color: 'black',
-        weight: 1,
-        fillColor: '#3388ff',
-        fillOpacity: 1,
-      })
-        .addTo(map)
-        .bindTooltip(`${a.name} (${a.code})`);
+
+    data.forEach(a => {
+      if (!(a.routes && a.routes.length)) return;
+
+      let marker;
+      if (useCanvas) {
+        marker = createCanvasMarker(a, a.lat, a.lon);
+      } else {
+        marker = L.circleMarker([a.lat, a.lon], {
+          radius: minRadius,
+          color: 'black',
+          weight: 1,
+          fillColor: '#3388ff',
+          fillOpacity: 1,
+        })
+          .addTo(map)
+          .bindTooltip(`${a.name} (${a.code})`);
+      }
       marker.routesLines = [];
       marker.airport = a;
       markers.push({ marker, airport: a });
-      marker.on('click', () => {
+      const onClick = () => {
         if (marker.routesLines.length) {
           marker.routesLines.forEach(l => {
             map.removeLayer(l);
@@ -283,48 +663,60 @@ fetch('airports.json')
           marker.routesLines = [];
           updatePathDisplay();
         } else if (a.routes) {
-          const airlineFilter = filterSelect.value;
-          a.routes.forEach(route => {
-            if (airlineFilter && route.airline !== airlineFilter) {
-              return;
-            }
-          const color = getAirlineColor(route.airline);
-          const line = L.polyline(
-            [route.from, route.to],
-            { color, pane: 'routes' }
-          )
-            .addTo(map)
-            .bindTooltip(`${route.from_name} - ${route.airline} - ${route.to_name}`);
-          line.route = route;
-          line.originalColor = color;
-          line.on('click', e => {
-            toggleRouteSelection(line, route);
-            L.DomEvent.stopPropagation(e);
-          });
-            marker.routesLines.push(line);
+          loadRouteGeometry([a.code]).then(() => {
+            if (marker.routesLines.length) return;
+            const geometry = routeGeometry.get(a.code) || {};
+            const airlineFilter = filterSelect.value;
+            a.routes.forEach(route => {
+              if (airlineFilter && route.airline_code !== airlineFilter) {
+                return;
+              }
+              const color = getAirlineColor(route.airline);
+              const line = L.polyline(
+                geometry[route.to_code] || [route.from, route.to],
+                { color, pane: 'routes', renderer: routesRenderer }
+              )
+                .addTo(map)
+                .bindTooltip(`${route.from_name} - ${route.airline} - ${route.to_name}`);
+              line.route = route;
+              line.originalColor = color;
+              line.on('click', e => {
+                toggleRouteSelection(line, route);
+                L.DomEvent.stopPropagation(e);
+              });
+              marker.routesLines.push(line);
+            });
           });
         }
-      });
+      };
+      if (useCanvas) {
+        marker.onClick = onClick;
+      } else {
+        marker.on('click', onClick);
+      }
     });
+    prefetchVisibleGeometry();
+    map.on('moveend', prefetchVisibleGeometry);
 
-    Array.from(airlinesSet).sort().forEach(code => {
+    return fetchFacets();
+  })
+  .then(facets => {
+    (facets.airlines || []).forEach(({ code, name }) => {
       const opt = document.createElement('option');
       opt.value = code;
-      opt.textContent = code;
+      opt.textContent = name;
       filterSelect.appendChild(opt);
     });
 
-    Array.from(countriesMap.entries())
-      .sort((a, b) => a[1].localeCompare(b[1]))
-      .forEach(([code, name]) => {
-        const opt = document.createElement('option');
-        opt.value = code;
-        opt.textContent = name;
-        countrySelect.appendChild(opt);
-      });
+    (facets.countries || []).forEach(({ code, name }) => {
+      const opt = document.createElement('option');
+      opt.value = code;
+      opt.textContent = name;
+      countrySelect.appendChild(opt);
+    });
 
     countrySelect.selectedIndex = -1;
-    applyFilter();
+    applyFacets(facets);
     if (planeToggle.checked) {
       activeFlightsLayer.addTo(map);
       planeIntervalId = setInterval(loadActiveFlights, planeUpdateInterval);
@@ -1,20 +1,41 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Body
+from fastapi import FastAPI, HTTPException, UploadFile, File, Body, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import uvicorn
 import os
 import csv
 import json
 import orjson
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from math import radians, cos, sin, asin, sqrt
 import re
+import logging
+import multiprocessing
+import socket
+import unicodedata
+import base64
+import hashlib
+import heapq
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+import struct
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import requests
+import numpy as np
 from scipy.spatial import cKDTree
 
 from typing import Dict, List
 
+logger = logging.getLogger(__name__)
+
 DATA_DIR = Path(os.environ.get("DATA_DIR", "public"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -26,9 +47,35 @@ ROUTES_DB_PATH = DATA_DIR / "routes_dynamic.json"
 ACTIVE_PLANES_PATH = DATA_DIR / "active_planes.json"
 STATS_PATH = DATA_DIR / "routes_stats.json"
 CONFIG_PATH = DATA_DIR / "config.json"
+ROUTE_FREQUENCY_PATH = DATA_DIR / "routes_frequency.json"
+ROUTE_GEOMETRY_PATH = DATA_DIR / "route_geometry.json"
+ROUTE_ANALYTICS_PATH = DATA_DIR / "route_analytics.json"
+# Airport, country and airline tables last downloaded by update_airports
+AIRPORT_TABLES_PATH = DATA_DIR / "airport_tables.json"
+# Hourly position history segments written on every ingestion
+HISTORY_DIR = DATA_DIR / "history"
+# Catalog of files produced by the server, kept next to the datasets so the
+# admin page can describe them without parsing each file.
+MANIFEST_NAME = "manifest.json"
 AIRLINES_URL = "https://raw.githubusercontent.com/jpatokal/openflights/master/data/airlines.dat"
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A streaming feed replaces polling; the ingestion poller (see
+    # _poll_loop) otherwise runs only when enabled
+    if FEED != "opensky" and FEED not in FEED_ADAPTERS:
+        raise ValueError(f"unknown FEED {FEED!r}; expected opensky or one of {sorted(FEED_ADAPTERS)}")
+    if FEED in FEED_ADAPTERS:
+        start_stream()
+    elif POLL_ENABLED:
+        POLL_STOP.clear()
+        threading.Thread(target=_poll_loop, name="poller", daemon=True).start()
+    yield
+    POLL_STOP.set()
+    stop_stream()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 CALLSIGN_RE = re.compile(r"^([A-Za-z]{2,3})")
@@ -37,11 +84,57 @@ CALLSIGN_RE = re.compile(r"^([A-Za-z]{2,3})")
 AIRPORTS_TREE = None
 AIRPORTS_INDEX = []
 AIRPORTS_MAP = {}
-AIRPORTS_LAT_RANGE = (None, None)
-AIRPORTS_LON_RANGE = (None, None)
+AIRPORTS_LOOKUP = None
+# Incremented whenever the lookup structures above are rebuilt
+AIRPORTS_VERSION = 0
+# (path, mtime_ns, size, continents) the index was last loaded from, and the
+# airport_identity of what it indexes
+AIRPORTS_SOURCE = None
+AIRPORTS_IDENTITY = None
+
+# Per-continent airport indexes used to shard ingestion. SHARD_GRID maps
+# SHARD_CELL_DEG cells to positions in SHARD_KEYS; with a single shard the
+# whole snapshot is processed inline.
+SHARD_INDEXES: Dict[str, "AirportIndex"] = {}
+SHARD_KEYS: List[str] = []
+SHARD_GRID = None
+SHARD_CELL_DEG = 1.0
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+SHARD_POOL = None
+SHARD_POOL_VERSION = None
 
 EARTH_RADIUS_KM = 6371.0
 
+# Matching radius per OurAirports airport ``type``; 0 keeps a type out of the
+# nearest-airport indexes. Airports without a known type use the "" entry.
+# Override with MATCH_RADIUS_KM, e.g. "small_airport=0,large_airport=50".
+MATCH_RADIUS_KM: Dict[str, float] = {
+    "large_airport": 40.0,
+    "medium_airport": 30.0,
+    "small_airport": 10.0,
+    "heliport": 0.0,
+    "seaplane_base": 0.0,
+    "balloonport": 0.0,
+    "closed": 0.0,
+    "": 30.0,
+}
+MATCH_RADIUS_KM.update(
+    (name.strip(), float(km))
+    for name, _, km in (
+        item.partition("=") for item in os.environ.get("MATCH_RADIUS_KM", "").split(",") if item
+    )
+)
+# Types matched first; the others only when none of these is in range
+PRIMARY_AIRPORT_TYPES = {"large_airport", "medium_airport", ""}
+
+# COVERAGE_CELL_DEG cells holding a point within COVERAGE_RADIUS_KM of an
+# indexed airport. Untracked states outside them are dropped before
+# processing, as no airport is close enough to match them; None (no
+# airports) keeps everything. The radius defaults to the widest match radius.
+COVERAGE_MASK = None
+COVERAGE_CELL_DEG = 0.25
+COVERAGE_RADIUS_KM = float(os.environ.get("COVERAGE_RADIUS_KM", max(MATCH_RADIUS_KM.values())))
+
 CONTINENTS: Dict[str, str] = {
     "AF": "Africa",
     "AN": "Antarctica",
@@ -58,19 +151,334 @@ DEFAULT_CONFIG = {
 }
 
 
-def load_json(path: Path, default):
-    """Load JSON using orjson with a fallback default."""
-    if not path.exists():
+# Bump when the on-disk layout of a dataset changes.
+SCHEMA_VERSIONS: Dict[str, int] = {
+    "airports.json": 1,
+    "airports_full.json": 1,
+    "routes_dynamic.json": 1,
+    "active_planes.json": 1,
+    "routes_stats.json": 1,
+    "config.json": 1,
+    "routes_frequency.json": 1,
+    "route_geometry.json": 1,
+    "route_analytics.json": 1,
+}
+
+# Expected shape of uploads replacing known datasets: container type and the
+# keys every record must have (None accepts any value).
+UPLOAD_SCHEMAS = {
+    "airports.json": ("list", ("code", "lat", "lon")),
+    "airports_full.json": ("list", ("code", "lat", "lon")),
+    "routes_dynamic.json": ("list", ("source", "destination")),
+    "active_planes.json": ("dict", ()),
+    "routes_stats.json": ("dict", None),
+    "config.json": ("dict", None),
+    "routes_frequency.json": ("dict", None),
+    "route_geometry.json": ("dict", None),
+    "route_analytics.json": ("dict", None),
+}
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 512 * 1024 * 1024))
+MAX_UPLOAD_RECORD_BYTES = 16 * 1024 * 1024
+
+MANIFEST_LOCK = threading.Lock()
+
+# Parsed JSON datasets keyed by path: (stat/generation key, value, weight).
+# Weight estimates the in-memory footprint from the file size.
+JSON_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+JSON_CACHE_LOCK = threading.Lock()
+JSON_CACHE_MAX_BYTES = int(os.environ.get("JSON_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+JSON_CACHE_EXPANSION = 8
+JSON_CACHE_BYTES = 0
+# Incremented by write_json so rewrites within one mtime tick are noticed
+WRITE_GENERATIONS: Dict[str, int] = {}
+# Record counts for files not described by the manifest keyed by path and
+# invalidated by (mtime_ns, size).
+RECORD_COUNT_CACHE: Dict[str, tuple] = {}
+
+
+def load_json(path: Path, default, cache: bool = True):
+    """Load JSON using orjson with a fallback default.
+
+    Parsed data is cached per path and reused while the file's (mtime, size,
+    inode) and writer generation are unchanged. Cached objects are shared
+    between callers and must be treated as read-only; pass ``cache=False`` to
+    get a private copy that can be modified.
+    """
+    try:
+        st = path.stat()
+    except OSError:
         return default
+    name = str(path)
+    key = (st.st_mtime_ns, st.st_size, st.st_ino, st.st_dev, WRITE_GENERATIONS.get(name, 0))
+    if cache:
+        with JSON_CACHE_LOCK:
+            entry = JSON_CACHE.get(name)
+            if entry and entry[0] == key:
+                JSON_CACHE.move_to_end(name)
+                return entry[1]
     try:
-        return orjson.loads(path.read_bytes())
+        value = orjson.loads(path.read_bytes())
     except Exception:
         return default
+    if cache:
+        _json_cache_put(name, key, value, st.st_size * JSON_CACHE_EXPANSION)
+    return value
+
+
+def _json_cache_put(name: str, key: tuple, value, weight: int):
+    """Insert a parsed dataset, evicting least recently used entries."""
+    global JSON_CACHE_BYTES
+    if weight > JSON_CACHE_MAX_BYTES:
+        return
+    with JSON_CACHE_LOCK:
+        old = JSON_CACHE.pop(name, None)
+        if old:
+            JSON_CACHE_BYTES -= old[2]
+        JSON_CACHE[name] = (key, value, weight)
+        JSON_CACHE_BYTES += weight
+        while JSON_CACHE_BYTES > JSON_CACHE_MAX_BYTES:
+            _, evicted = JSON_CACHE.popitem(last=False)
+            JSON_CACHE_BYTES -= evicted[2]
+
+
+def replace_file(path: Path, payload: bytes):
+    """Write ``payload`` to a temporary file beside ``path`` and swap it in.
+
+    Readers see either the old or the new content, never a partial write.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f_out:
+            f_out.write(payload)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
 
 
 def write_json(path: Path, data):
-    """Write JSON using orjson."""
-    path.write_bytes(orjson.dumps(data))
+    """Write JSON using orjson and record the file in the manifest.
+
+    Identical content is not rewritten so the file keeps its mtime and
+    caches keyed on it stay valid.
+    """
+    payload = orjson.dumps(data)
+    content_hash = hashlib.sha256(payload).hexdigest()
+    entry = load_manifest(path.parent).get(path.name)
+    if entry and entry.get("hash") == content_hash and path.exists():
+        st = path.stat()
+        if entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+            return
+    replace_file(path, payload)
+    bump_generation(path)
+    records = len(data) if isinstance(data, (list, dict)) else 0
+    record_manifest(path, records, content_hash)
+
+
+def bump_generation(path: Path):
+    """Invalidate cached parses of ``path`` after it was rewritten."""
+    name = str(path)
+    WRITE_GENERATIONS[name] = WRITE_GENERATIONS.get(name, 0) + 1
+
+
+def _manifest_path(directory: Path) -> Path:
+    return directory / MANIFEST_NAME
+
+
+def load_manifest(directory: Path, cache: bool = True) -> Dict[str, dict]:
+    """Return manifest entries for ``directory`` keyed by file name."""
+    data = load_json(_manifest_path(directory), {}, cache=cache)
+    return data if isinstance(data, dict) else {}
+
+
+def record_manifest(path: Path, records: int, content_hash: str):
+    """Store size, mtime, record count and hash for a freshly written file."""
+    st = path.stat()
+    entry = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "records": records,
+        "hash": content_hash,
+        "schema_version": SCHEMA_VERSIONS.get(path.name),
+    }
+    with MANIFEST_LOCK:
+        manifest = load_manifest(path.parent, cache=False)
+        manifest[path.name] = entry
+        replace_file(_manifest_path(path.parent), orjson.dumps(manifest))
+        bump_generation(_manifest_path(path.parent))
+
+
+def forget_manifest(path: Path):
+    """Drop the manifest entry for a removed file."""
+    with MANIFEST_LOCK:
+        manifest = load_manifest(path.parent, cache=False)
+        if manifest.pop(path.name, None) is not None:
+            replace_file(_manifest_path(path.parent), orjson.dumps(manifest))
+            bump_generation(_manifest_path(path.parent))
+
+
+def count_records(path: Path) -> int:
+    """Count records in a file not produced by the server, cached by mtime."""
+    st = path.stat()
+    key = str(path)
+    cached = RECORD_COUNT_CACHE.get(key)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    records = 0
+    data = load_json(path, None, cache=False)
+    if isinstance(data, (list, dict)):
+        records = len(data)
+    elif data is None:
+        try:
+            with path.open("rb") as f_in:
+                records = sum(1 for _ in f_in)
+        except Exception:
+            records = 0
+    RECORD_COUNT_CACHE[key] = (st.st_mtime_ns, st.st_size, records)
+    return records
+
+
+# Returned by JsonStreamValidator._finish_record for an empty container, as
+# None is a valid record
+NO_RECORD = object()
+
+
+class JsonStreamValidator:
+    """Incrementally validate a JSON dataset fed in arbitrary chunks.
+
+    Only the top-level record currently being read is buffered, so large
+    uploads are checked with bounded memory. Raises ``ValueError`` on the
+    first malformed or non-conforming record.
+
+    ``feed`` returns the records completed by each chunk as ``(record,
+    end_offset)`` pairs, where ``end_offset`` is the absolute byte offset just
+    past the record's separator; dict records are ``(key, value)`` tuples.
+    Passing ``inside=True`` starts the parser past the opening bracket, so a
+    reader can resume at a previously returned offset.
+    """
+
+    TOKENS = re.compile(rb'[\[\]{}",\\]')
+
+    def __init__(self, container: str, required=None, inside: bool = False, offset: int = 0):
+        self.opener, self.closer = (b"[", b"]") if container == "list" else (b"{", b"}")
+        self.required = required
+        self.depth = 1 if inside else 0
+        self.offset = offset
+        self.in_string = False
+        self.escape = False
+        self.closed = False
+        self.buf = bytearray()
+        self.records = 0
+
+    def feed(self, chunk: bytes):
+        done = []
+        start = 0
+        skip = 1 if self.escape else 0
+        self.escape = False
+        for m in self.TOKENS.finditer(chunk):
+            i = m.start()
+            if i < skip:
+                continue
+            ch = chunk[i:i + 1]
+            if self.in_string:
+                if ch == b"\\":
+                    skip = i + 2
+                    self.escape = skip > len(chunk)
+                elif ch == b'"':
+                    self.in_string = False
+                continue
+            if self.depth == 0:
+                self._check_blank(chunk[start:i])
+                if self.closed or ch != self.opener:
+                    raise ValueError(f"expected a JSON {'array' if self.opener == b'[' else 'object'}")
+                self.depth = 1
+                start = i + 1
+            elif ch == b'"':
+                self.in_string = True
+            elif ch in b"[{":
+                self.depth += 1
+            elif ch in b"]}":
+                self.depth -= 1
+                if self.depth == 0:
+                    if ch != self.closer:
+                        raise ValueError("mismatched brackets")
+                    self.buf += chunk[start:i]
+                    start = i + 1
+                    record = self._finish_record(last=True)
+                    if record is not NO_RECORD:
+                        done.append((record, self.offset + start))
+                    self.closed = True
+            elif ch == b"," and self.depth == 1:
+                self.buf += chunk[start:i]
+                start = i + 1
+                done.append((self._finish_record(), self.offset + start))
+        if self.depth:
+            self.buf += chunk[start:]
+            if len(self.buf) > MAX_UPLOAD_RECORD_BYTES:
+                raise ValueError("record too large")
+        else:
+            self._check_blank(chunk[start:])
+        self.offset += len(chunk)
+        return done
+
+    def close(self):
+        if not self.closed or self.in_string:
+            raise ValueError("truncated JSON")
+
+    @staticmethod
+    def _check_blank(data: bytes):
+        if data.strip():
+            raise ValueError("unexpected data outside the top-level value")
+
+    def _finish_record(self, last: bool = False):
+        raw = bytes(self.buf).strip()
+        self.buf.clear()
+        if not raw:
+            if last and self.records == 0:
+                return NO_RECORD
+            raise ValueError("empty record")
+        try:
+            if self.opener == b"[":
+                key, value = None, orjson.loads(raw)
+            else:
+                key, value = next(iter(orjson.loads(b"{" + raw + b"}").items()))
+        except orjson.JSONDecodeError as exc:
+            raise ValueError(f"record {self.records}: {exc}") from None
+        if self.required is not None:
+            if not isinstance(value, dict):
+                raise ValueError(f"record {self.records}: expected an object")
+            missing = [k for k in self.required if k not in value]
+            if missing:
+                raise ValueError(f"record {self.records}: missing {', '.join(missing)}")
+        self.records += 1
+        return value if key is None else (key, value)
+
+
+def iter_json_records(path: Path, container: str, offset: int = 0):
+    """Yield ``(record, end_offset)`` from a JSON dataset without loading it whole.
+
+    A non-zero ``offset`` must be one previously yielded for the same file
+    contents; reading resumes at the record that follows it. Raises
+    ``ValueError`` if the file is malformed or ends early.
+    """
+    parser = JsonStreamValidator(container, inside=offset > 0, offset=offset)
+    with path.open("rb") as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield from parser.feed(chunk)
+    parser.close()
+
+
+def reload_dataset(path: Path):
+    """Refresh in-memory state derived from a dataset replaced on disk."""
+    if path == AIRPORTS_FULL_PATH.resolve():
+        load_airport_index()
+    elif path == ACTIVE_PLANES_PATH.resolve() and STREAM is not None:
+        STREAM.resume()
 
 
 def normalize_continents(values: List[str]) -> List[str]:
@@ -118,17 +526,281 @@ def _to_unit_vector(lat: float, lon: float):
     ]
 
 
+def airport_type(ap: dict) -> str:
+    kind = ap.get("type") or ""
+    return kind if kind in MATCH_RADIUS_KM else ""
+
+
+def match_radius(ap: dict) -> float:
+    """Return the matching radius in km for an airport's type."""
+    return MATCH_RADIUS_KM[airport_type(ap)]
+
+
 def build_airport_tree(airports):
-    """Build global KDTree from iterable of airport dicts."""
+    """Build global KDTree from iterable of airport dicts.
+
+    Only airports of a type with a matching radius are included.
+    """
     global AIRPORTS_TREE, AIRPORTS_INDEX
     coords = []
     AIRPORTS_INDEX = []
     for ap in airports:
+        if match_radius(ap) <= 0:
+            continue
         coords.append(_to_unit_vector(ap["lat"], ap["lon"]))
         AIRPORTS_INDEX.append(ap["code"])
     AIRPORTS_TREE = cKDTree(coords) if coords else None
 
 
+class AirportIndex:
+    """Nearest-airport lookups that prefer large and medium airports.
+
+    Airports are split into a primary tier (PRIMARY_AIRPORT_TYPES) and a
+    secondary tier (other types with a radius), each with its own KD-tree.
+    A position matches the closest primary airport within its type's radius,
+    else the closest secondary one. The same index resolves origins and
+    destinations.
+    """
+
+    def __init__(self, airports: Dict[str, dict]):
+        self.airports = airports
+        self.tiers = []
+        for primary in (True, False):
+            codes = [
+                code for code, ap in airports.items()
+                if match_radius(ap) > 0 and (airport_type(ap) in PRIMARY_AIRPORT_TYPES) == primary
+            ]
+            if not codes:
+                continue
+            coords = [_to_unit_vector(airports[c]["lat"], airports[c]["lon"]) for c in codes]
+            radius = [match_radius(airports[c]) for c in codes]
+            chord = 2 * sin(max(radius) / EARTH_RADIUS_KM / 2)
+            self.tiers.append((cKDTree(coords), codes, radius, chord))
+
+    def nearest(self, lat: float, lon: float):
+        """Return the matching airport dict for a position, or None."""
+        if lat is None or lon is None:
+            return None
+        point = _to_unit_vector(lat, lon)
+        for tree, codes, radius, chord in self.tiers:
+            # Every airport within the tier's largest radius, since the
+            # nearest may be out of its own radius while a farther one is not
+            best = None
+            for i in tree.query_ball_point(point, chord * 1.001):
+                ap = self.airports[codes[i]]
+                d = haversine(lat, lon, ap["lat"], ap["lon"])
+                if d <= radius[i] and (best is None or d < best[0]):
+                    best = (d, codes[i], ap)
+            if best:
+                return best[2]
+        return None
+
+
+def build_shards(airports: Dict[str, dict]):
+    """Partition airports by continent for sharded ingestion.
+
+    Each grid cell belongs to the continent of the airport nearest to its
+    centre. A shard's index also includes every airport whose matching
+    radius reaches one of its cells, so shard lookups near a border give the
+    same answer as the global index.
+    """
+    global SHARD_INDEXES, SHARD_KEYS, SHARD_GRID
+    continents = sorted({ap.get("continent") or "" for ap in airports.values()})
+    if len(continents) < 2 or AIRPORTS_TREE is None:
+        SHARD_INDEXES = {"": AIRPORTS_LOOKUP}
+        SHARD_KEYS = [""]
+        SHARD_GRID = None
+        return
+    rows = int(180 / SHARD_CELL_DEG)
+    cols = int(360 / SHARD_CELL_DEG)
+    lat_c = np.radians(-90 + (np.arange(rows) + 0.5) * SHARD_CELL_DEG)
+    lon_c = np.radians(-180 + (np.arange(cols) + 0.5) * SHARD_CELL_DEG)
+    lat_g, lon_g = np.meshgrid(lat_c, lon_c, indexing="ij")
+    points = np.stack(
+        [np.cos(lat_g) * np.cos(lon_g), np.cos(lat_g) * np.sin(lon_g), np.sin(lat_g)],
+        axis=-1,
+    ).reshape(-1, 3)
+    _, idx = AIRPORTS_TREE.query(points)
+    shard_of_airport = np.array(
+        [continents.index(airports[c].get("continent") or "") for c in AIRPORTS_INDEX],
+        dtype=np.int8,
+    )
+    grid = shard_of_airport[idx].reshape(rows, cols)
+    members: List[Dict[str, dict]] = [{} for _ in continents]
+    for code, ap in airports.items():
+        members[continents.index(ap.get("continent") or "")][code] = ap
+        for r, c in _cells_within(ap["lat"], ap["lon"], match_radius(ap)):
+            members[grid[r, c]][code] = ap
+    SHARD_INDEXES = {key: AirportIndex(m) for key, m in zip(continents, members)}
+    SHARD_KEYS = continents
+    SHARD_GRID = grid
+
+
+def _cells_within(lat: float, lon: float, radius_km: float):
+    """Yield the ``(row, col)`` shard cells a circle around a point can reach."""
+    rows = int(180 / SHARD_CELL_DEG)
+    cols = int(360 / SHARD_CELL_DEG)
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = np.degrees(angle)
+    r0 = max(int((lat - dlat + 90) // SHARD_CELL_DEG), 0)
+    r1 = min(int((lat + dlat + 90) // SHARD_CELL_DEG), rows - 1)
+    # Widest longitude span of the circle, reached at its most polar latitude
+    polar = radians(min(abs(lat) + dlat, 90))
+    spread = sin(angle / 2) / cos(polar) if cos(polar) > 1e-9 else 2.0
+    if spread >= 1:
+        col_range = range(cols)
+    else:
+        dlon = np.degrees(2 * asin(spread))
+        c0 = int((lon - dlon + 180) // SHARD_CELL_DEG)
+        c1 = int((lon + dlon + 180) // SHARD_CELL_DEG)
+        col_range = [c % cols for c in range(c0, min(c1, c0 + cols - 1) + 1)]
+    for r in range(r0, r1 + 1):
+        for c in col_range:
+            yield r, c
+
+
+def _grid_cell(lat: float, lon: float):
+    rows = int(180 / SHARD_CELL_DEG)
+    cols = int(360 / SHARD_CELL_DEG)
+    r = min(max(int((lat + 90) // SHARD_CELL_DEG), 0), rows - 1)
+    c = int((lon + 180) // SHARD_CELL_DEG) % cols
+    return r, c
+
+
+def shard_for(lat, lon) -> str:
+    """Return the shard key owning a position."""
+    if SHARD_GRID is None or lat is None or lon is None:
+        return SHARD_KEYS[0] if SHARD_KEYS else ""
+    r, c = _grid_cell(lat, lon)
+    return SHARD_KEYS[SHARD_GRID[r, c]]
+
+
+def build_coverage_mask(airports: Dict[str, dict]):
+    """Rasterize the area within COVERAGE_RADIUS_KM of the indexed airports.
+
+    Cell centres are matched against the airport tree with the radius grown
+    by half a cell diagonal, so every point within reach of an airport falls
+    in a marked cell. Only rows that can be in reach are queried.
+    """
+    global COVERAGE_MASK
+    if AIRPORTS_TREE is None:
+        COVERAGE_MASK = None
+        return
+    rows = int(180 / COVERAGE_CELL_DEG)
+    cols = int(360 / COVERAGE_CELL_DEG)
+    reach = COVERAGE_RADIUS_KM / EARTH_RADIUS_KM + radians(COVERAGE_CELL_DEG) / sqrt(2)
+    lats = [ap["lat"] for ap in airports.values()]
+    lo = max(int((min(lats) + 90 - np.degrees(reach)) // COVERAGE_CELL_DEG), 0)
+    hi = min(int((max(lats) + 90 + np.degrees(reach)) // COVERAGE_CELL_DEG) + 1, rows)
+    lat_c = np.radians(-90 + (np.arange(lo, hi) + 0.5) * COVERAGE_CELL_DEG)
+    lon_c = np.radians(-180 + (np.arange(cols) + 0.5) * COVERAGE_CELL_DEG)
+    lat_g, lon_g = np.meshgrid(lat_c, lon_c, indexing="ij")
+    points = np.stack(
+        [np.cos(lat_g) * np.cos(lon_g), np.cos(lat_g) * np.sin(lon_g), np.sin(lat_g)],
+        axis=-1,
+    ).reshape(-1, 3)
+    chord = 2 * sin(min(reach, np.pi) / 2)
+    dist, _ = AIRPORTS_TREE.query(points, distance_upper_bound=chord)
+    mask = np.zeros((rows, cols), dtype=bool)
+    mask[lo:hi] = np.isfinite(dist).reshape(hi - lo, cols)
+    COVERAGE_MASK = mask
+
+
+def coverage_filter(states, active=()):
+    """Return the states with a position inside the coverage mask.
+
+    Aircraft in ``active`` are already tracked and are kept wherever they are,
+    so a flight that cruises out of coverage still updates its last position.
+    """
+    if not states:
+        return []
+    coords = np.array([(s[6], s[5]) for s in states], dtype=float)
+    keep = ~np.isnan(coords).any(axis=1)
+    if COVERAGE_MASK is not None:
+        rows = np.clip(((coords[:, 0] + 90) // COVERAGE_CELL_DEG), 0, COVERAGE_MASK.shape[0] - 1)
+        cols = ((coords[:, 1] + 180) // COVERAGE_CELL_DEG) % COVERAGE_MASK.shape[1]
+        rows = np.where(keep, rows, 0).astype(int)
+        cols = np.where(keep, cols, 0).astype(int)
+        covered = COVERAGE_MASK[rows, cols]
+        if active:
+            covered |= np.array([s[0] in active for s in states], dtype=bool)
+        keep &= covered
+    return [states[i] for i in np.flatnonzero(keep).tolist()]
+
+
+def set_airport_index(airports: Dict[str, dict]):
+    """Swap in new nearest-airport lookup structures and bump their version."""
+    global AIRPORTS_MAP, AIRPORTS_TREE, AIRPORTS_INDEX, AIRPORTS_LOOKUP
+    global AIRPORTS_VERSION, AIRPORTS_SOURCE, AIRPORTS_IDENTITY
+    AIRPORTS_MAP = airports
+    if AIRPORTS_MAP:
+        build_airport_tree(AIRPORTS_MAP.values())
+    else:
+        AIRPORTS_TREE = None
+        AIRPORTS_INDEX = []
+    AIRPORTS_LOOKUP = AirportIndex(AIRPORTS_MAP)
+    build_coverage_mask(AIRPORTS_MAP)
+    build_shards(AIRPORTS_MAP)
+    AIRPORTS_VERSION += 1
+    AIRPORTS_SOURCE = None
+    AIRPORTS_IDENTITY = None
+
+
+def airport_identity(airports: Dict[str, dict]) -> str:
+    """Hash the airport fields the lookup structures are built from."""
+    fields = sorted(
+        (code, ap.get("name"), ap.get("lat"), ap.get("lon"), ap.get("type"), ap.get("continent"))
+        for code, ap in airports.items()
+    )
+    return hashlib.sha256(orjson.dumps(fields)).hexdigest()
+
+
+def load_airport_index(allowed_continents=None):
+    """Rebuild the airport index from ``airports_full.json``.
+
+    Airports are limited to ``allowed_continents`` (the configured flight
+    continents by default); airports without a continent are always kept.
+    The rebuild is skipped when neither the file nor the continents changed,
+    and when a rewritten file holds the same airports (update_airports
+    rewrites it with each airport's routes).
+    """
+    global AIRPORTS_SOURCE, AIRPORTS_IDENTITY
+    if allowed_continents is None:
+        config = load_config()
+        allowed_continents = set(config.get("flight_continents") or CONTINENTS.keys())
+    st = AIRPORTS_FULL_PATH.stat() if AIRPORTS_FULL_PATH.exists() else None
+    source = (
+        str(AIRPORTS_FULL_PATH),
+        st.st_mtime_ns if st else None,
+        st.st_size if st else None,
+        tuple(sorted(allowed_continents)),
+    )
+    if source == AIRPORTS_SOURCE:
+        return
+    airports = {}
+    try:
+        airports = {a["code"]: a for a in load_json(AIRPORTS_FULL_PATH, [])}
+    except Exception:
+        airports = {}
+    filtered_airports = {}
+    if airports:
+        if allowed_continents:
+            filtered_airports = {
+                code: ap
+                for code, ap in airports.items()
+                if not ap.get("continent")
+                or (ap.get("continent") in allowed_continents)
+            }
+        else:
+            filtered_airports = airports
+    airports = filtered_airports or airports
+    identity = airport_identity(airports)
+    if identity != AIRPORTS_IDENTITY:
+        set_airport_index(airports)
+    AIRPORTS_SOURCE = source
+    AIRPORTS_IDENTITY = identity
+
+
 def parse_callsign(callsign: str):
     """Return (prefix, number) from a callsign string."""
     cs = (callsign or "").strip()
@@ -153,19 +825,1695 @@ def haversine(lat1, lon1, lat2, lon2):
 
 
 def nearest_airport(lat: float, lon: float):
-    """Return closest airport dict within 30km of given coordinates."""
-    if lat is None or lon is None or AIRPORTS_TREE is None:
+    """Return the airport matching the given coordinates (see AirportIndex)."""
+    if AIRPORTS_LOOKUP is None:
         return None
-    point = _to_unit_vector(lat, lon)
-    dist, idx = AIRPORTS_TREE.query(point)
-    if idx >= len(AIRPORTS_INDEX):
+    return AIRPORTS_LOOKUP.nearest(lat, lon)
+
+
+def _init_shard_worker(indexes):
+    global SHARD_INDEXES
+    SHARD_INDEXES = indexes
+
+
+def _shard_pool():
+    """Return the ingestion worker pool, recreated when the airports change.
+
+    Workers are started from a fork server (spawned where unavailable)
+    rather than forked from the threaded server process.
+    """
+    global SHARD_POOL, SHARD_POOL_VERSION
+    if SHARD_POOL is None or SHARD_POOL_VERSION != AIRPORTS_VERSION:
+        if SHARD_POOL is not None:
+            SHARD_POOL.shutdown(wait=False)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        SHARD_POOL = ProcessPoolExecutor(
+            max_workers=min(INGEST_WORKERS, len(SHARD_INDEXES)),
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_shard_worker,
+            initargs=(SHARD_INDEXES,),
+        )
+        SHARD_POOL_VERSION = AIRPORTS_VERSION
+    return SHARD_POOL
+
+
+def partition_snapshot(states, active):
+    """Split snapshot states and tracked flights by shard.
+
+    Tracked flights follow the shard of their current state; flights missing
+    from the snapshot go to the shard owning their last position so they are
+    finalized there.
+    """
+    parts = {key: ([], {}) for key in SHARD_KEYS or [""]}
+    if SHARD_GRID is not None and states:
+        coords = np.array([(s[6], s[5]) for s in states], dtype=float)
+        rows = np.clip(((coords[:, 0] + 90) // SHARD_CELL_DEG).astype(int), 0, SHARD_GRID.shape[0] - 1)
+        cols = ((coords[:, 1] + 180) // SHARD_CELL_DEG).astype(int) % SHARD_GRID.shape[1]
+        shard_keys = [SHARD_KEYS[i] for i in SHARD_GRID[rows, cols].tolist()]
+    else:
+        shard_keys = [next(iter(parts))] * len(states)
+    for s, key in zip(states, shard_keys):
+        part = parts[key]
+        part[0].append(s)
+        if s[0] in active:
+            part[1][s[0]] = active[s[0]]
+    placed = {s[0] for s in states}
+    for icao24, af in active.items():
+        if icao24 not in placed:
+            parts[shard_for(*(af.get("last_coord") or (None, None)))][1][icao24] = af
+    return parts
+
+
+def _process_shard(shard: str, states, active, now: str, index: "AirportIndex" = None):
+    """Advance one shard's tracked flights with its part of the snapshot.
+
+    Returns the shard's remaining active flights and route deltas
+    ``(key, icao24, first_seen, last_seen)`` for flights that disappeared
+    from the feed.
+    """
+    index = index or SHARD_INDEXES[shard]
+    seen = set()
+    for s in states:
+        icao24 = s[0]
+        callsign = s[1].strip() if s[1] else ""
+        lon = s[5]
+        lat = s[6]
+        seen.add(icao24)
+        prefix, number = parse_callsign(callsign)
+        if icao24 in active:
+            af = active[icao24]
+            if not af.get("origin"):
+                active.pop(icao24, None)
+                continue
+            af["last_coord"] = [lat, lon]
+            af["last_updated"] = now
+            af["callsign"] = callsign
+            af["airline"] = prefix
+            af["flight_number"] = number
+        else:
+            origin_ap = index.nearest(lat, lon)
+            if not origin_ap:
+                continue
+            active[icao24] = {
+                "callsign": callsign,
+                "airline": prefix,
+                "flight_number": number,
+                "origin": origin_ap["code"] if origin_ap else None,
+                "origin_name": origin_ap["name"] if origin_ap else None,
+                "origin_coord": [lat, lon],
+                "last_coord": [lat, lon],
+                "first_seen": now,
+                "last_updated": now,
+            }
+
+    deltas = []
+    for icao24 in [key for key in active if key not in seen]:
+        delta = finish_flight(icao24, active.pop(icao24), index)
+        if delta:
+            deltas.append(delta)
+    return active, deltas
+
+
+def finish_flight(icao24: str, af: dict, index: "AirportIndex"):
+    """Return the route delta of a flight that left the feed, or None.
+
+    The flight ends at the airport nearest its last position; the origin was
+    resolved when tracking started. The delta carries the flight's first and
+    last observation times.
+    """
+    prefix, number = parse_callsign(af.get("callsign", ""))
+    src_code = af.get("origin")
+    dest = index.nearest(*(af.get("last_coord") or (None, None))) if index else None
+    if not src_code or not dest or src_code == dest["code"]:
+        return None
+    return (prefix, number, src_code, dest["code"]), icao24, af.get("first_seen"), af.get("last_updated")
+
+
+# Trails of tracked flights: at most TRAIL_MAX_POINTS positions per flight,
+# consecutive points at least TRAIL_MIN_KM apart
+TRAIL_MAX_POINTS = 64
+TRAIL_MIN_KM = 5.0
+
+
+class TrailStore:
+    """Bounded position trails for active flights.
+
+    Each flight owns a preallocated ``(TRAIL_MAX_POINTS, 2)`` float32 array.
+    While the last point is within TRAIL_MIN_KM of the one before it, new
+    positions move it instead of adding a point. When the array is full the
+    interior point deviating least from the line between its neighbours is
+    dropped, so the trail keeps its overall shape in constant memory.
+    Ingestion writes while request handlers read, so access holds ``lock``.
+    """
+
+    def __init__(self, capacity: int = None, min_km: float = None):
+        self.capacity = capacity or TRAIL_MAX_POINTS
+        self.min_km = TRAIL_MIN_KM if min_km is None else min_km
+        self.points: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def append(self, icao24: str, lat: float, lon: float):
+        with self.lock:
+            self._append(icao24, lat, lon)
+
+    def _append(self, icao24: str, lat: float, lon: float):
+        pts = self.points.get(icao24)
+        if pts is None:
+            pts = self.points[icao24] = np.empty((self.capacity, 2), dtype=np.float32)
+            self.counts[icao24] = 0
+        n = self.counts[icao24]
+        if n >= 2 and haversine(*pts[n - 2].tolist(), *pts[n - 1].tolist()) < self.min_km:
+            pts[n - 1] = (lat, lon)
+            return
+        if n == self.capacity:
+            self._drop_least_significant(pts)
+            n -= 1
+        pts[n] = (lat, lon)
+        self.counts[icao24] = n + 1
+
+    def _drop_least_significant(self, pts: np.ndarray):
+        # Distance of each interior point from the chord between its
+        # neighbours, on an equirectangular projection
+        scale = np.cos(np.radians(pts[:, 0]))
+        xy = np.column_stack([pts[:, 1] * scale, pts[:, 0]])
+        a, b, c = xy[:-2], xy[1:-1], xy[2:]
+        chord = c - a
+        cross = np.abs(chord[:, 0] * (b - a)[:, 1] - chord[:, 1] * (b - a)[:, 0])
+        length = np.maximum(np.hypot(chord[:, 0], chord[:, 1]), 1e-9)
+        i = int(np.argmin(cross / length)) + 1
+        pts[i:-1] = pts[i + 1:]
+
+    def get(self, icao24: str):
+        with self.lock:
+            pts = self.points.get(icao24)
+            return pts[:self.counts[icao24]].tolist() if pts is not None else []
+
+    def drop(self, icao24: str):
+        with self.lock:
+            self.points.pop(icao24, None)
+            self.counts.pop(icao24, None)
+
+    def retain(self, keys):
+        with self.lock:
+            for icao24 in [k for k in self.points if k not in keys]:
+                del self.points[icao24]
+                del self.counts[icao24]
+
+
+TRAILS = TrailStore()
+
+
+# New aircraft are only matched to an origin when they could be departing:
+# on the ground or below DEPARTURE_MAX_ALTITUDE_M (barometric, else
+# geometric). Unknown altitude counts as low.
+DEPARTURE_MAX_ALTITUDE_M = float(os.environ.get("DEPARTURE_MAX_ALTITUDE_M", "5000"))
+UNRESOLVED_TTL = float(os.environ.get("UNRESOLVED_TTL", "1800"))
+
+
+class UnresolvedTracker:
+    """Untracked aircraft not worth an origin lookup on the next polls.
+
+    Maps icao24 to ``(retry_after, on_ground)``. An entry is dropped when the
+    aircraft leaves the feed, lands or takes off, or its TTL runs out.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = UNRESOLVED_TTL if ttl is None else ttl
+        self.entries: Dict[str, tuple] = {}
+
+    @staticmethod
+    def on_ground(s) -> bool:
+        return bool(s[8]) if len(s) > 8 else False
+
+    @staticmethod
+    def plausibly_departing(s) -> bool:
+        if UnresolvedTracker.on_ground(s):
+            return True
+        altitude = s[7] if len(s) > 7 else None
+        if altitude is None and len(s) > 13:
+            altitude = s[13]
+        return altitude is None or altitude <= DEPARTURE_MAX_ALTITUDE_M
+
+    def select(self, states, active, now: float):
+        """Return the states to process, skipping aircraft known to be unresolvable."""
+        keep = []
+        seen = set()
+        for s in states:
+            seen.add(s[0])
+            if s[0] in active or self.admit(s, now):
+                keep.append(s)
+        for icao24 in [k for k in self.entries if k not in seen]:
+            del self.entries[icao24]
+        return keep
+
+    def admit(self, s, now: float) -> bool:
+        """Return whether an untracked aircraft's state is worth an origin lookup."""
+        entry = self.entries.get(s[0])
+        grounded = self.on_ground(s)
+        if entry and entry[0] > now and entry[1] == grounded:
+            return False
+        if not self.plausibly_departing(s):
+            self.entries[s[0]] = (now + self.ttl, grounded)
+            return False
+        self.entries.pop(s[0], None)
+        return True
+
+    def record(self, states, active, now: float):
+        """Remember processed aircraft that did not end up being tracked."""
+        for s in states:
+            if s[0] not in active:
+                self.entries[s[0]] = (now + self.ttl, self.on_ground(s))
+
+
+UNRESOLVED = UnresolvedTracker()
+
+
+def run_shards(parts, now: str):
+    """Process shards inline or on the worker pool and collect results."""
+    if len(parts) == 1 or INGEST_WORKERS <= 1:
+        return [
+            _process_shard(key, states, active, now, SHARD_INDEXES.get(key))
+            for key, (states, active) in parts.items()
+        ]
+    pool = _shard_pool()
+    futures = [
+        pool.submit(_process_shard, key, states, active, now)
+        for key, (states, active) in parts.items()
+    ]
+    return [f.result() for f in futures]
+
+
+class RouteFrequency:
+    """Per-route daily observation counters kept in a 31 day ring.
+
+    Counts live in a packed ``(routes, 31)`` uint16 array indexed by
+    ``day % 31``; weekly and monthly aggregates per route, airport and airline
+    are recomputed once per ingestion so queries never scan raw records.
+    """
+
+    DAYS = 31
+
+    def __init__(self, keys=None, counts=None, day=None):
+        self.keys = [tuple(k) for k in (keys or [])]
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        if counts is None:
+            counts = np.zeros((len(self.keys), self.DAYS), dtype=np.uint16)
+        self.counts = counts
+        self.day = day
+        self.aggregates = {}
+        self.aggregate()
+
+    @classmethod
+    def from_json(cls, data: dict):
+        keys = data.get("keys") or []
+        raw = base64.b64decode(data.get("counts") or b"")
+        counts = np.frombuffer(raw, dtype="<u2").astype(np.uint16)
+        if counts.size != len(keys) * cls.DAYS:
+            return cls()
+        return cls(keys, counts.reshape(len(keys), cls.DAYS), data.get("day"))
+
+    def to_json(self) -> dict:
+        return {
+            "day": self.day,
+            "keys": [list(k) for k in self.keys],
+            "counts": base64.b64encode(self.counts.astype("<u2").tobytes()).decode(),
+        }
+
+    def advance(self, day: int):
+        """Zero the slots of days skipped since the last recorded day."""
+        if self.day is not None and day > self.day:
+            gap = day - self.day
+            if gap >= self.DAYS:
+                self.counts[:] = 0
+            else:
+                slots = [(self.day + i) % self.DAYS for i in range(1, gap + 1)]
+                self.counts[:, slots] = 0
+        if self.day is None or day > self.day:
+            self.day = day
+
+    def record_many(self, observations: Dict[tuple, int], day: int):
+        """Add observation counts for ``day`` and refresh the aggregates."""
+        self.advance(day)
+        new_keys = [k for k in observations if k not in self.index]
+        if new_keys:
+            for k in new_keys:
+                self.index[k] = len(self.keys)
+                self.keys.append(k)
+            grown = np.zeros((len(new_keys), self.DAYS), dtype=np.uint16)
+            self.counts = np.vstack([self.counts, grown])
+        slot = day % self.DAYS
+        for key, n in observations.items():
+            row = self.index[key]
+            self.counts[row, slot] = min(int(self.counts[row, slot]) + n, 0xFFFF)
+        self.compact()
+        self.aggregate()
+
+    def compact(self):
+        """Drop routes with no observations left in the ring."""
+        alive = self.counts.any(axis=1)
+        if alive.all():
+            return
+        self.keys = [k for k, keep in zip(self.keys, alive) if keep]
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        self.counts = self.counts[alive]
+
+    def aggregate(self):
+        """Precompute weekly/monthly totals and the busiest-route ordering."""
+        if self.day is None or not self.keys:
+            self.aggregates = {"routes": [], "airports": {}, "airlines": {}}
+            return
+        week_slots = [(self.day - i) % self.DAYS for i in range(7)]
+        weekly = self.counts[:, week_slots].sum(axis=1, dtype=np.int64)
+        monthly = self.counts.sum(axis=1, dtype=np.int64)
+        order = np.lexsort((-monthly, -weekly))
+        routes = []
+        airports: Dict[str, List[int]] = {}
+        airlines: Dict[str, List[int]] = {}
+        for row in order.tolist():
+            airline, number, source, destination = self.keys[row]
+            w, m = int(weekly[row]), int(monthly[row])
+            routes.append({
+                "airline": airline,
+                "flight_number": number,
+                "source": source,
+                "destination": destination,
+                "weekly": w,
+                "monthly": m,
+                "daily": self.counts[row, week_slots[::-1]].tolist(),
+            })
+            for code in {source, destination}:
+                totals = airports.setdefault(code, [0, 0])
+                totals[0] += w
+                totals[1] += m
+            totals = airlines.setdefault(airline, [0, 0])
+            totals[0] += w
+            totals[1] += m
+        self.aggregates = {"routes": routes, "airports": airports, "airlines": airlines}
+
+
+# Upper edges of the route length histogram
+ROUTE_LENGTH_BINS_KM = [0, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 20100]
+ROUTE_ANALYTICS_TOP = 10
+
+
+def flight_minutes(start: str, end: str):
+    """Return minutes between two ISO timestamps, or None if unparsable."""
+    try:
+        delta = datetime.fromisoformat(end.replace("Z", "")) - datetime.fromisoformat(start.replace("Z", ""))
+    except (AttributeError, ValueError):
+        return None
+    return round(delta.total_seconds() / 60, 1)
+
+
+def build_route_analytics(routes, airports: Dict[str, dict], freq: RouteFrequency = None) -> dict:
+    """Compute route lengths and aggregate statistics in vectorized passes.
+
+    Great-circle distances come from one NumPy haversine over the airport
+    coordinate arrays and are stored on each route as ``distance_km``.
+    Durations are the ``duration_min`` observed when flights finished, and
+    busiest routes use the 31 day observation counts from ``freq``.
+    """
+    codes = list(airports)
+    position = {code: i for i, code in enumerate(codes)}
+    coords = np.array([(airports[c]["lat"], airports[c]["lon"]) for c in codes], dtype=float).reshape(-1, 2)
+    coords = np.vstack([coords, [np.nan, np.nan]])  # row -1: unknown airport
+    n = len(routes)
+    src = np.fromiter((position.get(r.get("source"), -1) for r in routes), dtype=np.int64, count=n)
+    dst = np.fromiter((position.get(r.get("destination"), -1) for r in routes), dtype=np.int64, count=n)
+    lat1, lon1 = np.radians(coords[src].T)
+    lat2, lon2 = np.radians(coords[dst].T)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    dist = np.round(2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1))), 1)
+    duration = np.fromiter(
+        (r.get("duration_min") if r.get("duration_min") is not None else np.nan for r in routes),
+        dtype=float, count=n,
+    )
+    observed = np.zeros(n, dtype=np.int64)
+    if freq is not None and freq.keys:
+        monthly = freq.counts.sum(axis=1, dtype=np.int64)
+        rows = np.fromiter((freq.index.get(_route_key(r), -1) for r in routes), dtype=np.int64, count=n)
+        observed = np.where(rows >= 0, monthly[rows], 0)
+    for r, d in zip(routes, dist.tolist()):
+        if d == d:
+            r["distance_km"] = d
+        else:
+            r.pop("distance_km", None)
+
+    measured = ~np.isnan(dist)
+    timed = ~np.isnan(duration)
+    valid = dist[measured]
+    histogram, _ = np.histogram(valid, bins=ROUTE_LENGTH_BINS_KM)
+
+    names, inverse = np.unique(np.array([r.get("airline") or "" for r in routes], dtype=object), return_inverse=True)
+    k = len(names)
+    per_routes = np.bincount(inverse, minlength=k)
+    per_distance = np.bincount(inverse, weights=np.where(measured, dist, 0), minlength=k)
+    per_timed = np.bincount(inverse, weights=timed, minlength=k)
+    per_duration = np.bincount(inverse, weights=np.where(timed, duration, 0), minlength=k)
+    per_observed = np.bincount(inverse, weights=observed, minlength=k)
+    airlines = [
+        {
+            "airline": names[i],
+            "routes": int(per_routes[i]),
+            "distance_km": round(float(per_distance[i]), 1),
+            "mean_duration_min": round(float(per_duration[i] / per_timed[i]), 1) if per_timed[i] else None,
+            "observations": int(per_observed[i]),
+        }
+        for i in np.argsort(-per_routes, kind="stable").tolist()
+    ]
+
+    def summary(i):
+        r = routes[i]
+        return {
+            "airline": r.get("airline"),
+            "flight_number": r.get("flight_number"),
+            "source": r.get("source"),
+            "destination": r.get("destination"),
+            "distance_km": r.get("distance_km"),
+            "duration_min": r.get("duration_min"),
+            "observations": int(observed[i]),
+        }
+
+    longest = np.argsort(-np.where(measured, dist, -1), kind="stable")[:ROUTE_ANALYTICS_TOP]
+    busiest = np.argsort(-observed, kind="stable")[:ROUTE_ANALYTICS_TOP]
+    return {
+        "routes": n,
+        "distance_km": {
+            "measured": int(measured.sum()),
+            "total": round(float(valid.sum()), 1),
+            "mean": round(float(valid.mean()), 1) if valid.size else None,
+            "median": round(float(np.median(valid)), 1) if valid.size else None,
+            "max": float(valid.max()) if valid.size else None,
+        },
+        "duration_min": {
+            "observed": int(timed.sum()),
+            "mean": round(float(duration[timed].mean()), 1) if timed.any() else None,
+            "median": round(float(np.median(duration[timed])), 1) if timed.any() else None,
+        },
+        "length_histogram": {"bins_km": ROUTE_LENGTH_BINS_KM, "counts": histogram.tolist()},
+        "airlines": airlines,
+        "longest": [summary(i) for i in longest.tolist() if measured[i]],
+        "busiest": [summary(i) for i in busiest.tolist() if observed[i]],
+    }
+
+
+# Great-circle sampling: roughly one point per GEOMETRY_SEGMENT_KM, bounded
+GEOMETRY_SEGMENT_KM = 100.0
+GEOMETRY_MAX_POINTS = 64
+# Route geometry from the last build, keyed by (code_a, code_b, lat_a, lon_a,
+# lat_b, lon_b); each build keeps only the pairs it used
+GEOMETRY_CACHE: Dict[tuple, list] = {}
+
+
+def great_circle_paths(pairs) -> List[list]:
+    """Return great-circle polylines for ``(lat1, lon1, lat2, lon2)`` rows.
+
+    All paths are sampled in one vectorized pass with a point count that grows
+    with distance. Each result is a list of segments split at the antimeridian
+    so Leaflet never draws a line across the whole map.
+    """
+    pairs = np.asarray(pairs, dtype=float).reshape(-1, 4)
+    n = len(pairs)
+    if not n:
+        return []
+    lat = np.radians(pairs[:, [0, 2]])
+    lon = np.radians(pairs[:, [1, 3]])
+    xyz = np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+    a, b = xyz[:, 0], xyz[:, 1]
+    omega = np.arccos(np.clip((a * b).sum(axis=1), -1.0, 1.0))
+    counts = np.clip(
+        np.ceil(omega * EARTH_RADIUS_KM / GEOMETRY_SEGMENT_KM).astype(int) + 1,
+        2,
+        GEOMETRY_MAX_POINTS,
+    )
+    group = np.repeat(np.arange(n), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(group.size) - starts[group]) / (counts[group] - 1)
+    w = omega[group]
+    sin_w = np.sin(w)
+    short = sin_w < 1e-9
+    safe = np.where(short, 1.0, sin_w)
+    ca = np.where(short, 1 - t, np.sin((1 - t) * w) / safe)
+    cb = np.where(short, t, np.sin(t * w) / safe)
+    p = ca[:, None] * a[group] + cb[:, None] * b[group]
+    p /= np.linalg.norm(p, axis=1, keepdims=True)
+    lats = np.round(np.degrees(np.arcsin(np.clip(p[:, 2], -1.0, 1.0))), 4)
+    lons = np.round(np.degrees(np.arctan2(p[:, 1], p[:, 0])), 4)
+    paths = []
+    for start, count in zip(starts.tolist(), counts.tolist()):
+        paths.append(_split_antimeridian(lats[start:start + count].tolist(), lons[start:start + count].tolist()))
+    return paths
+
+
+def _split_antimeridian(lats: List[float], lons: List[float]) -> List[list]:
+    segments = [[[lats[0], lons[0]]]]
+    for i in range(1, len(lats)):
+        lat1, lon1, lat2, lon2 = lats[i - 1], lons[i - 1], lats[i], lons[i]
+        d = lon2 - lon1
+        if abs(d) > 180:
+            boundary = -180.0 if d > 0 else 180.0
+            lon2u = lon2 - 360 if d > 0 else lon2 + 360
+            frac = (boundary - lon1) / (lon2u - lon1)
+            lat_x = round(lat1 + frac * (lat2 - lat1), 4)
+            segments[-1].append([lat_x, boundary])
+            segments.append([[lat_x, -boundary]])
+        segments[-1].append([lat2, lon2])
+    return segments
+
+
+def build_route_geometry(airports: Dict[str, dict], routes) -> Dict[str, list]:
+    """Compute geometry for every airport pair with a route.
+
+    Results are keyed ``"A|B"`` with codes sorted and oriented from A to B.
+    Pairs from the previous build are reused from ``GEOMETRY_CACHE``; the
+    rest are computed in a single vectorized batch. The cache is then
+    replaced by this build's pairs, so it never outgrows the route set.
+    """
+    global GEOMETRY_CACHE
+    keys = {}
+    for rt in routes:
+        src = airports.get(rt.get("source"))
+        dest = airports.get(rt.get("destination"))
+        if not src or not dest or src["code"] == dest["code"]:
+            continue
+        a, b = sorted((src, dest), key=lambda ap: ap["code"])
+        keys[(a["code"], b["code"], a["lat"], a["lon"], b["lat"], b["lon"])] = None
+    cache = {k: GEOMETRY_CACHE[k] for k in keys if k in GEOMETRY_CACHE}
+    missing = [k for k in keys if k not in cache]
+    for k, path in zip(missing, great_circle_paths([k[2:] for k in missing])):
+        cache[k] = path
+    GEOMETRY_CACHE = cache
+    return {f"{k[0]}|{k[1]}": cache[k] for k in keys}
+
+
+def _reverse_path(segments: list) -> list:
+    return [seg[::-1] for seg in segments[::-1]]
+
+
+# Geometry oriented per airport ({code: {other: segments}}) and its source
+ROUTE_GEOMETRY_INDEX = None
+ROUTE_GEOMETRY_SOURCE = None
+
+
+def get_route_geometry_index() -> Dict[str, Dict[str, list]]:
+    """Return route geometry grouped by airport, reloading if the file changed."""
+    global ROUTE_GEOMETRY_INDEX, ROUTE_GEOMETRY_SOURCE
+    path = ROUTE_GEOMETRY_PATH
+    mtime = path.stat().st_mtime_ns if path.exists() else None
+    if ROUTE_GEOMETRY_INDEX is None or ROUTE_GEOMETRY_SOURCE != (str(path), mtime):
+        data = load_json(path, {})
+        index: Dict[str, Dict[str, list]] = {}
+        for key, segments in (data if isinstance(data, dict) else {}).items():
+            a, _, b = key.partition("|")
+            index.setdefault(a, {})[b] = segments
+            index.setdefault(b, {})[a] = _reverse_path(segments)
+        ROUTE_GEOMETRY_INDEX = index
+        ROUTE_GEOMETRY_SOURCE = (str(path), mtime)
+    return ROUTE_GEOMETRY_INDEX
+
+
+def _route_key(route: dict) -> tuple:
+    return (route.get("airline"), route.get("flight_number"), route.get("source"), route.get("destination"))
+
+
+class RouteIndex:
+    """In-memory index of collected routes by airport pair, airport and airline.
+
+    Each pair keeps its flights keyed by ``(airline, flight_number)`` so
+    aggregates are built from just the matching pairs. ``update_routes``
+    applies its changes incrementally instead of rebuilding the index, so
+    updates and queries are serialized by ``lock``.
+    """
+
+    def __init__(self, routes=()):
+        self.lock = threading.Lock()
+        self.pairs: Dict[tuple, Dict[tuple, dict]] = {}
+        self.by_source: Dict[str, Dict[tuple, None]] = {}
+        self.by_destination: Dict[str, Dict[tuple, None]] = {}
+        self.by_airline: Dict[str, Dict[tuple, int]] = {}
+        for route in routes:
+            self._upsert(route)
+
+    def upsert(self, route: dict):
+        with self.lock:
+            self._upsert(route)
+
+    def remove(self, key: tuple):
+        with self.lock:
+            self._remove(key)
+
+    def _upsert(self, route: dict):
+        airline, number, source, destination = _route_key(route)
+        pair = (source, destination)
+        flights = self.pairs.setdefault(pair, {})
+        if (airline, number) not in flights:
+            self.by_source.setdefault(source, {})[pair] = None
+            self.by_destination.setdefault(destination, {})[pair] = None
+            counts = self.by_airline.setdefault(airline, {})
+            counts[pair] = counts.get(pair, 0) + 1
+        flights[(airline, number)] = {
+            "airline": airline,
+            "flight_number": number,
+            "status": route.get("status"),
+            "first_seen": route.get("first_seen"),
+            "last_seen": route.get("last_seen"),
+        }
+
+    def _remove(self, key: tuple):
+        airline, number, source, destination = key
+        pair = (source, destination)
+        flights = self.pairs.get(pair)
+        if not flights or flights.pop((airline, number), None) is None:
+            return
+        counts = self.by_airline[airline]
+        counts[pair] -= 1
+        if not counts[pair]:
+            del counts[pair]
+            if not counts:
+                del self.by_airline[airline]
+        if not flights:
+            del self.pairs[pair]
+            for index, code in ((self.by_source, source), (self.by_destination, destination)):
+                index[code].pop(pair, None)
+                if not index[code]:
+                    del index[code]
+
+    def _aggregate(self, pair: tuple, airline: str = None, status: str = None):
+        """Summarize a pair's flights, or return None if none match."""
+        flights = [
+            f for f in self.pairs.get(pair, {}).values()
+            if (airline is None or f["airline"] == airline)
+            and (status is None or f["status"] == status)
+        ]
+        if not flights:
+            return None
+        return {
+            "source": pair[0],
+            "destination": pair[1],
+            "airlines": sorted({f["airline"] for f in flights if f["airline"]}),
+            "status": "Active" if any(f["status"] == "Active" for f in flights) else "Not Active",
+            "last_seen": max((f["last_seen"] or "" for f in flights), default=None) or None,
+            "flights": flights,
+        }
+
+    def query(self, source=None, destination=None, airline=None, status=None, offset=0, limit=100):
+        """Return a page of pair aggregates and the offset of the next page."""
+        with self.lock:
+            return self._query(source, destination, airline, status, offset, limit)
+
+    def _query(self, source, destination, airline, status, offset, limit):
+        if source and destination:
+            candidates = [(source, destination)]
+        elif source:
+            candidates = self.by_source.get(source, {})
+        elif destination:
+            candidates = self.by_destination.get(destination, {})
+        elif airline:
+            candidates = self.by_airline.get(airline, {})
+        else:
+            candidates = self.pairs
+        results = []
+        skipped = 0
+        for pair in candidates:
+            agg = self._aggregate(pair, airline, status)
+            if agg is None:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(results) == limit:
+                return results, offset + limit
+            results.append(agg)
+        return results, None
+
+
+# Route index and the (path, mtime_ns) of the routes file it reflects
+ROUTE_INDEX = None
+ROUTE_INDEX_SOURCE = None
+
+
+def _file_source(path: Path):
+    return (str(path), path.stat().st_mtime_ns if path.exists() else None)
+
+
+def get_route_index() -> RouteIndex:
+    """Return the route index, rebuilding it if the routes file changed."""
+    global ROUTE_INDEX, ROUTE_INDEX_SOURCE
+    source = _file_source(ROUTES_DB_PATH)
+    if ROUTE_INDEX is None or ROUTE_INDEX_SOURCE != source:
+        routes = load_json(ROUTES_DB_PATH, [])
+        ROUTE_INDEX = RouteIndex(routes if isinstance(routes, list) else [])
+        ROUTE_INDEX_SOURCE = source
+    return ROUTE_INDEX
+
+
+def _fold(text: str) -> str:
+    """Case- and accent-insensitive form used by the airport search."""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).casefold().strip()
+
+
+class AirportSearch:
+    """Prefix index over airport codes, names, municipalities and countries.
+
+    Every searchable term is kept in one sorted list, so a prefix maps to a
+    contiguous slice found by bisection. Matches rank by field (codes, then
+    names, municipalities and countries) and then by number of routes,
+    folded into one integer key per term. Prefixes matching more than
+    SCAN_LIMIT terms keep their full ranking precomputed.
+    """
+
+    CODE, NAME, WORD, MUNICIPALITY, COUNTRY = range(5)
+    MAX_RESULTS = 50
+    SCAN_LIMIT = 256
+    WALK_CHUNK = 64
+
+    def __init__(self, airports):
+        self.airports = [a for a in airports if isinstance(a, dict) and a.get("code")]
+        # Airport order by popularity then name; a term's key is
+        # tier * len(airports) + this rank
+        order = sorted(
+            range(len(self.airports)),
+            key=lambda i: (-len(self.airports[i].get("routes") or []), self.airports[i].get("name") or ""),
+        )
+        base = [0] * len(order)
+        for rank, i in enumerate(order):
+            base[i] = rank
+        n = len(self.airports)
+        entries = []
+        self.words: List[tuple] = []
+        for i, ap in enumerate(self.airports):
+            terms = {}
+            for value, tier in (
+                (ap.get("code"), self.CODE),
+                (ap.get("iata"), self.CODE),
+                (ap.get("icao"), self.CODE),
+                (ap.get("name"), self.NAME),
+                (ap.get("municipality"), self.MUNICIPALITY),
+                (ap.get("country"), self.COUNTRY),
+            ):
+                term = _fold(value)
+                if not term:
+                    continue
+                word_tier = self.WORD if tier == self.NAME else tier
+                for word, t in [(term, tier)] + [(w, word_tier) for w in term.split()]:
+                    if t < terms.get(word, self.COUNTRY + 1):
+                        terms[word] = t
+            self.words.append(tuple(terms))
+            entries.extend((term, tier * n + base[i], i) for term, tier in terms.items())
+        entries.sort()
+        self.terms = [e[0] for e in entries]
+        self.keys = np.array([e[1] for e in entries], dtype=np.int64)
+        self.ids = np.array([e[2] for e in entries], dtype=np.int32)
+        # Full rankings for prefixes matching more than SCAN_LIMIT terms, so
+        # no query sorts a long slice (e.g. "air" for every "Airport")
+        self.ranked: Dict[str, tuple] = {}
+        self._precompute("", 0, len(entries))
+
+    def _rank(self, lo: int, hi: int):
+        """Return ``(ids, keys)`` of the airports in a slice, best key first."""
+        keys = self.keys[lo:hi]
+        order = np.argsort(keys, kind="stable")
+        ids = self.ids[lo:hi][order]
+        _, first = np.unique(ids, return_index=True)
+        first.sort()
+        return ids[first], keys[order][first]
+
+    def _precompute(self, prefix: str, lo: int, hi: int):
+        if hi - lo <= self.SCAN_LIMIT:
+            return
+        if prefix:
+            self.ranked[prefix] = self._rank(lo, hi)
+        i = lo
+        while i < hi:
+            if self.terms[i] == prefix:
+                i = bisect_right(self.terms, prefix, i, hi)
+                continue
+            child = self.terms[i][: len(prefix) + 1]
+            j = bisect_left(self.terms, child + "\uffff", i, hi)
+            self._precompute(child, i, j)
+            i = j
+
+    def _range(self, token: str):
+        lo = bisect_left(self.terms, token)
+        return lo, bisect_left(self.terms, token + "\uffff", lo)
+
+    def _matches(self, token: str):
+        """Return ``(ids, keys)`` of airports with a term starting with ``token``."""
+        if token in self.ranked:
+            return self.ranked[token]
+        return self._rank(*self._range(token))
+
+    def search(self, query: str, limit: int = 10):
+        tokens = _fold(query).split()
+        if not tokens:
+            return []
+        # Rank on the whole query (e.g. "new york" as a name prefix), else
+        # require every word to prefix some term of the airport
+        ids, keys = self._matches(" ".join(tokens))
+        best = dict(zip(ids[:limit].tolist(), keys[:limit].tolist()))
+        if len(tokens) > 1:
+            # Walk the most selective word's ranking and check the others
+            # against each airport's words, until ``limit`` airports match
+            # or the rest rank below the whole-query matches
+            ranges = {t: self._range(t) for t in tokens}
+            tokens.sort(key=lambda t: ranges[t][1] - ranges[t][0])
+            rest = tokens[1:]
+            cutoff = max(best.values()) if len(best) == limit else None
+            ids, keys = self._matches(tokens[0])
+            found = 0
+            for start in range(0, len(ids), self.WALK_CHUNK):
+                chunk = zip(ids[start:start + self.WALK_CHUNK].tolist(), keys[start:start + self.WALK_CHUNK].tolist())
+                for i, key in chunk:
+                    if found == limit or (cutoff is not None and key > cutoff):
+                        break
+                    words = self.words[i]
+                    if all(any(w.startswith(t) for w in words) for t in rest):
+                        found += 1
+                        best[i] = min(key, best.get(i, key))
+                else:
+                    continue
+                break
+        ranked = sorted(best.items(), key=lambda item: item[1])[:limit]
+        return [self.airports[i] for i, _ in ranked]
+
+
+# Airport search index and the (path, mtime_ns) of the airports file it reflects
+AIRPORT_SEARCH = None
+AIRPORT_SEARCH_SOURCE = None
+
+
+def get_airport_search() -> AirportSearch:
+    """Return the airport search index, rebuilding it if the airports changed."""
+    global AIRPORT_SEARCH, AIRPORT_SEARCH_SOURCE
+    source = _file_source(AIRPORTS_FULL_PATH)
+    if AIRPORT_SEARCH is None or AIRPORT_SEARCH_SOURCE != source:
+        airports = load_json(AIRPORTS_FULL_PATH, [])
+        AIRPORT_SEARCH = AirportSearch(airports if isinstance(airports, list) else [])
+        AIRPORT_SEARCH_SOURCE = source
+    return AIRPORT_SEARCH
+
+
+class FacetIndex:
+    """Airline and country facets over the airports shown on the map.
+
+    ``airline_airports`` maps an airline code to ``{airport: route count}``
+    and ``country_airports`` a country code to its airport codes, so filter
+    combinations resolve with dictionary lookups.
+    """
+
+    def __init__(self, airports):
+        self.airport_routes: Dict[str, int] = {}
+        self.airport_country: Dict[str, str] = {}
+        self.airline_airports: Dict[str, Dict[str, int]] = {}
+        self.airline_names: Dict[str, str] = {}
+        self.country_airports: Dict[str, set] = {}
+        self.country_names: Dict[str, str] = {}
+        for ap in airports:
+            if not isinstance(ap, dict) or not ap.get("code"):
+                continue
+            code = ap["code"]
+            country = ap.get("country_code") or ""
+            routes = ap.get("routes") or []
+            self.airport_routes[code] = len(routes)
+            self.airport_country[code] = country
+            self.country_airports.setdefault(country, set()).add(code)
+            self.country_names[country] = ap.get("country") or country
+            for r in routes:
+                airline = r.get("airline_code") or r.get("airline") or ""
+                counts = self.airline_airports.setdefault(airline, {})
+                counts[code] = counts.get(code, 0) + 1
+                self.airline_names.setdefault(airline, r.get("airline") or airline)
+        self.name_codes = {name: code for code, name in self.airline_names.items()}
+        self.airline_routes = {code: sum(c.values()) for code, c in self.airline_airports.items()}
+
+    def resolve_airline(self, airline: str):
+        """Accept an airline code or display name and return its code."""
+        if not airline or airline in self.airline_airports:
+            return airline
+        return self.name_codes.get(airline, airline)
+
+    def query(self, airline: str = None, countries=None) -> dict:
+        """Return airport route counts and facet counts for a filter combination.
+
+        Airline counts are limited to the selected countries and country
+        counts to the selected airline, as the dropdowns need.
+        """
+        airline = self.resolve_airline(airline)
+        in_countries = None
+        if countries:
+            in_countries = set().union(*(self.country_airports.get(c, ()) for c in countries))
+        counts = self.airline_airports.get(airline, {}) if airline else self.airport_routes
+        airports = {
+            code: n for code, n in counts.items()
+            if n and (in_countries is None or code in in_countries)
+        }
+        airlines = []
+        for code, per_airport in self.airline_airports.items():
+            if in_countries is None:
+                routes = self.airline_routes[code]
+            else:
+                routes = sum(n for ap, n in per_airport.items() if ap in in_countries)
+            if routes:
+                airlines.append({"code": code, "name": self.airline_names[code], "routes": routes})
+        airlines.sort(key=lambda a: a["name"])
+        country_counts: Dict[str, int] = {}
+        for code, n in counts.items():
+            if n:
+                country = self.airport_country[code]
+                country_counts[country] = country_counts.get(country, 0) + 1
+        country_list = sorted(
+            ({"code": c, "name": self.country_names[c], "airports": n} for c, n in country_counts.items()),
+            key=lambda c: c["name"],
+        )
+        return {"airline": airline, "airports": airports, "airlines": airlines, "countries": country_list}
+
+
+# Facet index over airports.json, and active icao24s per airline over
+# active_planes.json, each with the (path, mtime_ns) it reflects
+FACETS = None
+FACETS_SOURCE = None
+ACTIVE_FACETS: Dict[str, List[str]] = {}
+ACTIVE_FACETS_SOURCE = None
+
+
+def get_facets() -> FacetIndex:
+    """Return the facet index, rebuilding it if the UI airports changed."""
+    global FACETS, FACETS_SOURCE
+    source = _file_source(AIRPORTS_PATH)
+    if FACETS is None or FACETS_SOURCE != source:
+        airports = load_json(AIRPORTS_PATH, [])
+        FACETS = FacetIndex(airports if isinstance(airports, list) else [])
+        FACETS_SOURCE = source
+    return FACETS
+
+
+def get_active_facets() -> Dict[str, List[str]]:
+    """Return tracked icao24s grouped by airline code."""
+    global ACTIVE_FACETS, ACTIVE_FACETS_SOURCE
+    source = _file_source(ACTIVE_PLANES_PATH)
+    if ACTIVE_FACETS_SOURCE != source:
+        grouped: Dict[str, List[str]] = {}
+        active = load_json(ACTIVE_PLANES_PATH, {})
+        for icao24, af in (active.items() if isinstance(active, dict) else ()):
+            grouped.setdefault(af.get("airline") or "", []).append(icao24)
+        ACTIVE_FACETS = grouped
+        ACTIVE_FACETS_SOURCE = source
+    return ACTIVE_FACETS
+
+
+# Packed binary payloads keyed by name and invalidated by the source file's
+# (path, mtime_ns, size)
+PACKED_CACHE: Dict[str, tuple] = {}
+
+
+def _packed(name: str, path: Path, build) -> bytes:
+    """Return a cached binary payload built from ``path`` by ``build``."""
+    st = path.stat()
+    source = (str(path), st.st_mtime_ns, st.st_size)
+    cached = PACKED_CACHE.get(name)
+    if cached and cached[0] == source:
+        return cached[1]
+    payload = build(load_json(path, None))
+    PACKED_CACHE[name] = (source, payload)
+    return payload
+
+
+def pack_active_planes(active) -> bytes:
+    """Pack tracked flights for the canvas renderer.
+
+    Layout: uint32 count, ``count`` float32 ``[lat, lon]`` pairs, then a UTF-8
+    JSON array of ``[icao24, callsign, airline, flight_number, origin,
+    first_seen, last_updated]`` rows in the same order.
+    """
+    coords = []
+    meta = []
+    for icao24, f in (active or {}).items():
+        coord = f.get("last_coord")
+        if not isinstance(coord, list) or len(coord) != 2 or None in coord:
+            continue
+        coords.append(coord)
+        meta.append([
+            icao24,
+            f.get("callsign"),
+            f.get("airline"),
+            f.get("flight_number"),
+            f.get("origin_name") or f.get("origin"),
+            f.get("first_seen"),
+            f.get("last_updated"),
+        ])
+    header = np.array([len(coords)], dtype="<u4").tobytes()
+    body = np.array(coords, dtype="<f4").reshape(-1, 2).tobytes()
+    return header + body + orjson.dumps(meta)
+
+
+def encode_cursor(index: int, offset: int, mtime: int) -> str:
+    """Encode an export position as an opaque URL-safe token."""
+    return base64.urlsafe_b64encode(orjson.dumps([index, offset, mtime])).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+    """Return ``(index, offset, mtime)`` from an export cursor or raise ``ValueError``."""
+    try:
+        index, offset, mtime = orjson.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise ValueError("invalid cursor") from None
+    if not all(isinstance(v, int) and v >= 0 for v in (index, offset, mtime)):
+        raise ValueError("invalid cursor")
+    return index, offset, mtime
+
+
+def export_records(path: Path, container: str, to_row, match, cursor=None, limit: int = None):
+    """Yield matching records of a dataset as NDJSON lines, streamed from disk.
+
+    The file is read incrementally, so memory stays bounded however many
+    rows match. When ``limit`` rows were sent and more match, a final
+    ``{"next_cursor": ...}`` line carries the position to resume from. A
+    cursor issued for the same file contents seeks straight to its byte
+    offset; after a rewrite it falls back to skipping records by position.
+    If the file turns out malformed mid-read (rewritten under the reader),
+    the stream ends with an ``{"error": ..., "next_cursor": ...}`` line
+    positioned after the last row sent.
+    """
+    if not path.exists():
+        return
+    mtime = path.stat().st_mtime_ns
+    index, offset, skip = 0, 0, 0
+    if cursor:
+        index, offset, cursor_mtime = cursor
+        if cursor_mtime != mtime:
+            index, offset, skip = 0, 0, index
+    sent = 0
+    last = cursor or (0, 0, mtime)
+    try:
+        for record, end in iter_json_records(path, container, offset):
+            index += 1
+            if index <= skip:
+                continue
+            row = to_row(record)
+            if not match(row):
+                continue
+            if limit and sent == limit:
+                yield orjson.dumps({"next_cursor": encode_cursor(*last)}) + b"\n"
+                return
+            yield orjson.dumps(row) + b"\n"
+            sent += 1
+            last = (index, end, mtime)
+    except ValueError as exc:
+        yield orjson.dumps({"error": f"export interrupted: {exc}", "next_cursor": encode_cursor(*last)}) + b"\n"
+
+
+def export_filter(airline=None, airport=None, status=None, since=None, until=None,
+                  airports=(), timestamp="last_seen"):
+    """Build a row predicate for the export endpoints.
+
+    ``airports`` names the row fields compared against ``airport``; ``since``
+    and ``until`` bound the ISO timestamp in ``timestamp`` (inclusive).
+    """
+    def match(row):
+        if airline and row.get("airline") != airline:
+            return False
+        if airport and not any(row.get(k) == airport for k in airports):
+            return False
+        if status and row.get("status") != status:
+            return False
+        ts = row.get(timestamp) or ""
+        if since and ts < since:
+            return False
+        if until and ts > until:
+            return False
+        return True
+    return match
+
+
+# Loaded frequency counters with the (path, mtime_ns) they were read from
+ROUTE_FREQUENCY = None
+ROUTE_FREQUENCY_SOURCE = None
+
+
+def get_route_frequency() -> RouteFrequency:
+    """Return the route frequency counters, reloading them if the file changed."""
+    global ROUTE_FREQUENCY, ROUTE_FREQUENCY_SOURCE
+    path = ROUTE_FREQUENCY_PATH
+    mtime = path.stat().st_mtime_ns if path.exists() else None
+    if ROUTE_FREQUENCY is None or ROUTE_FREQUENCY_SOURCE != (str(path), mtime):
+        data = load_json(path, {})
+        ROUTE_FREQUENCY = RouteFrequency.from_json(data) if isinstance(data, dict) else RouteFrequency()
+        ROUTE_FREQUENCY_SOURCE = (str(path), mtime)
+    return ROUTE_FREQUENCY
+
+
+def save_route_frequency(freq: RouteFrequency):
+    """Persist the counters and remember them as the loaded copy."""
+    global ROUTE_FREQUENCY, ROUTE_FREQUENCY_SOURCE
+    write_json(ROUTE_FREQUENCY_PATH, freq.to_json())
+    ROUTE_FREQUENCY = freq
+    ROUTE_FREQUENCY_SOURCE = (str(ROUTE_FREQUENCY_PATH), ROUTE_FREQUENCY_PATH.stat().st_mtime_ns)
+
+
+# Position history: one segment per UTC hour. ``.ids`` lists the segment's
+# icao24 dictionary, one per line; ``.bin`` holds one frame per snapshot, a
+# ``<HI`` header (seconds into the hour, payload length) and a zlib payload of
+# delta-encoded uint32 ids followed by int32 latitudes and longitudes scaled
+# by HISTORY_SCALE.
+HISTORY_SCALE = 10000
+HISTORY_FRAME = struct.Struct("<HI")
+HISTORY_RETENTION_HOURS = int(os.environ.get("HISTORY_RETENTION_HOURS", "48"))
+# Segment indexes keyed by path: frame offsets, dictionary and bytes read so far
+HISTORY_SEGMENTS: Dict[str, dict] = {}
+HISTORY_LOCK = threading.Lock()
+# Decoded frames keyed by (path, offset); segments are append-only
+HISTORY_FRAMES: "OrderedDict[tuple, tuple]" = OrderedDict()
+HISTORY_FRAME_CACHE = 256
+
+
+def _history_path(hour: int) -> Path:
+    return HISTORY_DIR / f"positions-{datetime.utcfromtimestamp(hour):%Y%m%d%H}.bin"
+
+
+def _history_segment(path: Path) -> dict:
+    """Return the index of a segment, reading only what was appended since last time."""
+    key = str(path)
+    with HISTORY_LOCK:
+        seg = HISTORY_SEGMENTS.get(key)
+        ids_path = path.with_suffix(".ids")
+        try:
+            size = path.stat().st_size
+            ids_size = ids_path.stat().st_size
+        except FileNotFoundError:
+            HISTORY_SEGMENTS.pop(key, None)
+            return None
+        if seg is None or size < seg["size"] or ids_size < seg["ids_size"]:
+            seg = {"size": 0, "ids_size": 0, "frames": [], "times": [], "ids": [], "lookup": {}}
+            HISTORY_SEGMENTS[key] = seg
+        if ids_size > seg["ids_size"]:
+            with ids_path.open("rb") as f:
+                f.seek(seg["ids_size"])
+                data = f.read(ids_size - seg["ids_size"])
+            data = data[:data.rfind(b"\n") + 1]
+            for icao24 in data.decode().splitlines():
+                seg["lookup"][icao24] = len(seg["ids"])
+                seg["ids"].append(icao24)
+            seg["ids_size"] += len(data)
+        if size > seg["size"]:
+            with path.open("rb") as f:
+                f.seek(seg["size"])
+                while seg["size"] + HISTORY_FRAME.size <= size:
+                    ts, length = HISTORY_FRAME.unpack(f.read(HISTORY_FRAME.size))
+                    start = seg["size"] + HISTORY_FRAME.size
+                    if start + length > size:
+                        break  # frame still being written
+                    seg["frames"].append((start, length))
+                    seg["times"].append(ts)
+                    seg["size"] = start + length
+                    f.seek(seg["size"])
+        return seg
+
+
+def _history_frame(path: Path, start: int, length: int):
+    """Decode one frame into (ids, lats, lons) arrays."""
+    key = (str(path), start)
+    frame = HISTORY_FRAMES.get(key)
+    if frame is None:
+        with path.open("rb") as f:
+            f.seek(start)
+            raw = zlib.decompress(f.read(length))
+        cols = np.frombuffer(raw, dtype="<i4").reshape(3, -1)
+        ids = np.cumsum(cols[0].view("<u4"), dtype=np.int64)
+        frame = (ids, cols[1] / HISTORY_SCALE, cols[2] / HISTORY_SCALE)
+        with HISTORY_LOCK:
+            HISTORY_FRAMES[key] = frame
+            while len(HISTORY_FRAMES) > HISTORY_FRAME_CACHE:
+                HISTORY_FRAMES.popitem(last=False)
+    return frame
+
+
+def append_history(states, ts: int):
+    """Append one snapshot's positions to the segment for its hour."""
+    hour = ts - ts % 3600
+    path = _history_path(hour)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    seg = _history_segment(path) or {"ids": [], "lookup": {}}
+    lookup = dict(seg["lookup"])
+    added = []
+    rows = {}
+    for s in states:
+        icao24, lon, lat = s[0], s[5], s[6]
+        if not icao24 or lat is None or lon is None:
+            continue
+        if icao24 not in lookup:
+            lookup[icao24] = len(lookup)
+            added.append(icao24)
+        rows[lookup[icao24]] = (lat, lon)
+    if added:
+        with path.with_suffix(".ids").open("a") as f:
+            f.write("".join(f"{icao24}\n" for icao24 in added))
+    ids = np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+    coords = np.array([rows[i] for i in ids.tolist()], dtype=float).reshape(-1, 2)
+    cols = np.empty((3, len(ids)), dtype="<i4")
+    cols[0] = np.diff(ids, prepend=0)
+    cols[1:] = np.round(coords.T * HISTORY_SCALE)
+    payload = zlib.compress(cols.tobytes(), 6)
+    with path.open("ab") as f:
+        f.write(HISTORY_FRAME.pack(ts - hour, len(payload)) + payload)
+    prune_history(hour - HISTORY_RETENTION_HOURS * 3600)
+
+
+def prune_history(before: int):
+    """Delete history segments for hours starting before ``before``."""
+    cutoff = f"positions-{datetime.utcfromtimestamp(before):%Y%m%d%H}"
+    for p in HISTORY_DIR.glob("positions-*"):
+        if p.stem < cutoff:
+            p.unlink(missing_ok=True)
+            with HISTORY_LOCK:
+                HISTORY_SEGMENTS.pop(str(p.with_suffix(".bin")), None)
+
+
+def history_positions(at: int, bbox=None):
+    """Return the latest snapshot recorded at or before ``at``.
+
+    Only the segment covering ``at`` (or the previous hour, if the hour has
+    no earlier frame) is indexed, and only the matching frame is decoded.
+    ``bbox`` is ``(west, south, east, north)``.
+    """
+    hour = at - at % 3600
+    for start in (hour, hour - 3600):
+        path = _history_path(start)
+        seg = _history_segment(path)
+        if not seg:
+            continue
+        i = bisect_right(seg["times"], min(at - start, 3599)) - 1
+        if i < 0:
+            continue
+        ids, lats, lons = _history_frame(path, *seg["frames"][i])
+        if bbox:
+            west, south, east, north = bbox
+            mask = (lats >= south) & (lats <= north)
+            if west <= east:
+                mask &= (lons >= west) & (lons <= east)
+            else:
+                mask &= (lons >= west) | (lons <= east)
+            ids, lats, lons = ids[mask], lats[mask], lons[mask]
+        names = seg["ids"]
+        return {
+            "time": datetime.utcfromtimestamp(start + seg["times"][i]).isoformat() + "Z",
+            "positions": [
+                [names[k], lat, lon]
+                for k, lat, lon in zip(ids.tolist(), lats.tolist(), lons.tolist())
+                if k < len(names)
+            ],
+        }
+    return {"time": None, "positions": []}
+
+
+# Background jobs for the update endpoints. One worker runs them in order so
+# ingestions never overlap; a request for a kind of job that is already queued
+# or running gets that job back instead of starting another.
+JOBS: "OrderedDict[str, dict]" = OrderedDict()
+JOB_FUTURES: Dict[str, Future] = {}
+JOBS_LOCK = threading.Lock()
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="update-job")
+MAX_JOBS = 50
+JOB_CONTEXT = threading.local()
+
+
+def mark_stage(name: str):
+    """Start stage ``name`` of the running job, closing the previous stage."""
+    job = getattr(JOB_CONTEXT, "job", None)
+    if job is None:
+        return
+    _close_stage(job)
+    job["stage"] = name
+    JOB_CONTEXT.stage_started = time.perf_counter()
+
+
+def _close_stage(job: dict):
+    if job.get("stage"):
+        elapsed = time.perf_counter() - JOB_CONTEXT.stage_started
+        job["stages"].append({"name": job["stage"], "seconds": round(elapsed, 4)})
+        job["stage"] = None
+
+
+def _run_job(job: dict, func):
+    JOB_CONTEXT.job = job
+    job["status"] = "running"
+    job["started"] = datetime.utcnow().isoformat() + "Z"
+    try:
+        job["result"] = func()
+        job["status"] = "done"
+    except Exception as exc:
+        job["status"] = "failed"
+        job["error"] = str(exc) or exc.__class__.__name__
+    finally:
+        _close_stage(job)
+        job["finished"] = datetime.utcnow().isoformat() + "Z"
+        JOB_CONTEXT.job = None
+
+
+def submit_job(kind: str, func) -> dict:
+    """Queue ``func`` as a background job, coalescing with an in-flight one."""
+    with JOBS_LOCK:
+        for job in JOBS.values():
+            if job["kind"] == kind and job["status"] in ("queued", "running"):
+                return job
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "created": datetime.utcnow().isoformat() + "Z",
+            "started": None,
+            "finished": None,
+            "stage": None,
+            "stages": [],
+            "result": None,
+            "error": None,
+        }
+        JOBS[job["id"]] = job
+        for old_id in [i for i, j in JOBS.items() if j["status"] in ("done", "failed")]:
+            if len(JOBS) <= MAX_JOBS:
+                break
+            JOBS.pop(old_id)
+            JOB_FUTURES.pop(old_id, None)
+        JOB_FUTURES[job["id"]] = JOB_EXECUTOR.submit(_run_job, job, func)
+    return job
+
+
+def job_snapshot(job: dict) -> dict:
+    """Return a copy of a job safe to serialize while it is running."""
+    snapshot = dict(job)
+    snapshot["stages"] = list(job["stages"])
+    return snapshot
+
+
+def wait_for_job(job_id: str, timeout: float = None) -> dict:
+    """Block until a job finishes and return it."""
+    future = JOB_FUTURES.get(job_id)
+    if future is not None:
+        future.result(timeout)
+    return job_snapshot(JOBS[job_id])
+
+
+# Ingestion cadence. POLL_INTERVAL is the delay after a fresh snapshot; it
+# doubles up to POLL_MAX_INTERVAL while the feed repeats itself. retry_at
+# holds off upstream requests after a 429. Set POLL_ENABLED=1 to have the
+# server schedule /update-routes itself.
+OPENSKY_STATES_URL = "https://opensky-network.org/api/states/all"
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", "10"))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", "300"))
+POLL_ENABLED = os.environ.get("POLL_ENABLED", "0") == "1"
+INGEST_STATE = {"interval": POLL_INTERVAL, "retry_at": 0.0}
+POLL_STOP = threading.Event()
+
+
+def next_poll_delay(fresh: bool) -> float:
+    """Return the delay before the next poll after a fresh or repeated snapshot."""
+    if fresh:
+        INGEST_STATE["interval"] = POLL_INTERVAL
+    else:
+        INGEST_STATE["interval"] = min(INGEST_STATE["interval"] * 2, POLL_MAX_INTERVAL)
+    return INGEST_STATE["interval"]
+
+
+def note_rate_limit(headers) -> float:
+    """Hold off upstream requests for the period a 429 response asks for."""
+    try:
+        wait = float(headers.get("X-Rate-Limit-Retry-After-Seconds"))
+    except (TypeError, ValueError):
+        wait = min(INGEST_STATE["interval"] * 2, POLL_MAX_INTERVAL)
+    INGEST_STATE["retry_at"] = time.time() + wait
+    return wait
+
+
+def _poll_loop():
+    while not POLL_STOP.is_set():
+        job = submit_job("routes", update_routes)
+        try:
+            result = wait_for_job(job["id"])["result"] or {}
+        except Exception:
+            result = {}
+        delay = result.get("next_poll_in") or next_poll_delay(fresh=False)
+        POLL_STOP.wait(delay)
+
+
+# Streaming ingestion. FEED selects the source of aircraft positions:
+# "opensky" polls the REST snapshot through update_routes, other names come
+# from FEED_ADAPTERS and stream messages into a StreamIngester. A streamed
+# flight is finalized once nothing was heard from it for FEED_TIMEOUT
+# seconds; results are written every FEED_FLUSH_INTERVAL seconds.
+FEED = os.environ.get("FEED", "opensky")
+FEED_HOST = os.environ.get("FEED_HOST", "127.0.0.1")
+FEED_PORT = int(os.environ.get("FEED_PORT", "30003"))
+FEED_TIMEOUT = float(os.environ.get("FEED_TIMEOUT", "300"))
+FEED_FLUSH_INTERVAL = float(os.environ.get("FEED_FLUSH_INTERVAL", "10"))
+FEED_RECONNECT_MAX = 60.0
+FEED_STOP = threading.Event()
+FEET_TO_M = 0.3048
+
+
+def parse_sbs(line: str):
+    """Parse an SBS-1 (BaseStation) ``MSG`` line into an observation dict.
+
+    Returns ``icao24`` plus whichever of ``callsign``, ``altitude`` (metres),
+    ``lat``/``lon`` and ``on_ground`` the message carries, or None for other
+    message kinds and malformed lines.
+    """
+    fields = line.rstrip("\r\n").split(",")
+    if len(fields) < 22 or fields[0] != "MSG" or not fields[4]:
         return None
-    code = AIRPORTS_INDEX[idx]
-    ap = AIRPORTS_MAP.get(code)
-    if not ap:
+    msg = {"icao24": fields[4].strip().lower()}
+    try:
+        if fields[10].strip():
+            msg["callsign"] = fields[10].strip()
+        if fields[11]:
+            msg["altitude"] = float(fields[11]) * FEET_TO_M
+        if fields[14] and fields[15]:
+            msg["lat"] = float(fields[14])
+            msg["lon"] = float(fields[15])
+    except ValueError:
         return None
-    d = haversine(lat, lon, ap["lat"], ap["lon"])
-    return ap if d <= 30 else None
+    if fields[21]:
+        msg["on_ground"] = fields[21] not in ("0", "")
+    return msg
+
+
+class FeedAdapter(ABC):
+    """A continuous source of aircraft observations.
+
+    ``messages`` yields observation dicts (see parse_sbs) as they arrive and
+    None whenever the feed has been idle for ``idle_timeout`` seconds, so the
+    consumer can flush. It returns when the feed ends and raises OSError
+    when the connection fails; ``close`` interrupts it from another thread.
+    """
+
+    idle_timeout = 1.0
+
+    @abstractmethod
+    def messages(self):
+        ...
+
+    def close(self):
+        pass
+
+
+class SbsFeed(FeedAdapter):
+    """SBS-1/BaseStation messages read from a TCP port (dump1090: 30003)."""
+
+    def __init__(self, host: str = None, port: int = None):
+        self.host = host or FEED_HOST
+        self.port = port or FEED_PORT
+        self.sock = None
+
+    def messages(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=10)
+        self.sock.settimeout(self.idle_timeout)
+        buffer = b""
+        try:
+            while True:
+                try:
+                    chunk = self.sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not chunk:
+                    return
+                lines = (buffer + chunk).split(b"\n")
+                buffer = lines.pop()
+                for raw in lines:
+                    msg = parse_sbs(raw.decode("ascii", "replace"))
+                    if msg:
+                        yield msg
+        finally:
+            self.close()
+
+    def close(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+FEED_ADAPTERS = {"sbs": SbsFeed}
+
+
+class StreamIngester:
+    """Track flights from a streaming feed, one message at a time.
+
+    Observations are merged per aircraft, since SBS messages carry the
+    callsign, altitude and position separately. An untracked aircraft is
+    matched to an origin on its first position that passes the same
+    departure checks as polled states; tracked flights just move. Flights
+    are finalized by ``flush`` once silent for ``timeout`` seconds.
+    """
+
+    def __init__(self, feed: FeedAdapter, timeout: float = None, flush_interval: float = None):
+        self.feed = feed
+        self.timeout = FEED_TIMEOUT if timeout is None else timeout
+        self.flush_interval = FEED_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.aircraft: Dict[str, dict] = {}
+        self.active: Dict[str, dict] = {}
+        self.unresolved = UnresolvedTracker()
+        self.messages = 0
+
+    def load_airports(self):
+        config = load_config()
+        load_airport_index(set(config.get("flight_continents") or CONTINENTS.keys()))
+
+    def resume(self):
+        """Load the airport index and pick up flights tracked before a restart."""
+        self.load_airports()
+        active = load_json(ACTIVE_PLANES_PATH, {}, cache=False)
+        now = time.time()
+        for icao24 in active:
+            self.aircraft.setdefault(icao24, {})["heard"] = now
+        self.active = active
+        TRAILS.retain(active)
+
+    def state(self, icao24: str, info: dict) -> list:
+        """Return an aircraft's merged observations as an OpenSky state vector."""
+        return [
+            icao24, info.get("callsign", ""), "", None, info["heard"],
+            info.get("lon"), info.get("lat"), info.get("altitude"), info.get("on_ground", False),
+        ]
+
+    def observe(self, msg: dict, ts: float):
+        self.messages += 1
+        icao24 = msg["icao24"]
+        info = self.aircraft.setdefault(icao24, {})
+        info.update(msg)
+        info["heard"] = ts
+        af = self.active.get(icao24)
+        if af is not None and "callsign" in msg:
+            af["callsign"] = msg["callsign"]
+            af["airline"], af["flight_number"] = parse_callsign(msg["callsign"])
+        if "lat" not in msg:
+            return
+        lat, lon = msg["lat"], msg["lon"]
+        now = datetime.utcfromtimestamp(ts).isoformat() + "Z"
+        if af is not None:
+            af["last_coord"] = [lat, lon]
+            af["last_updated"] = now
+            TRAILS.append(icao24, lat, lon)
+            return
+        if not self.unresolved.admit(self.state(icao24, info), ts):
+            return
+        origin_ap = nearest_airport(lat, lon)
+        if not origin_ap:
+            self.unresolved.entries[icao24] = (ts + self.unresolved.ttl, info.get("on_ground", False))
+            return
+        callsign = info.get("callsign", "")
+        prefix, number = parse_callsign(callsign)
+        self.active[icao24] = {
+            "callsign": callsign,
+            "airline": prefix,
+            "flight_number": number,
+            "origin": origin_ap["code"],
+            "origin_name": origin_ap["name"],
+            "origin_coord": [lat, lon],
+            "last_coord": [lat, lon],
+            "first_seen": now,
+            "last_updated": now,
+        }
+        TRAILS.append(icao24, lat, lon)
+
+    def expire(self, ts: float):
+        """Forget aircraft silent for ``timeout`` and return finished route deltas."""
+        deltas = []
+        for icao24 in [k for k, info in self.aircraft.items() if ts - info["heard"] >= self.timeout]:
+            del self.aircraft[icao24]
+            self.unresolved.entries.pop(icao24, None)
+            af = self.active.pop(icao24, None)
+            if af is None:
+                continue
+            TRAILS.drop(icao24)
+            delta = finish_flight(icao24, af, AIRPORTS_LOOKUP)
+            if delta:
+                deltas.append(delta)
+        return deltas
+
+    def flush(self, ts: float) -> dict:
+        """Finalize silent flights and write routes, active flights and history."""
+        self.load_airports()
+        now = datetime.utcfromtimestamp(ts).isoformat() + "Z"
+        deltas = self.expire(ts)
+        append_history([
+            self.state(icao24, info) for icao24, info in self.aircraft.items() if "lat" in info
+        ], int(ts))
+        routes = record_routes(dict(self.active), deltas, now, {
+            "feed": FEED,
+            "feed_messages": self.messages,
+            "unresolved_aircraft": len(self.unresolved.entries),
+        })
+        refresh_airports()
+        return {"routes": routes, "active": len(self.active), "finished": len(deltas)}
+
+    def run(self, stop: threading.Event):
+        """Consume the feed until ``stop`` is set, reconnecting with backoff."""
+        delay = 1.0
+        next_flush = time.time() + self.flush_interval
+        while not stop.is_set():
+            try:
+                for msg in self.feed.messages():
+                    now = time.time()
+                    if msg is not None:
+                        self.observe(msg, now)
+                        delay = 1.0
+                    if now >= next_flush:
+                        # Writes share the job worker with /update-* jobs
+                        JOB_EXECUTOR.submit(self.flush, now).result()
+                        next_flush = now + self.flush_interval
+                    if stop.is_set():
+                        break
+            except OSError as exc:
+                logger.warning("feed connection failed: %s; retrying in %.0fs", exc, delay)
+            except Exception:
+                logger.exception("feed ingestion failed; retrying in %.0fs", delay)
+            stop.wait(delay)
+            delay = min(delay * 2, FEED_RECONNECT_MAX)
+
+
+STREAM = None
+
+
+def start_stream(name: str = None) -> StreamIngester:
+    """Start a StreamIngester on the named feed adapter in a background thread."""
+    global STREAM
+    STREAM = StreamIngester(FEED_ADAPTERS[name or FEED]())
+    STREAM.resume()
+    FEED_STOP.clear()
+    threading.Thread(target=STREAM.run, args=(FEED_STOP,), name="feed", daemon=True).start()
+    return STREAM
+
+
+def stop_stream():
+    global STREAM
+    FEED_STOP.set()
+    if STREAM is not None:
+        STREAM.feed.close()
+        STREAM = None
 
 
 @app.get("/airports.json")
@@ -176,28 +2524,47 @@ def get_airports():
     raise HTTPException(status_code=404, detail="airports data not found")
 
 
-@app.post("/update-airports")
+@app.get("/airports/search")
+def search_airports(q: str = "", limit: int = 10):
+    """Return airports whose code, name, municipality or country match ``q``."""
+    limit = max(1, min(limit, AirportSearch.MAX_RESULTS))
+    results = get_airport_search().search(q, limit)
+    keys = ("code", "iata", "icao", "name", "municipality", "country", "lat", "lon")
+    return {"results": [{k: ap.get(k) for k in keys} for ap in results]}
+
+
+@app.post("/update-airports", status_code=202)
+def post_update_airports():
+    """Queue an airports update and return its job."""
+    job = submit_job("airports", update_airports)
+    return {"job_id": job["id"], **job_snapshot(job)}
+
+
 def update_airports():
     """Download airport data from OurAirports and build routes from collected flights."""
+    return materialize_airports(fetch_airport_tables())
+
 
+def fetch_airport_tables() -> dict:
+    """Download airports, countries and airline names into AIRPORT_TABLES_PATH.
+
+    Airports keep every continent so the configured filter can change
+    without another download.
+    """
     airports_url = "https://raw.githubusercontent.com/davidmegginson/ourairports-data/master/airports.csv"
     countries_url = "https://raw.githubusercontent.com/davidmegginson/ourairports-data/master/countries.csv"
 
-    config = load_config()
-    allowed_continents = set(config.get("airport_continents") or CONTINENTS.keys())
-
     # Download airports from OurAirports
+    mark_stage("airports: download")
     resp = requests.get(airports_url)
     resp.raise_for_status()
     reader = csv.DictReader(resp.text.splitlines())
-    airports = {}
+    airports = []
 
     # Download countries to resolve ISO codes to readable names
     resp_countries = requests.get(countries_url)
     resp_countries.raise_for_status()
     country_map = {r["code"]: r["name"] for r in csv.DictReader(resp_countries.text.splitlines())}
-    latitudes = []
-    longitudes = []
     for row in reader:
         try:
             iata = row.get("iata_code")
@@ -210,37 +2577,21 @@ def update_airports():
             lon = float(row["longitude_deg"])
         except (ValueError, KeyError):
             continue
-        continent = row.get("continent") or ""
-        if allowed_continents and continent not in allowed_continents:
-            continue
         country_code = row.get("iso_country", "")
-        airports[key] = {
+        airports.append({
             "name": name,
             "code": key,
+            "type": row.get("type") or None,
+            "iata": iata or None,
+            "icao": icao or None,
+            "municipality": row.get("municipality") or None,
             "lat": lat,
             "lon": lon,
 
             "country_code": country_code,
             "country": country_map.get(country_code, country_code),
-            "continent": continent,
-            "routes": []
-        }
-        latitudes.append(lat)
-        longitudes.append(lon)
-
-    # Load collected route data
-    routes = load_json(ROUTES_DB_PATH, [])
-
-    # Self-clean invalid routes where source and destination are identical
-    cleaned_routes = []
-    for rt in routes:
-        src_code = rt.get("source")
-        dest_code = rt.get("destination")
-        if src_code and dest_code and src_code != dest_code:
-            cleaned_routes.append(rt)
-    if cleaned_routes != routes:
-        write_json(ROUTES_DB_PATH, cleaned_routes)
-    routes = cleaned_routes
+            "continent": row.get("continent") or "",
+        })
 
     # Build a mapping of airline codes to human readable names
     resp_airlines = requests.get(AIRLINES_URL)
@@ -258,6 +2609,60 @@ def update_airports():
         if icao and icao != "\\N":
             airline_names[icao] = name
 
+    tables = {"airports": airports, "airline_names": airline_names}
+    write_json(AIRPORT_TABLES_PATH, tables)
+    return tables
+
+
+# Ingestion marks the airports stale when routes change; refresh_airports
+# then rebuilds them from the local tables at most every
+# AIRPORTS_REFRESH_INTERVAL seconds.
+AIRPORTS_REFRESH_INTERVAL = float(os.environ.get("AIRPORTS_REFRESH_INTERVAL", "300"))
+AIRPORTS_STATE = {"stale": False, "materialized": 0.0}
+
+
+def refresh_airports():
+    """Rebuild the airport files after ingestion, throttled and without downloads.
+
+    Returns the materialize_airports result, or None when skipped. The
+    tables are downloaded only if none were stored yet.
+    """
+    if AIRPORTS_PATH.exists():
+        if not AIRPORTS_STATE["stale"]:
+            return None
+        if time.time() - AIRPORTS_STATE["materialized"] < AIRPORTS_REFRESH_INTERVAL:
+            return None
+    tables = load_json(AIRPORT_TABLES_PATH, None)
+    if not isinstance(tables, dict):
+        return update_airports()
+    return materialize_airports(tables)
+
+
+def materialize_airports(tables: dict):
+    """Write the airport files and indexes from airport tables and collected routes."""
+    config = load_config()
+    allowed_continents = set(config.get("airport_continents") or CONTINENTS.keys())
+    airports = {
+        ap["code"]: {**ap, "routes": []}
+        for ap in tables.get("airports") or []
+        if not allowed_continents or ap.get("continent") in allowed_continents
+    }
+    airline_names = tables.get("airline_names") or {}
+
+    # Load collected route data
+    mark_stage("airports: merge routes")
+    routes = load_json(ROUTES_DB_PATH, [])
+
+    # Self-clean invalid routes where source and destination are identical
+    cleaned_routes = []
+    for rt in routes:
+        src_code = rt.get("source")
+        dest_code = rt.get("destination")
+        if src_code and dest_code and src_code != dest_code:
+            cleaned_routes.append(rt)
+    if cleaned_routes != routes:
+        write_json(ROUTES_DB_PATH, cleaned_routes)
+    routes = cleaned_routes
 
     route_count = 0
     for rt in routes:
@@ -279,6 +2684,8 @@ def update_airports():
             "to": [dest["lat"], dest["lon"]],
             "from_name": src["name"],
             "to_name": dest["name"],
+            "from_code": src["code"],
+            "to_code": dest["code"],
         })
         dest["routes"].append({
             **route_details,
@@ -286,6 +2693,8 @@ def update_airports():
             "to": [src["lat"], src["lon"]],
             "from_name": dest["name"],
             "to_name": src["name"],
+            "from_code": dest["code"],
+            "to_code": src["code"],
         })
         route_count += 1
 
@@ -296,166 +2705,146 @@ def update_airports():
     if not airports_with_routes:
         airports_with_routes = list(airports.values())
 
+    mark_stage("airports: write")
     write_json(AIRPORTS_PATH, airports_with_routes)
     write_json(AIRPORTS_FULL_PATH, list(airports.values()))
+    write_json(ROUTE_GEOMETRY_PATH, build_route_geometry(airports, routes))
 
-    # Build lookup structures for nearest airport queries using the full list
-    global AIRPORTS_MAP, AIRPORTS_LAT_RANGE, AIRPORTS_LON_RANGE, AIRPORTS_TREE, AIRPORTS_INDEX
-    AIRPORTS_MAP = {a["code"]: a for a in airports.values()}
-    build_airport_tree(airports.values())
-    if latitudes and longitudes:
-        AIRPORTS_LAT_RANGE = (min(latitudes), max(latitudes))
-        AIRPORTS_LON_RANGE = (min(longitudes), max(longitudes))
-    else:
-        AIRPORTS_LAT_RANGE = (None, None)
-        AIRPORTS_LON_RANGE = (None, None)
+    # Rebuild lookup structures for nearest airport queries from the full list
+    mark_stage("airports: index")
+    load_airport_index()
+    get_airport_search()
+    get_facets()
 
     # Update stats file with airport counts
-    stats = load_json(STATS_PATH, {})
+    stats = load_json(STATS_PATH, {}, cache=False)
     now = datetime.utcnow().isoformat() + "Z"
     stats["airports_active"] = len(airports_with_routes)
     stats["airports_total"] = len(airports)
     stats["last_airports_update"] = now
     write_json(STATS_PATH, stats)
+    AIRPORTS_STATE.update(stale=False, materialized=time.time())
 
     return {"airports": len(airports_with_routes), "routes": route_count, "last_run": now}
 
 
-@app.post("/update-routes")
+@app.post("/update-routes", status_code=202)
+def post_update_routes():
+    """Queue a routes update (followed by an airports update) and return its job."""
+    job = submit_job("routes", update_routes)
+    return {"job_id": job["id"], **job_snapshot(job)}
+
+
 def update_routes():
     """Fetch active flights from OpenSky and update route database."""
+    if STREAM is not None:
+        return {"status": "streaming", "feed": FEED}
     config = load_config()
     allowed_continents = set(config.get("flight_continents") or CONTINENTS.keys())
 
-    resp = requests.get("https://opensky-network.org/api/states/all")
+    mark_stage("fetch")
+    wait = INGEST_STATE["retry_at"] - time.time()
+    if wait > 0:
+        return {"status": "rate_limited", "next_poll_in": round(wait, 1)}
+    resp = requests.get(OPENSKY_STATES_URL)
+    if resp.status_code == 429:
+        return {"status": "rate_limited", "next_poll_in": note_rate_limit(resp.headers)}
     resp.raise_for_status()
     data = resp.json()
 
+    # A snapshot no newer than the last one processed changes nothing
+    snapshot = data.get("time")
+    last_snapshot = load_json(STATS_PATH, {}).get("last_snapshot")
+    if snapshot is not None and last_snapshot is not None and snapshot <= last_snapshot:
+        return {"status": "unchanged", "snapshot": snapshot, "next_poll_in": next_poll_delay(fresh=False)}
+
     now = datetime.utcnow().isoformat() + "Z"
+    append_history(data.get("states") or [], int(data.get("time") or time.time()))
 
     # Load current active flights
-    active = load_json(ACTIVE_PLANES_PATH, {})
-
-    # Load existing routes
-    routes = load_json(ROUTES_DB_PATH, [])
-    routes_by_key = {
-        (r.get("airline"), r.get("flight_number"), r.get("source"), r.get("destination")): r
-        for r in routes
-    }
+    mark_stage("load")
+    active_prev = load_json(ACTIVE_PLANES_PATH, {}, cache=False)
 
     # Load airports for geolocation
-    airports = {}
-    latitudes = []
-    longitudes = []
-    if AIRPORTS_FULL_PATH.exists():
-        try:
-            a_list = load_json(AIRPORTS_FULL_PATH, [])
-            airports = {a["code"]: a for a in a_list}
-        except Exception:
-            airports = {}
-    filtered_airports = {}
-    if airports:
-        if allowed_continents:
-            filtered_airports = {
-                code: ap
-                for code, ap in airports.items()
-                if not ap.get("continent")
-                or (ap.get("continent") in allowed_continents)
-            }
-        else:
-            filtered_airports = airports
-    airports = filtered_airports or airports
-    latitudes = [a.get("lat") for a in airports.values() if a.get("lat") is not None]
-    longitudes = [a.get("lon") for a in airports.values() if a.get("lon") is not None]
-    global AIRPORTS_MAP, AIRPORTS_LAT_RANGE, AIRPORTS_LON_RANGE
-    AIRPORTS_MAP = airports
-    if AIRPORTS_MAP:
-        build_airport_tree(AIRPORTS_MAP.values())
-    else:
-        AIRPORTS_TREE = None
-        AIRPORTS_INDEX = []
-    if latitudes and longitudes:
-        AIRPORTS_LAT_RANGE = (min(latitudes), max(latitudes))
-        AIRPORTS_LON_RANGE = (min(longitudes), max(longitudes))
-    else:
-        AIRPORTS_LAT_RANGE = (None, None)
-        AIRPORTS_LON_RANGE = (None, None)
+    load_airport_index(allowed_continents)
+
+    states = coverage_filter(data.get("states") or [], active_prev)
+
+    # Advance each region's flights, then merge the finished routes
+    mark_stage("process")
+    poll_time = time.time()
+    states = UNRESOLVED.select(states, active_prev, poll_time)
+    active = {}
+    deltas = []
+    for shard_active, shard_deltas in run_shards(partition_snapshot(states, active_prev), now):
+        active.update(shard_active)
+        deltas.extend(shard_deltas)
+    UNRESOLVED.record(states, active, poll_time)
+    # Finished flights lose their trail; the others extend it
+    TRAILS.retain(active)
+    for icao24, af in active.items():
+        coord = af.get("last_coord")
+        if coord and None not in coord:
+            TRAILS.append(icao24, *coord)
+
+    routes = record_routes(active, deltas, now, {
+        "unresolved_aircraft": len(UNRESOLVED.entries),
+        "last_snapshot": snapshot,
+    })
+    refresh_airports()
+    return {
+        "status": "updated",
+        "routes": routes,
+        "active": len(active),
+        "last_run": now,
+        "snapshot": snapshot,
+        "next_poll_in": next_poll_delay(fresh=True),
+    }
 
-    seen = set()
-    lat_range = AIRPORTS_LAT_RANGE
-    lon_range = AIRPORTS_LON_RANGE
-    lat_margin = 5.0
-    lon_margin = 5.0
-    for s in data.get("states", []):
-        icao24 = s[0]
-        callsign = s[1].strip() if s[1] else ""
-        lon = s[5]
-        lat = s[6]
-        if lat is None or lon is None:
-            continue
-        if lat_range[0] is not None:
-            if lat < lat_range[0] - lat_margin or lat > lat_range[1] + lat_margin:
-                continue
-        if lon_range[0] is not None:
-            if lon < lon_range[0] - lon_margin or lon > lon_range[1] + lon_margin:
-                continue
-        seen.add(icao24)
-        prefix, number = parse_callsign(callsign)
-        if icao24 in active:
-            af = active[icao24]
-            if not af.get("origin"):
-                active.pop(icao24, None)
-                continue
-            af["last_coord"] = [lat, lon]
-            af["last_updated"] = now
-            af["callsign"] = callsign
-            af["airline"] = prefix
-            af["flight_number"] = number
-        else:
-            origin_ap = nearest_airport(lat, lon)
-            if not origin_ap:
-                continue
-            active[icao24] = {
-                "callsign": callsign,
-                "airline": prefix,
-                "flight_number": number,
-                "origin": origin_ap["code"] if origin_ap else None,
-                "origin_name": origin_ap["name"] if origin_ap else None,
-                "origin_coord": [lat, lon],
-                "last_coord": [lat, lon],
-                "first_seen": now,
-                "last_updated": now,
-            }
 
-    # Handle flights that disappeared since last run
-    finished = [key for key in active.keys() if key not in seen]
-    for icao24 in finished:
-        af = active.pop(icao24)
-        prefix, number = parse_callsign(af.get("callsign", ""))
-        src = nearest_airport(*(af.get("origin_coord") or (None, None)))
-        dest = nearest_airport(*(af.get("last_coord") or (None, None)))
-        if not src or not dest or src["code"] == dest["code"]:
-            continue
-        key = (prefix, number, src["code"], dest["code"])
+def record_routes(active: Dict[str, dict], deltas, now: str, stats: dict = None) -> int:
+    """Merge finished flights into the route database and write the results.
+
+    ``deltas`` are ``(key, icao24, first_seen, last_seen)`` tuples as
+    produced by finish_flight; routes record when the flight was last seen,
+    not when it was finalized. Writes the active flights, routes, frequencies, analytics
+    and stats (updated with ``stats``); returns the number of routes.
+    """
+    global ROUTE_INDEX_SOURCE
+    mark_stage("merge")
+    routes = load_json(ROUTES_DB_PATH, [], cache=False)
+    routes_by_key = {_route_key(r): r for r in routes}
+    route_index = get_route_index()
+    observations: Dict[tuple, int] = {}
+    touched = []
+    for key, icao24, first_seen, last_seen in deltas:
+        observations[key] = observations.get(key, 0) + 1
+        last_seen = last_seen or now
         route = routes_by_key.get(key)
         if route:
-            route["last_seen"] = now
+            route["last_seen"] = max(route.get("last_seen") or "", last_seen)
             route["icao24"] = icao24
         else:
+            prefix, number, source, destination = key
             route = {
                 "airline": prefix,
                 "flight_number": number,
                 "icao24": icao24,
-                "source": src["code"],
-                "destination": dest["code"],
-                "first_seen": now,
-                "last_seen": now,
+                "source": source,
+                "destination": destination,
+                "first_seen": last_seen,
+                "last_seen": last_seen,
                 "status": "Active",
             }
             routes.append(route)
             routes_by_key[key] = route
+        duration = flight_minutes(first_seen, last_seen)
+        if duration is not None:
+            route["duration_min"] = duration
+        touched.append(route)
 
     # Update status and prune old routes
+    mark_stage("prune")
     cleaned = []
     pruned = 0
     now_dt = datetime.utcnow()
@@ -466,25 +2855,43 @@ def update_routes():
             last_dt = now_dt
         if now_dt - last_dt > timedelta(days=31):
             pruned += 1
+            route_index.remove(_route_key(r))
             continue
-        r["status"] = "Active" if now_dt - last_dt <= timedelta(days=21) else "Not Active"
+        status = "Active" if now_dt - last_dt <= timedelta(days=21) else "Not Active"
+        if r.get("status") != status:
+            r["status"] = status
+            touched.append(r)
         cleaned.append(r)
     routes = cleaned
+    for r in touched:
+        route_index.upsert(r)
+
+    mark_stage("analytics")
+    freq = get_route_frequency()
+    freq.record_many(observations, now_dt.date().toordinal())
+    analytics = build_route_analytics(routes, AIRPORTS_MAP, freq)
+    analytics["generated"] = now
 
+    mark_stage("write")
     write_json(ACTIVE_PLANES_PATH, active)
     write_json(ROUTES_DB_PATH, routes)
+    ROUTE_INDEX_SOURCE = _file_source(ROUTES_DB_PATH)
+    save_route_frequency(freq)
+    write_json(ROUTE_ANALYTICS_PATH, analytics)
 
-    stats = load_json(STATS_PATH, {})
-    stats.update({
+    summary = load_json(STATS_PATH, {}, cache=False)
+    summary.update({
         "routes": len(routes),
         "last_run": now,
         "last_routes_update": now,
         "active_planes": len(active),
         "removed_last_run": pruned,
+        **(stats or {}),
     })
-    write_json(STATS_PATH, stats)
-    update_airports()
-    return {"routes": len(routes), "active": len(active), "last_run": now}
+    write_json(STATS_PATH, summary)
+    if deltas or pruned:
+        AIRPORTS_STATE["stale"] = True
+    return len(routes)
 
 
 @app.get("/active-planes")
@@ -495,7 +2902,169 @@ def get_active_planes():
     return {}
 
 
+@app.get("/active-planes.bin")
+def get_active_planes_packed():
+    """Return tracked flights in the packed layout used by the canvas renderer."""
+    if ACTIVE_PLANES_PATH.exists():
+        payload = _packed("active_planes", ACTIVE_PLANES_PATH, pack_active_planes)
+    else:
+        payload = pack_active_planes({})
+    return Response(payload, media_type="application/octet-stream")
+
+
+
+
+@app.get("/active-planes/{icao24}/trail")
+def get_active_plane_trail(icao24: str):
+    """Return the positions recorded for a tracked flight so far."""
+    trail = TRAILS.get(icao24)
+    if not trail:
+        af = load_json(ACTIVE_PLANES_PATH, {}).get(icao24)
+        if not af:
+            raise HTTPException(status_code=404, detail="Flight not tracked")
+        # Trails live in memory; after a restart only the endpoints are known
+        trail = [c for c in (af.get("origin_coord"), af.get("last_coord")) if c]
+    return {"icao24": icao24, "trail": trail}
+
+
+@app.get("/facets")
+def get_facet_counts(airline: str = None, country: List[str] = Query(None)):
+    """Return airline/country facets and the airports matching a filter.
+
+    ``airline`` takes a code or name; ``country`` may be repeated. With an
+    airline the tracked flights of that airline are included as ``active``.
+    """
+    result = get_facets().query(airline, country)
+    if result["airline"]:
+        result["active"] = get_active_facets().get(result["airline"], [])
+    return result
+
+
+@app.get("/routes")
+def query_routes(
+    source: str = Query(None, alias="from"),
+    destination: str = Query(None, alias="to"),
+    airline: str = None,
+    status: str = None,
+    offset: int = 0,
+    limit: int = 100,
+):
+    """Return collected routes aggregated by airport pair, one page at a time."""
+    limit = max(1, min(limit, 1000))
+    routes, next_offset = get_route_index().query(
+        source, destination, airline, status, max(0, offset), limit
+    )
+    return {"routes": routes, "next_offset": next_offset}
+
+
+@app.get("/routes/frequency")
+def get_route_frequency_stats(top: int = 10, airport: str = None, airline: str = None):
+    """Return busiest routes or weekly frequency for an airport or airline."""
+    freq = get_route_frequency()
+    aggregates = freq.aggregates
+    day = datetime.fromordinal(freq.day).date().isoformat() if freq.day else None
+    if airport is not None:
+        weekly, monthly = aggregates["airports"].get(airport, [0, 0])
+        return {"day": day, "airport": airport, "weekly": weekly, "monthly": monthly}
+    if airline is not None:
+        weekly, monthly = aggregates["airlines"].get(airline, [0, 0])
+        return {"day": day, "airline": airline, "weekly": weekly, "monthly": monthly}
+    top = max(0, min(top, 1000))
+    return {"day": day, "routes": aggregates["routes"][:top]}
+
+
+@app.get("/stats/routes")
+def get_route_analytics(airline: str = None, top: int = None):
+    """Return the route analytics computed by the last ingestion."""
+    analytics = load_json(ROUTE_ANALYTICS_PATH, {})
+    if not isinstance(analytics, dict) or not analytics:
+        return {}
+    result = dict(analytics)
+    if airline is not None:
+        result["airlines"] = [a for a in analytics.get("airlines", []) if a["airline"] == airline]
+    if top is not None:
+        top = max(0, top)
+        for key in ("airlines", "longest", "busiest"):
+            result[key] = result.get(key, [])[:top]
+    return result
+
+
+@app.get("/routes/geometry")
+def get_route_geometry(airport: List[str] = Query(...)):
+    """Return great-circle geometry for the routes of one or more airports.
+
+    The response maps each requested airport code to ``{other_code:
+    segments}`` with paths oriented away from the requested airport.
+    """
+    index = get_route_geometry_index()
+    return {code: index.get(code, {}) for code in airport[:100]}
+
+
+@app.get("/history/positions")
+def get_history_positions(at: str = None, bbox: str = None):
+    """Return aircraft positions as recorded at a past moment.
+
+    ``at`` is an ISO timestamp or Unix seconds (default: now); ``bbox`` is
+    ``west,south,east,north`` as produced by Leaflet's ``toBBoxString``.
+    """
+    try:
+        if at is None:
+            ts = int(time.time())
+        elif re.fullmatch(r"\d+(\.\d*)?", at):
+            ts = int(float(at))
+        else:
+            dt = datetime.fromisoformat(at.replace("Z", "+00:00"))
+            ts = int(dt.replace(tzinfo=dt.tzinfo or timezone.utc).timestamp())
+        box = tuple(float(v) for v in bbox.split(",")) if bbox else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid at or bbox")
+    if box is not None and len(box) != 4:
+        raise HTTPException(status_code=400, detail="bbox needs west,south,east,north")
+    return history_positions(ts, box)
+
+
+def _export_response(path, container, to_row, match, cursor, limit):
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    limit = max(1, limit) if limit else None
+    return StreamingResponse(
+        export_records(path, container, to_row, match, position, limit),
+        media_type="application/x-ndjson",
+    )
+
 
+@app.get("/export/routes.ndjson")
+def export_routes(
+    airline: str = None,
+    airport: str = None,
+    status: str = None,
+    since: str = None,
+    until: str = None,
+    cursor: str = None,
+    limit: int = None,
+):
+    """Stream collected routes as NDJSON, optionally filtered and paged."""
+    match = export_filter(airline, airport, status, since, until,
+                          airports=("source", "destination"), timestamp="last_seen")
+    return _export_response(ROUTES_DB_PATH, "list", lambda r: r, match, cursor, limit)
+
+
+@app.get("/export/active-planes.ndjson")
+def export_active_planes(
+    airline: str = None,
+    airport: str = None,
+    since: str = None,
+    until: str = None,
+    cursor: str = None,
+    limit: int = None,
+):
+    """Stream tracked flights as NDJSON, optionally filtered and paged."""
+    match = export_filter(airline, airport, None, since, until,
+                          airports=("origin",), timestamp="last_updated")
+    to_row = lambda item: {"icao24": item[0], **item[1]}
+    return _export_response(ACTIVE_PLANES_PATH, "dict", to_row, match, cursor, limit)
 
 
 @app.get("/info")
@@ -561,42 +3130,55 @@ def update_admin_config(payload: Dict[str, List[str]] = Body(...)):
     return {"status": "ok", "config": load_config()}
 
 
-@app.post("/admin/run-update")
+@app.post("/admin/run-update", status_code=202)
 def run_full_update():
-    """Trigger an immediate routes and airports update."""
-    result = update_routes()
-    return {"status": "started", "result": result}
+    """Queue an immediate routes and airports update."""
+    job = submit_job("routes", update_routes)
+    return {"status": "started", "job_id": job["id"], "job": job_snapshot(job)}
+
+
+@app.get("/admin/jobs/{job_id}")
+def get_job(job_id: str):
+    """Return status, stage timings and result of an update job."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job_snapshot(job)
 
 
 @app.get("/admin/files")
 def list_data_files():
-    """Return files available in the data directory with metadata."""
+    """Return files available in the data directory with metadata.
+
+    Files written by the server are described from the manifest; anything else
+    (uploads, foreign files, stale entries) is counted lazily.
+    """
+    manifest = load_manifest(DATA_DIR)
     files = []
     for p in DATA_DIR.glob("*"):
-        if p.is_file():
-            mtime = datetime.utcfromtimestamp(p.stat().st_mtime).isoformat() + "Z"
-            size = p.stat().st_size
-            records = 0
-            try:
-                data = load_json(p, None)
-                if isinstance(data, list):
-                    records = len(data)
-                elif isinstance(data, dict):
-                    records = len(data)
-            except Exception:
-                try:
-                    with p.open() as f_in:
-                        records = sum(1 for _ in f_in)
-                except Exception:
-                    records = 0
-            files.append(
-                {
-                    "name": p.name,
-                    "modified": mtime,
-                    "size": size,
-                    "records": records,
-                }
-            )
+        if not p.is_file() or p.name == MANIFEST_NAME or p.name.startswith("."):
+            continue
+        st = p.stat()
+        mtime = datetime.utcfromtimestamp(st.st_mtime).isoformat() + "Z"
+        entry = manifest.get(p.name)
+        if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+            records = entry.get("records", 0)
+            content_hash = entry.get("hash")
+            schema_version = entry.get("schema_version")
+        else:
+            records = count_records(p)
+            content_hash = None
+            schema_version = None
+        files.append(
+            {
+                "name": p.name,
+                "modified": mtime,
+                "size": st.st_size,
+                "records": records,
+                "hash": content_hash,
+                "schema_version": schema_version,
+            }
+        )
     return {"files": files}
 
 
@@ -607,6 +3189,7 @@ def delete_data_file(filename: str):
     if path.parent != DATA_DIR.resolve() or not path.is_file():
         raise HTTPException(status_code=404, detail="file not found")
     path.unlink()
+    forget_manifest(path)
     return {"status": "deleted"}
 
 
@@ -620,15 +3203,62 @@ def download_data_file(filename: str):
 
 
 @app.post("/admin/upload/{filename}")
-async def upload_data_file(filename: str, file: UploadFile = File(...)):
-    """Upload and replace a file in the data directory."""
+def upload_data_file(filename: str, file: UploadFile = File(...)):
+    """Upload and atomically replace a file in the data directory.
+
+    The upload is streamed to a temporary file in chunks. Known datasets are
+    validated record by record before the swap, and in-memory structures built
+    from them are reloaded afterwards by a job, so the reload never overlaps
+    ingestion. Runs in the threadpool: validation is CPU bound.
+    """
     path = (DATA_DIR / filename).resolve()
-    if path.parent != DATA_DIR.resolve():
+    if path.parent != DATA_DIR.resolve() or path.name == MANIFEST_NAME:
         raise HTTPException(status_code=400, detail="invalid path")
-    with path.open("wb") as f_out:
-        content = await file.read()
-        f_out.write(content)
-    return {"status": "ok"}
+    schema = UPLOAD_SCHEMAS.get(path.name)
+    validator = JsonStreamValidator(*schema) if schema else None
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as f_out:
+            while True:
+                chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="upload too large")
+                if validator:
+                    validator.feed(chunk)
+                digest.update(chunk)
+                f_out.write(chunk)
+        if validator:
+            validator.close()
+        os.replace(tmp_path, path)
+        bump_generation(path)
+    except ValueError as exc:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=f"invalid {path.name}: {exc}")
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if validator:
+        record_manifest(path, validator.records, digest.hexdigest())
+    else:
+        forget_manifest(path)
+    replaced = datetime.utcnow().isoformat() + "Z"
+    kind = f"reload:{path.name}"
+    job = submit_job(kind, lambda: reload_dataset(path))
+    if job["created"] < replaced:
+        # Coalesced with a reload that may have read the previous file
+        wait_for_job(job["id"])
+        job = submit_job(kind, lambda: reload_dataset(path))
+    job = wait_for_job(job["id"])
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"reload failed: {job['error']}")
+    return {"status": "ok", "size": size, "records": validator.records if validator else None}
+
 
 # Serve static files from the public directory (mounted last so API routes take precedence)
 app.mount("/", StaticFiles(directory="public", html=True), name="static")
@@ -1,4 +1,5 @@
 import json
+import pytest
 from pathlib import Path
 from fastapi.testclient import TestClient
 import sys
@@ -66,3 +67,176 @@ def test_admin_config(tmp_path, monkeypatch):
     saved = json.loads((data_dir / "config.json").read_text())
     assert set(saved["airport_continents"]) == {"EU", "NA"}
     assert saved["flight_continents"] == ["NA"]
+
+
+def test_admin_files_manifest(tmp_path, monkeypatch):
+    data_dir, client = setup(tmp_path, monkeypatch)
+    server.write_json(data_dir / "routes_dynamic.json", [{"a": 1}, {"a": 2}])
+    (data_dir / "foreign.txt").write_text("a\nb\nc\n")
+
+    manifest = json.loads((data_dir / "manifest.json").read_text())
+    entry = manifest["routes_dynamic.json"]
+    assert entry["records"] == 2
+    assert entry["schema_version"] == 1
+
+    # Manifest entries are trusted, so the dataset is not parsed again
+    monkeypatch.setattr(server, "load_json", lambda path, default, **kwargs: (
+        default if path.name != "manifest.json" else manifest
+    ))
+    files = {f["name"]: f for f in client.get("/admin/files").json()["files"]}
+    assert "manifest.json" not in files
+    assert files["routes_dynamic.json"]["records"] == 2
+    assert files["routes_dynamic.json"]["hash"] == entry["hash"]
+    assert files["foreign.txt"]["records"] == 3
+    assert files["foreign.txt"]["hash"] is None
+
+
+def test_json_stream_validator_chunks():
+    payload = json.dumps([
+        {"source": "A", "destination": "B", "note": "x\\\"],{"},
+        {"source": "C", "destination": "D"},
+    ]).encode()
+    validator = server.JsonStreamValidator("list", ("source", "destination"))
+    for i in range(len(payload)):
+        validator.feed(payload[i:i + 1])
+    validator.close()
+    assert validator.records == 2
+
+    bad = server.JsonStreamValidator("list", ("source", "destination"))
+    try:
+        bad.feed(b'[{"source": "A"}]')
+    except ValueError as exc:
+        assert "destination" in str(exc)
+    else:
+        raise AssertionError("missing key not detected")
+
+
+def test_upload_validates_and_reloads(tmp_path, monkeypatch):
+    data_dir, client = setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    (data_dir / "routes_dynamic.json").write_text("[]")
+
+    resp = client.post(
+        "/admin/upload/routes_dynamic.json",
+        files={"file": ("routes_dynamic.json", b'[{"source": "AAA"}')},
+    )
+    assert resp.status_code == 400
+    assert (data_dir / "routes_dynamic.json").read_text() == "[]"
+    assert not [p for p in data_dir.iterdir() if p.name.endswith(".part")]
+
+    airports = [
+        {"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"},
+        {"code": "BBB", "name": "B", "lat": 30, "lon": 40, "continent": "EU"},
+    ]
+    version = server.AIRPORTS_VERSION
+    resp = client.post(
+        "/admin/upload/airports_full.json",
+        files={"file": ("airports_full.json", json.dumps(airports).encode())},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["records"] == 2
+    assert server.AIRPORTS_VERSION == version + 1
+    assert set(server.AIRPORTS_MAP) == {"AAA", "BBB"}
+    assert server.nearest_airport(10, 20)["code"] == "AAA"
+    # The reload ran as a job, serialized with ingestion
+    assert any(j["kind"] == "reload:airports_full.json" for j in server.JOBS.values())
+
+    # A running stream picks up uploaded active flights
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    stream = server.StreamIngester(server.SbsFeed("127.0.0.1", 1))
+    stream.active = {"old": {"origin": "AAA"}}
+    monkeypatch.setattr(server, "STREAM", stream)
+    resp = client.post(
+        "/admin/upload/active_planes.json",
+        files={"file": ("active_planes.json", json.dumps({"abc": {"origin": "BBB"}}).encode())},
+    )
+    assert resp.status_code == 200
+    assert set(stream.active) == {"abc"} and "abc" in stream.aircraft
+
+    files = {f["name"]: f for f in client.get("/admin/files").json()["files"]}
+    assert files["airports_full.json"]["records"] == 2
+    assert files["airports_full.json"]["schema_version"] == 1
+
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", 4)
+    resp = client.post(
+        "/admin/upload/big.txt",
+        files={"file": ("big.txt", b"0123456789")},
+    )
+    assert resp.status_code == 413
+    assert not (data_dir / "big.txt").exists()
+
+
+def test_update_jobs_coalesce(tmp_path, monkeypatch):
+    import threading
+
+    data_dir, client = setup(tmp_path, monkeypatch)
+    release = threading.Event()
+    calls = []
+
+    def fake_update():
+        calls.append(1)
+        server.mark_stage("fetch")
+        release.wait(5)
+        server.mark_stage("write")
+        return {"routes": 3}
+
+    monkeypatch.setattr(server, "update_routes", fake_update)
+    first = client.post("/admin/run-update")
+    second = client.post("/update-routes")
+    assert first.status_code == 202 and second.status_code == 202
+    job_id = first.json()["job_id"]
+    assert second.json()["job_id"] == job_id
+
+    release.set()
+    server.wait_for_job(job_id)
+    job = client.get(f"/admin/jobs/{job_id}").json()
+    assert job["status"] == "done"
+    assert job["result"] == {"routes": 3}
+    assert [s["name"] for s in job["stages"]] == ["fetch", "write"]
+    assert calls == [1]
+
+    # A finished job no longer absorbs new requests
+    third = client.post("/update-routes").json()
+    assert third["job_id"] != job_id
+    server.wait_for_job(third["job_id"])
+    assert client.get("/admin/jobs/missing").status_code == 404
+
+
+def test_write_json_replaces_atomically(tmp_path, monkeypatch):
+    data_dir, client = setup(tmp_path, monkeypatch)
+    path = data_dir / "routes_stats.json"
+    server.write_json(path, {"routes": 1})
+    manifest = (data_dir / server.MANIFEST_NAME).read_bytes()
+
+    # A failed write leaves the previous file and manifest untouched
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(server.os, "replace", fail)
+    with pytest.raises(OSError):
+        server.write_json(path, {"routes": 2})
+    assert json.loads(path.read_text()) == {"routes": 1}
+    assert (data_dir / server.MANIFEST_NAME).read_bytes() == manifest
+    assert not list(data_dir.glob(".*.part"))
+
+
+def test_load_json_cache(tmp_path, monkeypatch):
+    data_dir, client = setup(tmp_path, monkeypatch)
+    path = data_dir / "routes_stats.json"
+    server.write_json(path, {"routes": 1})
+
+    first = server.load_json(path, {})
+    assert server.load_json(path, {}) is first
+    assert server.load_json(path, {}, cache=False) is not first
+
+    # Rewrites invalidate the entry even within the same mtime tick
+    server.write_json(path, {"routes": 2})
+    assert server.load_json(path, {}) == {"routes": 2}
+
+    # Entries are evicted once the estimated footprint exceeds the budget
+    other = data_dir / "other.json"
+    other.write_text("[1, 2, 3]")
+    monkeypatch.setattr(server, "JSON_CACHE_MAX_BYTES", path.stat().st_size * server.JSON_CACHE_EXPANSION)
+    server.load_json(other, [])
+    assert str(other) in server.JSON_CACHE
+    assert str(path) not in server.JSON_CACHE
@@ -1,4 +1,5 @@
 import json
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from unittest.mock import Mock
@@ -18,6 +19,17 @@ def fake_response(data):
     mock.raise_for_status = lambda: None
     return mock
 
+def run_update(client, url="/update-routes"):
+    """Queue an update job and wait for it to finish."""
+    resp = client.post(url)
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+    server.wait_for_job(job_id)
+    resp = client.get(f"/admin/jobs/{job_id}")
+    assert resp.json()["status"] == "done", resp.json()
+    return resp
+
+
 
 def test_update_routes(tmp_path, monkeypatch):
     states1 = {"states": [["abc", "AL123 ", "", 0, 0, 20.0, 10.0], ["def", "RYR456 ", "", 0, 0, 40.0, 30.0]]}
@@ -51,9 +63,9 @@ def test_update_routes(tmp_path, monkeypatch):
     server.build_airport_tree(airports)
     
     client = TestClient(server.app)
-    client.post("/update-routes")
-    client.post("/update-routes")
-    resp = client.post("/update-routes")
+    run_update(client)
+    run_update(client)
+    resp = run_update(client)
     assert resp.status_code == 200
 
     routes = json.loads((data_dir / "routes_dynamic.json").read_text())
@@ -64,14 +76,24 @@ def test_update_routes(tmp_path, monkeypatch):
     assert r["source"] == "AAA"
     assert r["destination"] == "BBB"
     assert r["status"] == "Active"
+    assert r["distance_km"] == 3040.6
+    assert r["duration_min"] >= 0
     stats = json.loads((data_dir / "routes_stats.json").read_text())
     assert stats["routes"] == 1
     assert stats["active_planes"] == 1
+    analytics = client.get("/stats/routes").json()
+    assert analytics["routes"] == 1 and analytics["longest"][0]["destination"] == "BBB"
 
     info = TestClient(server.app).get("/info").json()
     assert info["routes"] == 1
     assert info["active_planes"] == 1
 
+    # The index maintained by update_routes matches a fresh rebuild
+    assert server.get_route_index() is server.ROUTE_INDEX
+    assert server.ROUTE_INDEX.pairs == server.RouteIndex(routes).pairs
+    pairs = client.get("/routes", params={"from": "AAA"}).json()["routes"]
+    assert [p["destination"] for p in pairs] == ["BBB"]
+
 
 
 
@@ -118,9 +140,9 @@ def test_update_routes_missing_destination(tmp_path, monkeypatch):
     server.build_airport_tree(airports)
 
     client = TestClient(server.app)
-    client.post("/update-routes")
-    client.post("/update-routes")
-    resp = client.post("/update-routes")
+    run_update(client)
+    run_update(client)
+    resp = run_update(client)
     assert resp.status_code == 200
 
     routes = json.loads((data_dir / "routes_dynamic.json").read_text())
@@ -199,7 +221,7 @@ def test_route_expiration(tmp_path, monkeypatch):
     monkeypatch.setattr(server.requests, "get", fake_get)
 
     client = TestClient(server.app)
-    resp = client.post("/update-routes")
+    resp = run_update(client)
     assert resp.status_code == 200
 
     remaining = json.loads((data_dir / "routes_dynamic.json").read_text())
@@ -213,3 +235,745 @@ def test_route_expiration(tmp_path, monkeypatch):
 
 
 
+
+
+def test_route_frequency(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTE_FREQUENCY_PATH", data_dir / "routes_frequency.json")
+
+    daily = ("AL", "1", "AAA", "BBB")
+    rare = ("BT", "2", "AAA", "CCC")
+    freq = server.RouteFrequency()
+    today = datetime.utcnow().date().toordinal()
+    for day in range(today - 40, today + 1):
+        freq.record_many({daily: 2}, day)
+    freq.record_many({rare: 1}, today)
+    assert freq.counts.shape == (2, 31)
+    assert freq.counts[0].sum() == 62
+    server.save_route_frequency(freq)
+    monkeypatch.setattr(server, "ROUTE_FREQUENCY", None)
+
+    client = TestClient(server.app)
+    body = client.get("/routes/frequency", params={"top": 1}).json()
+    assert len(body["routes"]) == 1
+    top = body["routes"][0]
+    assert (top["airline"], top["source"], top["destination"]) == ("AL", "AAA", "BBB")
+    assert top["weekly"] == 14
+    assert top["daily"] == [2] * 7
+
+    assert client.get("/routes/frequency", params={"airport": "AAA"}).json()["weekly"] == 15
+    assert client.get("/routes/frequency", params={"airline": "BT"}).json()["monthly"] == 1
+
+    # Routes fall out of the ring once a month passes without observations
+    freq.record_many({}, today + 31)
+    assert freq.keys == []
+
+
+def test_update_routes_sharded(tmp_path, monkeypatch):
+    """Flights on different continents are processed by separate shards."""
+    states1 = {"states": [
+        ["eu1", "AL1 ", "", 0, 0, 20.0, 50.0],
+        ["na1", "UA2 ", "", 0, 0, -100.0, 40.0],
+    ]}
+    states2 = {"states": [
+        ["eu1", "AL1 ", "", 0, 0, 25.0, 52.0],
+        ["na1", "UA2 ", "", 0, 0, -90.0, 35.0],
+    ]}
+    states3 = {"states": []}
+    responses = iter([states1, states2, states3])
+
+    def fake_get(url):
+        return fake_response(next(responses))
+
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server.requests, "get", fake_get)
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    monkeypatch.setattr(server, "STATS_PATH", data_dir / "routes_stats.json")
+    monkeypatch.setattr(server, "AIRPORTS_PATH", data_dir / "airports.json")
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    monkeypatch.setattr(server, "CONFIG_PATH", data_dir / "config.json")
+    monkeypatch.setattr(server, "ROUTE_FREQUENCY_PATH", data_dir / "routes_frequency.json")
+    monkeypatch.setattr(server, "update_airports", lambda: {})
+    monkeypatch.setattr(server, "INGEST_WORKERS", 2)
+    airports = [
+        {"code": "EUA", "name": "EU A", "lat": 50, "lon": 20, "continent": "EU"},
+        {"code": "EUB", "name": "EU B", "lat": 52, "lon": 25, "continent": "EU"},
+        {"code": "NAA", "name": "NA A", "lat": 40, "lon": -100, "continent": "NA"},
+        {"code": "NAB", "name": "NA B", "lat": 35, "lon": -90, "continent": "NA"},
+    ]
+    Path(server.AIRPORTS_FULL_PATH).write_text(json.dumps(airports))
+    server.save_config({"airport_continents": ["EU", "NA"], "flight_continents": ["EU", "NA"]})
+
+    client = TestClient(server.app)
+    try:
+        for _ in range(3):
+            assert run_update(client).status_code == 200
+    finally:
+        if server.SHARD_POOL is not None:
+            server.SHARD_POOL.shutdown()
+            monkeypatch.setattr(server, "SHARD_POOL", None)
+
+    assert server.SHARD_KEYS == ["EU", "NA"]
+    assert set(server.SHARD_INDEXES["EU"].airports) >= {"EUA", "EUB"}
+    assert "NAA" not in server.SHARD_INDEXES["EU"].airports
+    routes = json.loads((data_dir / "routes_dynamic.json").read_text())
+    pairs = {(r["source"], r["destination"]) for r in routes}
+    assert pairs == {("EUA", "EUB"), ("NAA", "NAB")}
+
+
+
+def test_shard_lookup_parity(monkeypatch):
+    """Shard lookups near cell borders match the global index."""
+    import numpy as np
+
+    monkeypatch.setitem(server.MATCH_RADIUS_KM, "large_airport", 100.0)
+
+    def ap(code, lat, lon, continent, kind="large_airport"):
+        return {"code": code, "name": code, "lat": lat, "lon": lon, "continent": continent, "type": kind}
+
+    server.set_airport_index({a["code"]: a for a in [
+        ap("EUA", 50.5, 20.9, "EU"),
+        ap("ASA", 50.5, 23.1, "AS", "small_airport"),
+        ap("EUH", 75.0, 20.5, "EU", "medium_airport"),
+        ap("ASH", 75.0, 24.0, "AS", "small_airport"),
+        ap("NAA", 40.0, -100.0, "NA"),
+    ]})
+    assert server.SHARD_KEYS == ["AS", "EU", "NA"]
+
+    def shard_lookup(lat, lon):
+        return server.SHARD_INDEXES[server.shard_for(lat, lon)].nearest(lat, lon)
+
+    assert server.shard_for(50.5, 22.2) == "AS"
+    assert shard_lookup(50.5, 22.2)["code"] == "EUA"
+    rng = np.random.default_rng(0)
+    for lat0, lon0 in ((50.5, 22.0), (75.0, 22.0)):
+        for lat, lon in zip(rng.uniform(lat0 - 1.5, lat0 + 1.5, 500), rng.uniform(lon0 - 3, lon0 + 3, 500)):
+            lat, lon = float(lat), float(lon)
+            assert shard_lookup(lat, lon) == server.nearest_airport(lat, lon), (lat, lon)
+    server.set_airport_index({})
+
+
+def test_airport_index_rebuilds_on_identity(tmp_path, monkeypatch):
+    """Rewriting airports_full.json with new routes keeps the index."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "public").mkdir()
+    airports = [
+        {"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"},
+        {"code": "BBB", "name": "B", "lat": 30, "lon": 40, "continent": "EU"},
+    ]
+    server.write_json(server.AIRPORTS_FULL_PATH, airports)
+    server.load_airport_index({"EU"})
+    version = server.AIRPORTS_VERSION
+
+    airports[0]["routes"] = [{"to": "BBB"}]
+    server.write_json(server.AIRPORTS_FULL_PATH, airports)
+    server.load_airport_index({"EU"})
+    assert server.AIRPORTS_VERSION == version
+
+    airports[1]["lat"] = 31
+    server.write_json(server.AIRPORTS_FULL_PATH, airports)
+    server.load_airport_index({"EU"})
+    assert server.AIRPORTS_VERSION == version + 1
+    assert server.nearest_airport(31, 40)["code"] == "BBB"
+
+def test_packed_payloads(tmp_path, monkeypatch):
+    import numpy as np
+
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "AIRPORTS_PATH", data_dir / "airports.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    airports = [{"code": "AAA", "lat": 10.5, "lon": 20.25}, {"code": "BBB", "lat": -30, "lon": 40}]
+    (data_dir / "airports.json").write_text(json.dumps(airports))
+    active = {
+        "abc": {"callsign": "AL123", "airline": "AL", "origin": "AAA", "last_coord": [10, 20]},
+        "bad": {"callsign": "X"},
+    }
+    (data_dir / "active_planes.json").write_text(json.dumps(active))
+
+    client = TestClient(server.app)
+    body = client.get("/active-planes.bin").content
+    count = int(np.frombuffer(body[:4], dtype="<u4")[0])
+    assert count == 1
+    assert np.frombuffer(body[4:12], dtype="<f4").tolist() == [10, 20]
+    meta = json.loads(body[12:])
+    assert meta[0][:4] == ["abc", "AL123", "AL", None]
+
+
+def test_route_index_query(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    routes = [
+        {"airline": "AL", "flight_number": "1", "source": "AAA", "destination": "BBB",
+         "status": "Active", "last_seen": "2025-01-02T00:00:00Z"},
+        {"airline": "BT", "flight_number": "2", "source": "AAA", "destination": "BBB",
+         "status": "Not Active", "last_seen": "2025-01-01T00:00:00Z"},
+        {"airline": "AL", "flight_number": "3", "source": "AAA", "destination": "CCC",
+         "status": "Not Active", "last_seen": "2025-01-01T00:00:00Z"},
+        {"airline": "BT", "flight_number": "4", "source": "CCC", "destination": "BBB",
+         "status": "Active", "last_seen": "2025-01-03T00:00:00Z"},
+    ]
+    (data_dir / "routes_dynamic.json").write_text(json.dumps(routes))
+
+    client = TestClient(server.app)
+    body = client.get("/routes", params={"from": "AAA", "to": "BBB"}).json()
+    assert len(body["routes"]) == 1
+    pair = body["routes"][0]
+    assert pair["airlines"] == ["AL", "BT"]
+    assert pair["status"] == "Active"
+    assert pair["last_seen"] == "2025-01-02T00:00:00Z"
+
+    body = client.get("/routes", params={"from": "AAA", "limit": 1}).json()
+    assert len(body["routes"]) == 1 and body["next_offset"] == 1
+    body = client.get("/routes", params={"from": "AAA", "limit": 1, "offset": 1}).json()
+    assert body["routes"][0]["destination"] == "CCC" and body["next_offset"] is None
+
+    body = client.get("/routes", params={"to": "BBB", "airline": "BT", "status": "Active"}).json()
+    assert [(r["source"], r["destination"]) for r in body["routes"]] == [("CCC", "BBB")]
+
+    index = server.get_route_index()
+    index.remove(("BT", "4", "CCC", "BBB"))
+    assert "CCC" not in index.by_source
+    assert index.query(airline="BT")[0][0]["source"] == "AAA"
+
+
+
+def test_route_index_concurrent_updates():
+    """Queries running alongside incremental updates see a consistent index."""
+    import threading
+
+    index = server.RouteIndex()
+    stop = threading.Event()
+
+    def churn():
+        n = 0
+        while not stop.is_set():
+            route = {"airline": "AL", "flight_number": str(n % 50), "source": "AAA",
+                     "destination": f"D{n % 200}", "status": "Active"}
+            index.upsert(route)
+            if n % 3:
+                index.remove(server._route_key(route))
+            n += 1
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(300):
+            index.query(source="AAA", limit=1000)
+            index.query(airline="AL", limit=1000)
+            index.query(limit=1000)
+    finally:
+        stop.set()
+        writer.join()
+
+def test_export_ndjson(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    monkeypatch.setattr(server, "UPLOAD_CHUNK_SIZE", 7)
+    routes = [
+        {"airline": "AL" if i % 2 else "BT", "flight_number": str(i), "source": "AAA",
+         "destination": "BBB" if i % 3 else "CCC", "status": "Active",
+         "last_seen": f"2025-01-{i + 1:02d}T00:00:00Z"}
+        for i in range(10)
+    ]
+    (data_dir / "routes_dynamic.json").write_text(json.dumps(routes, indent=2))
+    active = {
+        "abc": {"airline": "AL", "origin": "AAA", "last_updated": "2025-01-02T00:00:00Z"},
+        "def": {"airline": "BT", "origin": "CCC", "last_updated": "2025-01-03T00:00:00Z"},
+    }
+    (data_dir / "active_planes.json").write_text(json.dumps(active))
+
+    def fetch(url, **params):
+        resp = client.get(url, params=params)
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line) for line in resp.text.splitlines()]
+
+    client = TestClient(server.app)
+    assert fetch("/export/routes.ndjson") == routes
+
+    rows = fetch("/export/routes.ndjson", airline="AL", since="2025-01-03", until="2025-01-09")
+    assert [r["flight_number"] for r in rows] == ["3", "5", "7"]
+    assert [r["flight_number"] for r in fetch("/export/routes.ndjson", airport="CCC")] == ["0", "3", "6", "9"]
+
+    # Page through with cursors, including after the file is rewritten
+    collected = []
+    page = fetch("/export/routes.ndjson", airline="AL", limit=2)
+    while True:
+        if "next_cursor" not in page[-1]:
+            collected += page
+            break
+        collected += page[:-1]
+        if len(collected) == 2:
+            (data_dir / "routes_dynamic.json").write_text(json.dumps(routes))
+        page = fetch("/export/routes.ndjson", airline="AL", limit=2, cursor=page[-1]["next_cursor"])
+    assert [r["flight_number"] for r in collected] == ["1", "3", "5", "7", "9"]
+
+    assert fetch("/export/active-planes.ndjson", airport="CCC") == [{"icao24": "def", **active["def"]}]
+    assert client.get("/export/routes.ndjson", params={"cursor": "bogus"}).status_code == 400
+
+    # A file cut short mid-read ends with an error row that resumes cleanly
+    text = json.dumps(routes)
+    (data_dir / "routes_dynamic.json").write_text(text[: text.index('"flight_number": "4"')])
+    page = fetch("/export/routes.ndjson")
+    assert [r["flight_number"] for r in page[:-1]] == ["0", "1", "2", "3"]
+    assert page[-1]["error"].startswith("export interrupted")
+    (data_dir / "routes_dynamic.json").write_text(text)
+    rest = fetch("/export/routes.ndjson", cursor=page[-1]["next_cursor"])
+    assert [r["flight_number"] for r in rest] == [str(i) for i in range(4, 10)]
+
+    # null elements are records too, including the last one
+    for raw, records in ((b"[1, null]", [1, None]), (b"[null]", [None]), (b"[]", [])):
+        (data_dir / "values.json").write_bytes(raw)
+        assert [r for r, _ in server.iter_json_records(data_dir / "values.json", "list")] == records
+
+
+def test_position_history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "HISTORY_DIR", tmp_path / "history")
+    monkeypatch.setattr(server, "HISTORY_SEGMENTS", {})
+    monkeypatch.setattr(server, "HISTORY_FRAMES", server.OrderedDict())
+    hour = 1735689600  # 2025-01-01T00:00:00Z
+    server.append_history([["abc", "", "", 0, 0, 20.0, 10.0], ["def", "", "", 0, 0, None, None]], hour + 10)
+    server.append_history([["abc", "", "", 0, 0, 20.5, 10.5], ["def", "", "", 0, 0, -120.0, 45.0]], hour + 70)
+    server.append_history([["def", "", "", 0, 0, -121.12345, 45.5]], hour + 3610)
+
+    client = TestClient(server.app)
+    body = client.get("/history/positions", params={"at": hour + 60}).json()
+    assert body == {"time": "2025-01-01T00:00:10Z", "positions": [["abc", 10.0, 20.0]]}
+
+    body = client.get("/history/positions", params={"at": "2025-01-01T00:59:59Z"}).json()
+    assert body["time"] == "2025-01-01T00:01:10Z"
+    assert sorted(p[0] for p in body["positions"]) == ["abc", "def"]
+
+    body = client.get("/history/positions", params={"at": hour + 3605, "bbox": "-130,40,-110,50"}).json()
+    assert body == {"time": "2025-01-01T00:01:10Z", "positions": [["def", 45.0, -120.0]]}
+
+    body = client.get("/history/positions", params={"at": hour + 3700}).json()
+    assert body == {"time": "2025-01-01T01:00:10Z", "positions": [["def", 45.5, -121.1234]]}
+    assert server._history_segment(server._history_path(hour + 3600))["ids"] == ["def"]
+
+    assert client.get("/history/positions", params={"at": hour}).json()["positions"] == []
+    assert client.get("/history/positions", params={"bbox": "1,2"}).status_code == 400
+
+    server.prune_history(hour + 3600)
+    assert sorted(p.name for p in (tmp_path / "history").iterdir()) == [
+        "positions-2025010101.bin", "positions-2025010101.ids",
+    ]
+
+
+def test_coverage_filter(monkeypatch):
+    # The mask reaches as far as the widest airport match radius
+    assert server.COVERAGE_RADIUS_KM == max(server.MATCH_RADIUS_KM.values())
+    server.set_airport_index({"AAA": {"code": "AAA", "name": "A", "lat": 50.0, "lon": 10.0}})
+    states = [
+        ["near", "", "", 0, 0, 10.3, 50.0],
+        ["far", "", "", 0, 0, 12.0, 50.0],
+        ["none", "", "", 0, 0, None, None],
+        ["north", "", "", 0, 0, 10.0, 52.0],
+    ]
+    assert [s[0] for s in server.coverage_filter(states)] == ["near"]
+
+    # Tracked aircraft are kept outside coverage, but still need a position
+    tracked = {"north": {}, "none": {}}
+    assert [s[0] for s in server.coverage_filter(states, tracked)] == ["near", "north"]
+
+    server.set_airport_index({"BBB": {"code": "BBB", "name": "B", "lat": 50.0, "lon": 12.0}})
+    assert [s[0] for s in server.coverage_filter(states)] == ["far"]
+
+    server.set_airport_index({})
+    assert server.COVERAGE_MASK is None
+    assert [s[0] for s in server.coverage_filter(states)] == ["near", "far", "north"]
+
+
+def test_airport_type_matching():
+    def ap(code, lat, kind):
+        return {"code": code, "name": code, "lat": lat, "lon": 10.0, "type": kind}
+
+    server.set_airport_index({
+        "LRG": ap("LRG", 50.0, "large_airport"),
+        "SML": ap("SML", 50.3, "small_airport"),
+        "HEL": ap("HEL", 49.7, "heliport"),
+        "CLO": ap("CLO", 60.0, "closed"),
+        "UNK": ap("UNK", 40.0, None),
+    })
+    assert server.AIRPORTS_INDEX == ["LRG", "SML", "UNK"]
+    # A large airport within its radius wins over a nearer small one
+    assert server.nearest_airport(50.3, 10.0)["code"] == "LRG"
+    assert server.nearest_airport(50.38, 10.0)["code"] == "SML"
+    assert server.nearest_airport(50.45, 10.0) is None
+    assert server.nearest_airport(49.7, 10.0)["code"] == "LRG"
+    assert server.nearest_airport(60.0, 10.0) is None
+    assert server.nearest_airport(40.2, 10.0)["code"] == "UNK"
+    assert server.nearest_airport(40.3, 10.0) is None
+    server.set_airport_index({})
+    assert server.nearest_airport(50.0, 10.0) is None
+
+
+def test_snapshot_dedup_and_rate_limit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    monkeypatch.setattr(server, "STATS_PATH", data_dir / "routes_stats.json")
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    monkeypatch.setattr(server, "CONFIG_PATH", data_dir / "config.json")
+    monkeypatch.setattr(server, "update_airports", lambda: {})
+    monkeypatch.setattr(server, "INGEST_STATE", {"interval": 10.0, "retry_at": 0.0})
+    monkeypatch.setattr(server, "POLL_INTERVAL", 10.0)
+    monkeypatch.setattr(server, "POLL_MAX_INTERVAL", 30.0)
+    airports = [{"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"}]
+    (data_dir / "airports_full.json").write_text(json.dumps(airports))
+
+    state = ["abc", "AL123 ", "", 0, 0, 20.0, 10.0]
+    limited = fake_response(None)
+    limited.status_code = 429
+    limited.headers = {"X-Rate-Limit-Retry-After-Seconds": "120"}
+    responses = iter([
+        fake_response({"time": 100, "states": [state]}),
+        fake_response({"time": 100, "states": [state]}),
+        fake_response({"time": 90, "states": []}),
+        limited,
+        fake_response({"time": 110, "states": [state]}),
+    ])
+    calls = []
+
+    def fake_get(url):
+        calls.append(url)
+        return next(responses)
+
+    monkeypatch.setattr(server.requests, "get", fake_get)
+    result = server.update_routes()
+    assert result["status"] == "updated" and result["next_poll_in"] == 10.0
+    mtime = server.STATS_PATH.stat().st_mtime_ns
+
+    assert server.update_routes() == {"status": "unchanged", "snapshot": 100, "next_poll_in": 20.0}
+    assert server.update_routes()["next_poll_in"] == 30.0
+    assert server.STATS_PATH.stat().st_mtime_ns == mtime
+
+    assert server.update_routes() == {"status": "rate_limited", "next_poll_in": 120.0}
+    assert server.update_routes()["status"] == "rate_limited"
+    assert len(calls) == 4
+
+    server.INGEST_STATE["retry_at"] = 0.0
+    result = server.update_routes()
+    assert result["status"] == "updated" and result["snapshot"] == 110
+    assert json.loads(server.STATS_PATH.read_text())["last_snapshot"] == 110
+
+
+def test_unresolved_aircraft_skip_lookups(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    monkeypatch.setattr(server, "STATS_PATH", data_dir / "routes_stats.json")
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    monkeypatch.setattr(server, "CONFIG_PATH", data_dir / "config.json")
+    monkeypatch.setattr(server, "update_airports", lambda: {})
+    monkeypatch.setattr(server, "UNRESOLVED", server.UnresolvedTracker(ttl=1000))
+    airports = [{"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"}]
+    (data_dir / "airports_full.json").write_text(json.dumps(airports))
+
+    def state(icao24, lat, lon, altitude, on_ground=False):
+        return [icao24, "AL1 ", "", 0, 0, lon, lat, altitude, on_ground]
+
+    snapshots = iter([
+        # cruising, low but out of match range (inside coverage), departing
+        [state("cru", 10.4, 20, 11000), state("low", 10.4, 20, 900), state("dep", 10, 20, 300)],
+        [state("cru", 10.4, 20.05, 11000), state("low", 10.4, 20.05, 800), state("dep", 10.1, 20.1, 900)],
+        # "low" lands somewhere unindexed, "cru" keeps cruising
+        [state("cru", 10.4, 20.1, 11000), state("low", 10.4, 20.08, 0, True), state("dep", 10.2, 20.2, 1500)],
+    ])
+    monkeypatch.setattr(server.requests, "get", lambda url: fake_response({"states": next(snapshots)}))
+    lookups = []
+    real_nearest = server.AirportIndex.nearest
+
+    def counting_nearest(self, lat, lon):
+        lookups.append((lat, lon))
+        return real_nearest(self, lat, lon)
+
+    monkeypatch.setattr(server.AirportIndex, "nearest", counting_nearest)
+
+    server.update_routes()
+    assert len(lookups) == 2  # "low" and "dep"; "cru" is skipped outright
+    assert set(server.UNRESOLVED.entries) == {"cru", "low"}
+    active = json.loads((data_dir / "active_planes.json").read_text())
+    assert list(active) == ["dep"]
+
+    lookups.clear()
+    server.update_routes()
+    assert lookups == []
+
+    server.update_routes()
+    assert lookups == [(10.4, 20.08)]  # landed, so resolved once more
+    assert server.UNRESOLVED.entries["low"][1] is True
+
+    tracker = server.UnresolvedTracker(ttl=10)
+    tracker.entries = {"gone": (100, False), "old": (5, False)}
+    kept = tracker.select([state("old", 1, 1, 500)], {}, now=50)
+    assert [s[0] for s in kept] == ["old"] and tracker.entries == {}
+
+
+def test_trail_store():
+    store = server.TrailStore(capacity=4, min_km=5)
+    store.append("abc", 0.0, 0.0)
+    store.append("abc", 0.0, 0.01)
+    store.append("abc", 0.0, 0.02)  # last point still within 5 km: moved
+    assert len(store.get("abc")) == 2
+    store.append("abc", 0.0, 1.0)
+    assert store.get("abc") == [[0.0, 0.0], [0.0, 1.0]]
+    store.append("abc", 0.0, 2.0)
+    store.append("abc", 1.0, 3.0)
+    store.append("abc", 2.0, 3.0)  # full: the straight-line middle point goes
+    assert store.get("abc") == [[0.0, 0.0], [0.0, 2.0], [1.0, 3.0], [2.0, 3.0]]
+    assert store.points["abc"].shape == (4, 2)
+    store.retain({"other"})
+    assert store.get("abc") == []
+
+    # Reads stay safe while ingestion appends and drops trails
+    import threading
+
+    stop = threading.Event()
+
+    def churn():
+        while not stop.is_set():
+            store.append("abc", 0.0, 1.0)
+            store.drop("abc")
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(20000):
+            assert store.get("abc") in ([], [[0.0, 1.0]])
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_active_plane_trail(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTES_DB_PATH", data_dir / "routes_dynamic.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+    monkeypatch.setattr(server, "STATS_PATH", data_dir / "routes_stats.json")
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    monkeypatch.setattr(server, "CONFIG_PATH", data_dir / "config.json")
+    monkeypatch.setattr(server, "update_airports", lambda: {})
+    monkeypatch.setattr(server, "TRAILS", server.TrailStore())
+    airports = [
+        {"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"},
+        {"code": "BBB", "name": "B", "lat": 12, "lon": 22, "continent": "EU"},
+    ]
+    (data_dir / "airports_full.json").write_text(json.dumps(airports))
+    snapshots = iter([
+        [["abc", "AL1 ", "", 0, 0, 20.0, 10.0]],
+        [["abc", "AL1 ", "", 0, 0, 21.0, 11.0]],
+        [["abc", "AL1 ", "", 0, 0, 22.0, 12.0]],
+        [],
+    ])
+    monkeypatch.setattr(server.requests, "get", lambda url: fake_response({"states": next(snapshots)}))
+
+    client = TestClient(server.app)
+    for _ in range(3):
+        server.update_routes()
+    body = client.get("/active-planes/abc/trail").json()
+    assert body == {"icao24": "abc", "trail": [[10.0, 20.0], [11.0, 21.0], [12.0, 22.0]]}
+
+    server.update_routes()
+    routes = json.loads((data_dir / "routes_dynamic.json").read_text())
+    assert [(r["source"], r["destination"]) for r in routes] == [("AAA", "BBB")]
+    assert client.get("/active-planes/abc/trail").status_code == 404
+
+
+def test_route_analytics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTE_ANALYTICS_PATH", data_dir / "route_analytics.json")
+    airports = {
+        "AAA": {"code": "AAA", "lat": 0.0, "lon": 0.0},
+        "BBB": {"code": "BBB", "lat": 0.0, "lon": 10.0},
+        "CCC": {"code": "CCC", "lat": 0.0, "lon": 1.0},
+    }
+    routes = [
+        {"airline": "AL", "flight_number": "1", "source": "AAA", "destination": "BBB", "duration_min": 80.0},
+        {"airline": "AL", "flight_number": "2", "source": "AAA", "destination": "CCC", "duration_min": 20.0},
+        {"airline": "BT", "flight_number": "3", "source": "CCC", "destination": "BBB"},
+        {"airline": "BT", "flight_number": "4", "source": "CCC", "destination": "ZZZ"},
+    ]
+    freq = server.RouteFrequency()
+    freq.record_many({("BT", "3", "CCC", "BBB"): 5, ("AL", "1", "AAA", "BBB"): 2}, 739000)
+
+    analytics = server.build_route_analytics(routes, airports, freq)
+    assert [r.get("distance_km") for r in routes] == [1111.9, 111.2, 1000.8, None]
+    assert analytics["distance_km"] == {
+        "measured": 3, "total": 2223.9, "mean": 741.3, "median": 1000.8, "max": 1111.9,
+    }
+    assert analytics["duration_min"] == {"observed": 2, "mean": 50.0, "median": 50.0}
+    assert analytics["length_histogram"]["counts"][:3] == [1, 0, 2]
+    assert analytics["airlines"][0] == {
+        "airline": "AL", "routes": 2, "distance_km": 1223.1, "mean_duration_min": 50.0, "observations": 2,
+    }
+    assert [r["flight_number"] for r in analytics["longest"]] == ["1", "3", "2"]
+    assert [(r["flight_number"], r["observations"]) for r in analytics["busiest"]] == [("3", 5), ("1", 2)]
+
+    server.write_json(server.ROUTE_ANALYTICS_PATH, analytics)
+    client = TestClient(server.app)
+    body = client.get("/stats/routes", params={"airline": "BT", "top": 1}).json()
+    assert body["airlines"] == [analytics["airlines"][1]]
+    assert body["longest"] == analytics["longest"][:1]
+    assert server.flight_minutes("2025-01-01T10:00:00Z", "2025-01-01T11:30:00Z") == 90.0
+
+
+def sbs(kind, icao24, callsign="", altitude="", lat="", lon="", ground=""):
+    fields = ["MSG", str(kind), "1", "1", icao24, "1", "2025/01/01", "12:00:00.000",
+              "2025/01/01", "12:00:00.000", callsign, str(altitude), "", "",
+              str(lat), str(lon), "", "", "", "", "", ground]
+    return ",".join(fields)
+
+
+def test_parse_sbs():
+    assert server.parse_sbs(sbs(1, "4CA2D6", callsign="RYR456  ")) == {"icao24": "4ca2d6", "callsign": "RYR456"}
+    msg = server.parse_sbs(sbs(3, "4ca2d6", altitude=1000, lat=10.0, lon=20.0, ground="0") + "\r\n")
+    assert msg == {"icao24": "4ca2d6", "altitude": 304.8, "lat": 10.0, "lon": 20.0, "on_ground": False}
+    assert server.parse_sbs(sbs(2, "4ca2d6", lat=10.0, lon=20.0, ground="-1"))["on_ground"] is True
+    assert server.parse_sbs("STA,,5,179,400AE7,10103,2008/11/28,14:58:51.153,2008/11/28,14:58:51.153,RM") is None
+    assert server.parse_sbs(sbs(3, "4ca2d6", lat="x", lon=20.0)) is None
+
+
+def test_stream_ingester_replay(tmp_path, monkeypatch):
+    """Messages from a local SBS replay server drive tracking and finalization."""
+    import socket
+    import threading
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "update_airports", lambda: {})
+    monkeypatch.setattr(server, "TRAILS", server.TrailStore())
+    airports = [
+        {"code": "AAA", "name": "A", "lat": 10, "lon": 20, "continent": "EU"},
+        {"code": "BBB", "name": "B", "lat": 30, "lon": 40, "continent": "EU"},
+    ]
+    Path(server.AIRPORTS_FULL_PATH).write_text(json.dumps(airports))
+
+    replay = [
+        sbs(1, "abc123", callsign="AL123"),
+        sbs(2, "abc123", lat=10.0, lon=20.0, ground="-1"),
+        sbs(3, "def456", callsign="HI1", altitude=35000, lat=20.0, lon=30.0, ground="0"),
+        sbs(3, "abc123", altitude=10000, lat=20.0, lon=30.0, ground="0"),
+        sbs(3, "abc123", altitude=2000, lat=30.0, lon=40.0, ground="0"),
+    ]
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            # Split a line across writes, as TCP may
+            payload = ("\r\n".join(replay) + "\r\n").encode()
+            conn.sendall(payload[:30])
+            conn.sendall(payload[30:])
+
+    threading.Thread(target=serve, daemon=True).start()
+    feed = server.SbsFeed("127.0.0.1", listener.getsockname()[1])
+    ingester = server.StreamIngester(feed, timeout=300, flush_interval=10)
+    ingester.resume()
+    t0 = time.time()
+    for i, msg in enumerate(m for m in feed.messages() if m):
+        ingester.observe(msg, t0 + i)
+    listener.close()
+    assert ingester.messages == 5
+
+    # The cruising aircraft is never looked up; the other one is tracked
+    assert set(ingester.active) == {"abc123"}
+    assert "def456" in ingester.unresolved.entries
+    af = ingester.active["abc123"]
+    assert af["origin"] == "AAA" and af["callsign"] == "AL123" and af["last_coord"] == [30.0, 40.0]
+    assert server.TRAILS.get("abc123")[-1] == [30.0, 40.0]
+
+    assert ingester.flush(t0 + 60) == {"routes": 0, "active": 1, "finished": 0}
+    assert set(json.loads(server.ACTIVE_PLANES_PATH.read_text())) == {"abc123"}
+
+    # Silence past the timeout finishes the flight at the nearest airport
+    assert ingester.flush(t0 + 400) == {"routes": 1, "active": 0, "finished": 1}
+    routes = json.loads(server.ROUTES_DB_PATH.read_text())
+    assert [(r["airline"], r["source"], r["destination"]) for r in routes] == [("AL", "AAA", "BBB")]
+    # Dated by the last message heard, not by when the flight was finalized
+    last_heard = datetime.utcfromtimestamp(t0 + 4).isoformat() + "Z"
+    assert routes[0]["last_seen"] == routes[0]["first_seen"] == last_heard
+    assert routes[0]["duration_min"] < 1
+    assert ingester.aircraft == {} and ingester.unresolved.entries == {}
+    assert server.TRAILS.get("abc123") == []
+    stats = json.loads(server.STATS_PATH.read_text())
+    assert stats["feed_messages"] == 5 and stats["active_planes"] == 0
+
+    # Polling stays out of the way while a stream is running
+    monkeypatch.setattr(server, "STREAM", ingester)
+    assert server.update_routes()["status"] == "streaming"
+
+
+def test_stream_run_errors(monkeypatch, caplog):
+    import threading
+
+    import pytest
+
+    with pytest.raises(TypeError):
+        server.FeedAdapter()
+
+    stop = threading.Event()
+
+    class BrokenFeed(server.FeedAdapter):
+        calls = 0
+
+        def messages(self):
+            BrokenFeed.calls += 1
+            if BrokenFeed.calls == 1:
+                raise ConnectionRefusedError("refused")
+            stop.set()
+            yield {"icao24": "abc"}
+
+    ingester = server.StreamIngester(BrokenFeed(), flush_interval=3600)
+    monkeypatch.setattr(ingester, "observe", lambda msg, ts: 1 / 0)
+    monkeypatch.setattr(stop, "wait", lambda delay: None)
+    with caplog.at_level("WARNING", logger="server"):
+        ingester.run(stop)
+    assert "feed connection failed: refused" in caplog.text
+    assert "ZeroDivisionError" in caplog.text
+
+    # An unknown feed is rejected at startup instead of falling back to polling
+    monkeypatch.setattr(server, "FEED", "nope")
+    with pytest.raises(ValueError, match="unknown FEED"):
+        with TestClient(server.app):
+            pass
@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import httpx
+
+import sys
+from pathlib import Path as SysPath
+sys.path.insert(0, str(SysPath(__file__).resolve().parents[1]))
+import server
+import loadtest
+
+
+def test_percentile():
+    samples = sorted(float(i) for i in range(1, 101))
+    assert loadtest.percentile(samples, 50) == 50.0
+    assert loadtest.percentile(samples, 99) == 99.0
+    assert loadtest.percentile([], 95) == 0.0
+
+
+def test_run_load_with_ingestion(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    for name, attr in [
+        ("airports.json", "AIRPORTS_PATH"),
+        ("airports_full.json", "AIRPORTS_FULL_PATH"),
+        ("routes_dynamic.json", "ROUTES_DB_PATH"),
+        ("active_planes.json", "ACTIVE_PLANES_PATH"),
+        ("routes_stats.json", "STATS_PATH"),
+        ("config.json", "CONFIG_PATH"),
+        ("routes_frequency.json", "ROUTE_FREQUENCY_PATH"),
+        ("route_geometry.json", "ROUTE_GEOMETRY_PATH"),
+    ]:
+        monkeypatch.setattr(server, attr, data_dir / name)
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    airports = loadtest.synthetic_airports(50)
+    monkeypatch.setattr(server.requests, "get", loadtest.FakeFeeds(airports, 40))
+    (data_dir / "airports_full.json").write_text(json.dumps(airports))
+    server.update_routes()
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await loadtest.run_load(client, clients=3, duration=0.5, think=0.01, ingest_interval=0.05)
+
+    rows = asyncio.run(run()).report()
+    # Let queued ingestion jobs finish before the patched paths are restored
+    for job_id in list(server.JOBS):
+        server.wait_for_job(job_id)
+    assert rows["total"]["requests"] > 0
+    assert rows["total"]["errors"] == 0
+    assert rows["POST /update-routes"]["requests"] >= 1
+    assert rows["total"]["p50_ms"] <= rows["total"]["p95_ms"] <= rows["total"]["p99_ms"]
+    assert "GET /active-planes" in loadtest.format_report(rows)
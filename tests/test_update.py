@@ -18,6 +18,17 @@ def fake_response(text):
     mock.raise_for_status = lambda: None
     return mock
 
+def run_update(client, url="/update-airports"):
+    """Queue an update job and wait for it to finish."""
+    resp = client.post(url)
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+    server.wait_for_job(job_id)
+    resp = client.get(f"/admin/jobs/{job_id}")
+    assert resp.json()["status"] == "done", resp.json()
+    return resp
+
+
 
 def test_update_airports(tmp_path, monkeypatch):
     airports_csv = (
@@ -78,7 +89,7 @@ def test_update_airports(tmp_path, monkeypatch):
     (data_dir / "routes_dynamic.json").write_text(json.dumps(routes))
 
     client = TestClient(server.app)
-    resp = client.post("/update-airports")
+    resp = run_update(client)
     assert resp.status_code == 200
 
     data = json.loads((data_dir / "airports.json").read_text())
@@ -90,6 +101,7 @@ def test_update_airports(tmp_path, monkeypatch):
     assert len(a_bbb["routes"]) == 1
     assert a_aaa["routes"][0]["airline"] == "Test Airline"
     assert a_aaa["routes"][0]["flight_number"] == "123"
+    assert a_aaa["routes"][0]["to_code"] == "BBB"
     assert a_bbb["routes"][0]["to_name"] == "AirportA"
     assert a_aaa["country_code"] == "AA"
     assert a_aaa["country"] == "Country AA"
@@ -104,6 +116,25 @@ def test_update_airports(tmp_path, monkeypatch):
     info = TestClient(server.app).get("/info").json()
     assert info["active_airports"] == 2
 
+    assert a_aaa["municipality"] == "CityA" and a_aaa["iata"] == "AAA"
+    body = client.get("/airports/search", params={"q": "city"}).json()
+    assert [r["code"] for r in body["results"]] == ["AAA", "BBB"]
+
+    # Ingestion refreshes the airports from the stored tables, throttled
+    monkeypatch.setattr(server.requests, "get", Mock(side_effect=AssertionError("no downloads")))
+    monkeypatch.setattr(server, "AIRPORTS_STATE", {"stale": False, "materialized": 0.0})
+    monkeypatch.setattr(server, "AIRPORTS_REFRESH_INTERVAL", 60)
+    assert server.refresh_airports() is None
+    routes[0]["flight_number"] = "456"
+    server.write_json(server.ROUTES_DB_PATH, routes[:1])
+    server.AIRPORTS_STATE["stale"] = True
+    assert server.refresh_airports()["routes"] == 1
+    data = json.loads((data_dir / "airports.json").read_text())
+    assert data[0]["routes"][0]["flight_number"] == "456"
+    assert data[0]["routes"][0]["airline"] == "Test Airline"
+    server.AIRPORTS_STATE["stale"] = True
+    assert server.refresh_airports() is None
+
 
 def test_update_airports_no_routes(tmp_path, monkeypatch):
     """When no routes exist, all airports should be kept."""
@@ -144,7 +175,7 @@ def test_update_airports_no_routes(tmp_path, monkeypatch):
     (data_dir / "routes_dynamic.json").write_text("[]")
 
     client = TestClient(server.app)
-    resp = client.post("/update-airports")
+    resp = run_update(client)
     assert resp.status_code == 200
 
     data = json.loads((data_dir / "airports.json").read_text())
@@ -219,7 +250,7 @@ def test_update_airports_self_clean(tmp_path, monkeypatch):
     (data_dir / "routes_dynamic.json").write_text(json.dumps(routes))
 
     client = TestClient(server.app)
-    resp = client.post("/update-airports")
+    resp = run_update(client)
     assert resp.status_code == 200
 
     data = json.loads((data_dir / "airports.json").read_text())
@@ -250,3 +281,151 @@ def test_get_airports_missing(tmp_path, monkeypatch):
     client = TestClient(server.app)
     resp = client.get("/airports.json")
     assert resp.status_code == 404
+
+
+def test_great_circle_paths():
+    short, pacific = server.great_circle_paths([[10, 20, 10.1, 20.1], [35.5, 139.8, 37.6, -122.4]])
+    assert short == [[[10.0, 20.0], [10.1, 20.1]]]
+
+    # Tokyo -> San Francisco crosses the antimeridian and is split there
+    assert len(pacific) == 2
+    assert pacific[0][0] == [35.5, 139.8]
+    assert pacific[0][-1][1] == 180.0
+    assert pacific[1][0][1] == -180.0
+    assert pacific[1][-1] == [37.6, -122.4]
+    assert pacific[0][-1][0] == pacific[1][0][0]
+    # Long-haul routes are sampled densely and bend north of both endpoints
+    points = pacific[0] + pacific[1]
+    assert len(points) > 20
+    assert max(p[0] for p in points) > 45
+
+
+def test_route_geometry_endpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "ROUTE_GEOMETRY_PATH", data_dir / "route_geometry.json")
+    airports = {
+        "AAA": {"code": "AAA", "lat": 10, "lon": 20},
+        "BBB": {"code": "BBB", "lat": 30, "lon": 40},
+    }
+    routes = [
+        {"airline": "AL", "source": "BBB", "destination": "AAA"},
+        {"airline": "BT", "source": "AAA", "destination": "BBB"},
+    ]
+    # The cache only holds the pairs of the latest build
+    server.build_route_geometry({**airports, "CCC": {"code": "CCC", "lat": 0, "lon": 0}},
+                                [{"source": "AAA", "destination": "CCC"}])
+    geometry = server.build_route_geometry(airports, routes)
+    assert list(geometry) == ["AAA|BBB"]
+    assert [k[:2] for k in server.GEOMETRY_CACHE] == [("AAA", "BBB")]
+    server.write_json(server.ROUTE_GEOMETRY_PATH, geometry)
+
+    client = TestClient(server.app)
+    body = client.get("/routes/geometry", params=[("airport", "AAA"), ("airport", "BBB")]).json()
+    assert body["AAA"]["BBB"][0][0] == [10.0, 20.0]
+    assert body["BBB"]["AAA"][0][0] == [30.0, 40.0]
+    assert body["BBB"]["AAA"][0][-1] == [10.0, 20.0]
+
+
+def test_airport_search(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "AIRPORTS_FULL_PATH", data_dir / "airports_full.json")
+    monkeypatch.setattr(server.AirportSearch, "SCAN_LIMIT", 2)
+    airports = [
+        {"code": "LHR", "iata": "LHR", "icao": "EGLL", "name": "London Heathrow Airport",
+         "municipality": "London", "country": "United Kingdom", "routes": [{}, {}]},
+        {"code": "LGW", "iata": "LGW", "icao": "EGKK", "name": "London Gatwick Airport",
+         "municipality": "London", "country": "United Kingdom", "routes": [{}]},
+        {"code": "ZRH", "name": "Zürich Airport", "municipality": "Zürich", "country": "Switzerland"},
+        {"code": "LZH", "name": "Liuzhou Bailian Airport", "municipality": "Liuzhou", "country": "China"},
+        {"code": "ELN", "name": "Bowers Field", "municipality": "Ellensburg", "country": "United States"},
+    ]
+    server.write_json(server.AIRPORTS_FULL_PATH, airports)
+
+    client = TestClient(server.app)
+
+    def codes(q, **params):
+        body = client.get("/airports/search", params={"q": q, **params}).json()
+        return [r["code"] for r in body["results"]]
+
+    assert codes("egll") == ["LHR"]
+    assert codes("l") == ["LHR", "LGW", "LZH"]
+    assert codes("lon") == ["LHR", "LGW"]
+    assert codes("zur") == ["ZRH"]
+    assert codes("london gat") == ["LGW"]
+    assert codes("airport", limit=2) == ["LHR", "LGW"]
+    assert codes("united") == ["LHR", "LGW", "ELN"]
+    assert codes("  ") == []
+
+    # Word order does not matter, including when a common word's ranking
+    # is precomputed and the walk has to stop early
+    monkeypatch.setattr(server.AirportSearch, "WALK_CHUNK", 1)
+    server.write_json(server.AIRPORTS_FULL_PATH, airports[::-1])
+    assert codes("airport zur") == ["ZRH"]
+    assert codes("zur airport") == ["ZRH"]
+    assert codes("airport liu") == codes("liu airport") == ["LZH"]
+    assert codes("airport london", limit=1) == ["LHR"]
+    assert codes("united kingdom air") == ["LHR", "LGW"]
+
+
+def test_facets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "public").mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "AIRPORTS_PATH", data_dir / "airports.json")
+    monkeypatch.setattr(server, "ACTIVE_PLANES_PATH", data_dir / "active_planes.json")
+
+    def route(code, name, to):
+        return {"airline": name, "airline_code": code, "to_code": to}
+
+    airports = [
+        {"code": "AAA", "country_code": "AA", "country": "Country AA",
+         "routes": [route("AL", "Alpha", "BBB"), route("AL", "Alpha", "CCC"), route("BT", "Beta", "BBB")]},
+        {"code": "BBB", "country_code": "BB", "country": "Country BB",
+         "routes": [route("AL", "Alpha", "AAA"), route("BT", "Beta", "AAA")]},
+        {"code": "CCC", "country_code": "BB", "country": "Country BB",
+         "routes": [route("AL", "Alpha", "AAA")]},
+    ]
+    server.write_json(server.AIRPORTS_PATH, airports)
+    server.write_json(server.ACTIVE_PLANES_PATH, {
+        "abc": {"airline": "AL"}, "def": {"airline": "BT"}, "ghi": {"airline": "AL"},
+    })
+
+    client = TestClient(server.app)
+    body = client.get("/facets").json()
+    assert body["airports"] == {"AAA": 3, "BBB": 2, "CCC": 1}
+    assert body["airlines"] == [
+        {"code": "AL", "name": "Alpha", "routes": 4},
+        {"code": "BT", "name": "Beta", "routes": 2},
+    ]
+    assert body["countries"] == [
+        {"code": "AA", "name": "Country AA", "airports": 1},
+        {"code": "BB", "name": "Country BB", "airports": 2},
+    ]
+    assert "active" not in body
+
+    body = client.get("/facets", params={"airline": "Beta"}).json()
+    assert body["airline"] == "BT"
+    assert body["airports"] == {"AAA": 1, "BBB": 1}
+    assert body["active"] == ["def"]
+
+    body = client.get("/facets", params={"airline": "AL", "country": "BB"}).json()
+    assert body["airports"] == {"BBB": 1, "CCC": 1}
+    assert body["airlines"] == [
+        {"code": "AL", "name": "Alpha", "routes": 2},
+        {"code": "BT", "name": "Beta", "routes": 1},
+    ]
+    assert body["countries"] == [
+        {"code": "AA", "name": "Country AA", "airports": 1},
+        {"code": "BB", "name": "Country BB", "airports": 2},
+    ]
+    assert sorted(body["active"]) == ["abc", "ghi"]